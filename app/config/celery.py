@@ -7,3 +7,7 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 app = Celery("idis")
 app.config_from_object("django.conf:settings", namespace="CELERY_")
 app.autodiscover_tasks()
+
+# time tasks in every worker and publisher, and profile a sample of them
+import idis.core.profiling  # noqa: E402, F401
+import idis.core.taskmetrics  # noqa: E402, F401
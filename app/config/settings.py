@@ -47,6 +47,8 @@ DATABASES = {
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD", "secretpassword"),
         "HOST": os.environ.get("POSTGRES_HOST", "postgres"),
         "PORT": "",
+        # Keep connections open between requests and celery tasks
+        "CONN_MAX_AGE": int(os.environ.get("POSTGRES_CONN_MAX_AGE", "60")),
     }
 }
 
@@ -119,12 +121,10 @@ EVALUATION_FILES_SUBDIRECTORY = "evaluation"
 
 CACHES = {
     "default": {
-        "BACKEND": "speedinfo.backends.proxy_cache",
-        "CACHE_BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
         "LOCATION": "memcached:11211",
     }
 }
-SPEEDINFO_STORAGE = "speedinfo.storage.cache.storage.CacheStorage"
 
 ROOT_URLCONF = "config.urls"
 DEFAULT_SCHEME = os.environ.get("DEFAULT_SCHEME", "https")
@@ -225,8 +225,8 @@ MIDDLEWARE = (
     # subdomain_middleware after CurrentSiteMiddleware
     # Flatpage fallback almost last
     "django.contrib.flatpages.middleware.FlatpageFallbackMiddleware",
-    # speedinfo at the end but before FetchFromCacheMiddleware
-    "speedinfo.middleware.ProfilerMiddleware",
+    # profiles a fraction of requests, see PROFILING_SAMPLE_RATE
+    "idis.core.profiling.SamplingProfilerMiddleware",
 )
 
 # Python dotted path to the WSGI application used by Django's runserver.
@@ -263,7 +263,6 @@ THIRD_PARTY_APPS = [
     "django_extensions",  # custom extensions
     "simple_history",  # for object history
     "corsheaders",  # to allow api communication from subdomains
-    "speedinfo",  # for profiling views
     "drf_yasg",
     "markdownx",  # for editing markdown
 ]
@@ -398,10 +397,31 @@ CONTAINER_EXEC_DOCKER_RUNTIME = os.environ.get(
     "CONTAINER_EXEC_DOCKER_RUNTIME", None
 )
 
+# Seconds between pipeline runs started by celery beat
+PIPELINE_RUN_INTERVAL = int(os.environ.get("PIPELINE_RUN_INTERVAL", "30"))
+# Seconds between trash purges started by celery beat. A purge stops after this
+# time, and the next one continues
+PIPELINE_TRASH_PURGE_INTERVAL = int(
+    os.environ.get("PIPELINE_TRASH_PURGE_INTERVAL", "60")
+)
+# Seconds between counts of the studies and files in each pipeline stage for
+# metrics, started by celery beat
+PIPELINE_STAGE_METRICS_INTERVAL = int(
+    os.environ.get("PIPELINE_STAGE_METRICS_INTERVAL", "300")
+)
+
 CELERY_BEAT_SCHEDULE = {
     "run_celery_test": {
         "task": "idis.pipeline.tasks.run_pipeline_once",
-        "schedule": timedelta(seconds=30),
+        "schedule": timedelta(seconds=PIPELINE_RUN_INTERVAL),
+    },
+    "purge_trash": {
+        "task": "idis.pipeline.tasks.purge_trash",
+        "schedule": timedelta(seconds=PIPELINE_TRASH_PURGE_INTERVAL),
+    },
+    "record_stage_sizes": {
+        "task": "idis.pipeline.tasks.record_stage_sizes",
+        "schedule": timedelta(seconds=PIPELINE_STAGE_METRICS_INTERVAL),
     },
 }
 
@@ -426,6 +446,21 @@ IDIS_PRE_FETCHING_FOLDER = os.environ.get(
     "IDIS_PRE_FETCHING_FOLDER", "/tmp/ctp/pre_fetching"
 )
 
+# The output of finished jobs is kept here. Used for re-using output when the
+# same job is submitted again
+IDIS_RESULTS_FOLDER = os.environ.get("IDIS_RESULTS_FOLDER", "/tmp/ctp/results")
+
+# Retrying files that failed. Delay doubles after each failed attempt
+IDIS_FILE_RETRY_BASE_DELAY = int(
+    os.environ.get("IDIS_FILE_RETRY_BASE_DELAY", "30")
+)  # seconds
+IDIS_FILE_RETRY_MAX_DELAY = int(
+    os.environ.get("IDIS_FILE_RETRY_MAX_DELAY", "3600")
+)  # seconds
+IDIS_FILE_RETRY_MAX_ATTEMPTS = int(
+    os.environ.get("IDIS_FILE_RETRY_MAX_ATTEMPTS", "5")
+)
+
 ##############################################################################
 #
 # pipeline app
@@ -443,8 +478,45 @@ PIPELINE_IDIS_WEB_API_SERVER_NAME = os.environ.get(
 PIPELINE_IDIS_WEB_API_SERVER_URL = os.environ.get(
     "PIPELINE_IDIS_WEB_API_SERVER_URL", "https://umcradanonp11.umcn.nl/p01"
 )
-
-# Holds IDIS job ids
+# Spread new IDIS jobs over these servers. Comma separated name=url pairs.
+# Defaults to the single server above
+PIPELINE_IDIS_WEB_API_SERVERS = [
+    tuple(x.strip().split("=", 1))
+    for x in os.environ.get(
+        "PIPELINE_IDIS_WEB_API_SERVERS",
+        f"{PIPELINE_IDIS_WEB_API_SERVER_NAME}="
+        f"{PIPELINE_IDIS_WEB_API_SERVER_URL}",
+    ).split(",")
+    if x.strip()
+]
+# Seconds before an unreachable IDIS server is tried again. Doubles with each
+# failure in a row
+PIPELINE_IDIS_SERVER_RETRY_INTERVAL = int(
+    os.environ.get("PIPELINE_IDIS_SERVER_RETRY_INTERVAL", "60")
+)
+# Make at most this many IDIS web API calls to a single server at the same time
+PIPELINE_IDIS_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("PIPELINE_IDIS_MAX_CONCURRENT_REQUESTS", "8")
+)
+# Have at most this many jobs in flight on a single IDIS server. Further
+# studies wait in cooled_down. 0 for no limit
+PIPELINE_IDIS_SERVER_MAX_IN_FLIGHT = int(
+    os.environ.get("PIPELINE_IDIS_SERVER_MAX_IN_FLIGHT", "100")
+)
+# Have at most this many jobs in flight for a single stream, unless set on the
+# stream itself. 0 for no limit
+PIPELINE_STREAM_MAX_IN_FLIGHT = int(
+    os.environ.get("PIPELINE_STREAM_MAX_IN_FLIGHT", "0")
+)
+# Check the status of a pending IDIS job at least every this many seconds.
+# Recently created jobs are checked more often
+PIPELINE_STATUS_POLL_MAX_INTERVAL = int(
+    os.environ.get("PIPELINE_STATUS_POLL_MAX_INTERVAL", "300")
+)
+
+# Holds IDIS job ids. Any sqlalchemy database url, or 'django://' to use the
+# main database. Run 'manage.py import_records' before switching to django://,
+# or the jobs of studies that are pending are lost
 PIPELINE_RECORDS_DB_URL = os.environ.get(
     "PIPELINE_RECORDS_DB_URL",
     "sqlite:////" + PIPELINE_BASE_PATH + "/records_db.sqlite",
@@ -455,6 +527,108 @@ PIPELINE_RECORDS_DB_URL = os.environ.get(
 PIPELINE_LOCAL_PATH = os.environ.get("PIPELINE_LOCAL_PATH", "/")
 PIPELINE_UNC_PATH = os.environ.get("PIPELINE_UNC_PATH", r"\\server\share")
 
+# Pipeline runs lock each other out through this server. redis:// to lock
+# across all workers, memory:// to lock within a single process only. Other
+# urls are refused on start, so set this when the broker is not redis
+PIPELINE_LOCK_URL = os.environ.get("PIPELINE_LOCK_URL", CELERY_BROKER_URL)
+# Release a lock held by a crashed worker after this many seconds
+PIPELINE_LOCK_TIMEOUT = int(
+    os.environ.get("PIPELINE_LOCK_TIMEOUT", str(CELERY_TASK_TIME_LIMIT))
+)
+# The watch_incoming command pushes on a study in incoming when no files have
+# been written to it for this many seconds. Defaults to the cool down of the
+# incoming stage
+PIPELINE_WATCHER_QUIET_PERIOD = int(
+    os.environ.get("PIPELINE_WATCHER_QUIET_PERIOD", "300")
+)
+# Seconds between checks for studies that have become quiet. When inotify is
+# not available, also the interval for scanning incoming folders
+PIPELINE_WATCHER_POLL_INTERVAL = int(
+    os.environ.get("PIPELINE_WATCHER_POLL_INTERVAL", "5")
+)
+# When the pipeline is empty, skip runs for at most this many seconds. Runs
+# are only skipped while the watch_incoming command is running
+PIPELINE_MAX_IDLE_BACKOFF = int(
+    os.environ.get("PIPELINE_MAX_IDLE_BACKOFF", "300")
+)
+# Run each stream in its own celery task, so that streams do not wait for
+# each other. Tasks go to the queue set on each stream, if any
+PIPELINE_PER_STREAM = strtobool(os.environ.get("PIPELINE_PER_STREAM", "False"))
+# When work is left after a run, queue at most this many runs in a row
+# without waiting for celery beat
+PIPELINE_MAX_IMMEDIATE_RERUNS = int(
+    os.environ.get("PIPELINE_MAX_IMMEDIATE_RERUNS", "10")
+)
+# Delete at most this many files, and reclaim at most this many bytes, per
+# second when purging the trash stage. 0 for no limit
+PIPELINE_TRASH_PURGE_FILES_PER_SECOND = int(
+    os.environ.get("PIPELINE_TRASH_PURGE_FILES_PER_SECOND", "0")
+)
+PIPELINE_TRASH_PURGE_BYTES_PER_SECOND = int(
+    os.environ.get("PIPELINE_TRASH_PURGE_BYTES_PER_SECOND", str(50 * 2 ** 20))
+)
+# Move loose DICOM files in incoming stream folders into a folder per study,
+# based on their StudyInstanceUID. Off by default, turn on for modalities that
+# send loose files
+PIPELINE_GROUP_LOOSE_FILES = strtobool(
+    os.environ.get("PIPELINE_GROUP_LOOSE_FILES", "False")
+)
+# Leave loose files alone that have been written to in the last this many
+# seconds
+PIPELINE_GROUPING_MIN_AGE = int(
+    os.environ.get("PIPELINE_GROUPING_MIN_AGE", "10")
+)
+# Drop DICOM files from incoming studies that have been sent before with the
+# same SOPInstanceUID and content. Off by default, as it reads and hashes
+# every incoming file
+PIPELINE_DROP_DUPLICATES = strtobool(
+    os.environ.get("PIPELINE_DROP_DUPLICATES", "False")
+)
+
+# Metrics served at /metrics are aggregated on this server. redis:// to count
+# across all workers, memory:// to count within a single process only. Empty
+# to switch metrics off
+METRICS_URL = os.environ.get("METRICS_URL", PIPELINE_LOCK_URL)
+# When set, /metrics can only be read with this bearer token
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Timings of celery tasks are added up in each worker process and sent to
+# METRICS_URL at most every this many seconds
+METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL", "10"))
+# Called before metrics are served, to set values that are cheaper to collect
+# on request than to keep up to date
+METRICS_COLLECTORS = [
+    "idis.jobs.metrics.collect_job_states",
+    "idis.pipeline.metrics.collect_run_statistics",
+]
+
+# Fraction of web requests and celery tasks to profile, between 0 and 1. Can
+# be changed at runtime with the profiling management command
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+# Profiles are kept on this server. Defaults to METRICS_URL
+PROFILING_URL = os.environ.get("PROFILING_URL", METRICS_URL)
+# Keep only the last this many profiles
+PROFILING_BUFFER_SIZE = int(os.environ.get("PROFILING_BUFFER_SIZE", "100"))
+# Keep this many functions with the highest cumulative time of each profile
+PROFILING_TOP_N = int(os.environ.get("PROFILING_TOP_N", "20"))
+# Seconds that each process uses a sample rate before checking for changes
+PROFILING_RATE_CHECK_INTERVAL = int(
+    os.environ.get("PROFILING_RATE_CHECK_INTERVAL", "10")
+)
+# Profile every request with django-speedinfo, which stores stats in the
+# cache. Adds overhead to every request, use PROFILING_SAMPLE_RATE instead
+# where possible
+SPEEDINFO_ENABLED = strtobool(os.environ.get("SPEEDINFO_ENABLED", "False"))
+if SPEEDINFO_ENABLED:
+    INSTALLED_APPS += ["speedinfo"]
+    # speedinfo at the end but before FetchFromCacheMiddleware
+    MIDDLEWARE += ("speedinfo.middleware.ProfilerMiddleware",)
+    CACHES["default"] = {
+        "BACKEND": "speedinfo.backends.proxy_cache",
+        "CACHE_BACKEND": CACHES["default"]["BACKEND"],
+        "LOCATION": CACHES["default"]["LOCATION"],
+    }
+    SPEEDINFO_STORAGE = "speedinfo.storage.cache.storage.CacheStorage"
+
 
 # Set which template pack to use for forms
 CRISPY_TEMPLATE_PACK = "bootstrap4"
@@ -5,6 +5,8 @@ from django.contrib import admin
 from django.views.generic import TemplateView
 from django.views import defaults as default_views
 
+from idis.core.views import metrics
+
 urlpatterns = [
     path(
         "", TemplateView.as_view(template_name="pages/home.html"), name="home"
@@ -19,6 +21,7 @@ urlpatterns = [
     # User management
     path("jobs/", include("idis.jobs.urls", namespace="jobs")),
     path("accounts/", include("idis.profiles.urls")),
+    path("metrics", metrics, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 if settings.DEBUG:
@@ -0,0 +1,5 @@
+""" Measuring performance on synthetic data, before deploying
+
+Run through management commands, such as ``manage.py benchmark_pipeline``.
+Nothing in here is used by IDIS itself
+"""
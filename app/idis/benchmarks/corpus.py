@@ -0,0 +1,142 @@
+""" Synthetic DICOM studies for benchmarks
+
+Studies are CT-like, with a single frame of 16 bit zeros as pixel data. All
+UIDs are generated, so every file is a distinct instance.
+"""
+import os
+import time
+from pathlib import Path
+from typing import List
+
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+
+
+class CorpusSpec:
+    """What to generate: n_studies × n_series × n_instances files of rows ×
+    columns pixels"""
+
+    def __init__(
+        self,
+        n_studies: int = 10,
+        n_series: int = 2,
+        n_instances: int = 10,
+        rows: int = 64,
+        columns: int = 64,
+    ):
+        self.n_studies = n_studies
+        self.n_series = n_series
+        self.n_instances = n_instances
+        self.rows = rows
+        self.columns = columns
+
+    def __str__(self):
+        return (
+            f"{self.n_studies} studies x {self.n_series} series x "
+            f"{self.n_instances} instances of {self.rows}x{self.columns} "
+            f"pixels"
+        )
+
+    @property
+    def files_per_study(self) -> int:
+        return self.n_series * self.n_instances
+
+    @property
+    def n_files(self) -> int:
+        return self.n_studies * self.files_per_study
+
+
+def create_dataset(
+    study_uid: str, series_uid: str, number: int, rows: int, columns: int
+) -> FileDataset:
+    """A single synthetic CT instance"""
+    meta = Dataset()  # FileMetaDataset only exists from pydicom 2.0
+    meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    dataset = FileDataset("", Dataset(), file_meta=meta, preamble=b"\0" * 128)
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    dataset.SOPClassUID = CT_IMAGE_STORAGE
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.StudyInstanceUID = study_uid
+    dataset.SeriesInstanceUID = series_uid
+    dataset.PatientName = "Benchmark^Patient"
+    dataset.PatientID = "BENCHMARK"
+    dataset.Modality = "CT"
+    dataset.InstanceNumber = number
+    dataset.Rows = rows
+    dataset.Columns = columns
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 0
+    dataset.PixelData = bytes(rows * columns * 2)
+    return dataset
+
+
+def generate_study(
+    folder: Path, spec: CorpusSpec, age: float = 3600, loose: bool = False
+) -> List[Path]:
+    """Write a single synthetic study
+
+    Parameters
+    ----------
+    folder: Path
+        Write files into a new folder in here, named after the study
+    spec: CorpusSpec
+        Number of series and instances, and pixel size
+    age: float, optional
+        Set modification times to this many seconds ago, so that the study has
+        cooled down already. Defaults to one hour
+    loose: bool, optional
+        Write files directly into folder, without a folder for the study, like
+        a modality that sends loose files. Defaults to False
+
+    Returns
+    -------
+    List[Path]
+        All files written
+    """
+    folder = Path(folder)
+    study_uid = generate_uid()
+    if not loose:
+        folder = folder / study_uid
+    folder.mkdir(parents=True, exist_ok=True)
+    mtime = time.time() - age
+
+    written = []
+    for _ in range(spec.n_series):
+        series_uid = generate_uid()
+        for number in range(1, spec.n_instances + 1):
+            dataset = create_dataset(
+                study_uid, series_uid, number, spec.rows, spec.columns
+            )
+            path = folder / f"{dataset.SOPInstanceUID}.dcm"
+            dataset.save_as(str(path))
+            os.utime(path, (mtime, mtime))
+            written.append(path)
+    if not loose:
+        os.utime(folder, (mtime, mtime))
+    return written
+
+
+def generate_corpus(
+    folder: Path, spec: CorpusSpec, age: float = 3600, loose: bool = False
+) -> List[Path]:
+    """Write spec.n_studies synthetic studies into folder. See generate_study
+
+    Returns
+    -------
+    List[Path]
+        All files written
+    """
+    written = []
+    for _ in range(spec.n_studies):
+        written += generate_study(folder, spec, age=age, loose=loose)
+    return written
@@ -0,0 +1,193 @@
+""" Benchmark of file handling in idis.jobs
+
+Builds a synthetic CTP quarantine: a number of CTP quarantine folders holding
+DICOM files for several jobs, plus some files that are not DICOM. Then times
+each step that IDIS takes on such a tree, in the order it takes them: reading
+job ids, scraping into the IDIS quarantine, counting and listing files per
+job, archiving, and moving and copying job data.
+
+Each step is timed once per tree size, as it changes the tree.
+"""
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List
+
+from idis.benchmarks.corpus import create_dataset
+from idis.benchmarks.pipeline import get_peak_rss_mb
+from idis.jobs.ctp import (
+    CTPQuarantineFolder,
+    IDISCTPQuarantine,
+    IDISDICOMDataSet,
+)
+from idis.jobs.filehandling import (
+    JobFolder,
+    SafeFolder,
+    copy_job_file,
+    move_job_data,
+)
+from pydicom.uid import generate_uid
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Names of the timed steps, in the order they are run
+CASES = [
+    "CTPQuarantineFolder.get_job_files",
+    "IDISCTPQuarantine.scrape",
+    "IDISCTPQuarantine.get_file_count",
+    "JobFolder.get_files",
+    "IDISCTPQuarantine.archive",
+    "move_job_data",
+    "copy_job_file",
+]
+
+
+class QuarantineSpec:
+    """What to generate: n_files spread over n_folders CTP quarantine folders
+    and n_jobs jobs. One in every unknown_every files is not DICOM"""
+
+    def __init__(
+        self,
+        n_files: int = 1000,
+        n_folders: int = 4,
+        n_jobs: int = 10,
+        unknown_every: int = 100,
+    ):
+        self.n_files = n_files
+        self.n_folders = n_folders
+        self.n_jobs = n_jobs
+        self.unknown_every = unknown_every
+
+    def __str__(self):
+        return (
+            f"{self.n_files} files in {self.n_folders} quarantine folders "
+            f"for {self.n_jobs} jobs"
+        )
+
+    @property
+    def job_ids(self) -> List[int]:
+        return list(range(1, self.n_jobs + 1))
+
+
+def create_job_file_content(job_id: int) -> bytes:
+    """A small DICOM file that has the IDIS private JobID tag set"""
+    dataset = create_dataset(
+        generate_uid(), generate_uid(), number=1, rows=8, columns=8
+    )
+    dataset.add_new(0x00750010, "LO", IDISDICOMDataSet.PRIVATE_CREATOR)
+    dataset.add_new(0x00751027, "UL", job_id)
+    buffer = BytesIO()
+    dataset.save_as(buffer)
+    return buffer.getvalue()
+
+
+def generate_quarantine(
+    folder: Path, spec: QuarantineSpec
+) -> List[CTPQuarantineFolder]:
+    """Write a synthetic CTP quarantine into folder
+
+    Returns
+    -------
+    List[CTPQuarantineFolder]
+        The quarantine folders written
+    """
+    contents = {x: create_job_file_content(x) for x in spec.job_ids}
+    ctp_folders = [
+        CTPQuarantineFolder(Path(folder) / f"DicomAnonymizer{i}")
+        for i in range(spec.n_folders)
+    ]
+    for ctp_folder in ctp_folders:
+        ctp_folder.path.mkdir(parents=True)
+
+    for i in range(spec.n_files):
+        path = ctp_folders[i % spec.n_folders].path / f"file{i:06d}"
+        if spec.unknown_every and i % spec.unknown_every == 0:
+            path.write_bytes(b"not a DICOM file")
+        else:
+            path.write_bytes(contents[spec.job_ids[i % spec.n_jobs]])
+    return ctp_folders
+
+
+def timed(seconds: Dict[str, float], case: str, function, *args):
+    """Call function with args and add the time it took to seconds[case]"""
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        seconds[case] = seconds.get(case, 0) + time.perf_counter() - start
+
+
+def run_quarantine_benchmark(spec: QuarantineSpec) -> Dict[str, float]:
+    """Run each step in CASES on a new synthetic quarantine
+
+    Returns
+    -------
+    Dict[str, float]
+        Seconds taken by each step. Per-job steps are summed over all jobs
+    """
+    seconds = {}
+    with tempfile.TemporaryDirectory() as base_path:
+        base_path = Path(base_path)
+        ctp_folders = generate_quarantine(base_path / "ctp", spec)
+        quarantine = IDISCTPQuarantine(
+            base_folder=base_path / "idis", ctp_quarantine_folders=ctp_folders
+        )
+
+        for ctp_folder in ctp_folders:
+            timed(seconds, CASES[0], ctp_folder.get_job_files)
+        timed(seconds, CASES[1], quarantine.scrape)
+        for job_id in spec.job_ids:
+            timed(seconds, CASES[2], quarantine.get_file_count, job_id)
+        for folder in quarantine.active_quarantine_folders:
+            job_folder = JobFolder(folder.path)
+            for job_id in spec.job_ids:
+                timed(seconds, CASES[3], job_folder.get_files, job_id)
+        for job_id in spec.job_ids:
+            timed(seconds, CASES[4], quarantine.archive, job_id)
+
+        archived = list(quarantine.archive_mapping.values())
+        moved = JobFolder(base_path / "moved")
+        for folder in archived:
+            for job_id in spec.job_ids:
+                timed(seconds, CASES[5], move_job_data, job_id, folder, moved)
+        copied = SafeFolder(base_path / "copied")
+        for job_id in spec.job_ids:
+            for job_file in moved.get_files(job_id):
+                timed(seconds, CASES[6], copy_job_file, job_file, copied)
+    return seconds
+
+
+def run_benchmark(
+    sizes: List[int] = None, n_folders: int = 4, n_jobs: int = 10
+) -> dict:
+    """Run the quarantine benchmark for trees of each size
+
+    Parameters
+    ----------
+    sizes: List[int], optional
+        Number of files in each tree. Defaults to DEFAULT_SIZES
+    n_folders: int, optional
+        Number of CTP quarantine folders. Defaults to 4
+    n_jobs: int, optional
+        Number of jobs that files belong to. Defaults to 10
+
+    Returns
+    -------
+    dict
+        Measurements. 'seconds' maps '<case>[<size>]' to seconds taken
+    """
+    sizes = sizes or DEFAULT_SIZES
+    seconds = {}
+    for size in sizes:
+        spec = QuarantineSpec(n_files=size, n_folders=n_folders, n_jobs=n_jobs)
+        for case, value in run_quarantine_benchmark(spec).items():
+            seconds[f"{case}[{size}]"] = value
+    return {
+        "benchmark": "jobs",
+        "sizes": sizes,
+        "folders": n_folders,
+        "jobs": n_jobs,
+        "seconds": seconds,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
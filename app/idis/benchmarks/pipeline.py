@@ -0,0 +1,200 @@
+""" End-to-end benchmark of IDISPipeline.run_once
+
+Builds the default pipeline with init_pipeline() in a temporary folder, fills
+the incoming stage of several streams with synthetic studies and runs the
+pipeline until every study has reached the finished stage. IDIS is replaced by
+a mock client tool that takes a fixed time for each call and reports every
+job as done.
+
+All database changes are rolled back afterwards.
+"""
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from itertools import count
+from typing import Dict
+
+from anonapi.responses import JobStatus, JobsInfoList
+from anonapi.testresources import JobInfoFactory, MockAnonClientTool
+from django.db import transaction
+from django.test import override_settings
+
+from idis.benchmarks.corpus import CorpusSpec, generate_corpus
+from idis.jobs.models import Profile
+from idis.pipeline.models import Stream
+from idis.pipeline.building import init_pipeline
+
+# (stage attribute of IDISPipeline, method) pairs to time
+TIMED_METHODS = [
+    ("incoming", "get_all_cooled_studies"),
+    ("cooled_down", "push_study"),
+    ("pending", "push_studies"),
+    ("pending", "update_records"),
+    ("finished", "push_studies"),
+    ("finished", "get_all_cooled_studies"),
+    ("trash", "push_studies"),
+    ("trash", "delete_all"),
+    ("errored", "push_studies"),
+]
+
+
+class LatencyMockAnonClientTool(MockAnonClientTool):
+    """Takes latency seconds for each call. Every job it creates is done on
+    the first status check"""
+
+    def __init__(self, latency: float = 0.05):
+        super().__init__()
+        self.latency = latency
+        self.job_ids = count(1)
+        self.lock = threading.Lock()
+
+    def create_path_job(self, *_, **__):
+        time.sleep(self.latency)
+        with self.lock:
+            job_id = next(self.job_ids)
+        return JobInfoFactory(job_id=job_id, status=JobStatus.ACTIVE)
+
+    def get_job_info_list(self, server, job_ids, get_extended_info=False):
+        time.sleep(self.latency)
+        return JobsInfoList(
+            [JobInfoFactory(job_id=x, status=JobStatus.DONE) for x in job_ids]
+        )
+
+    def get_server_status(self, server) -> str:
+        return f"OK: {server} is a mock"
+
+
+class StageTimer:
+    """Adds up the time spent in methods of each pipeline stage"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def instrument(self, pipeline):
+        """Wrap the methods in TIMED_METHODS of the stages of pipeline"""
+        for stage_name, method_name in TIMED_METHODS:
+            stage = getattr(pipeline, stage_name)
+            setattr(
+                stage,
+                method_name,
+                self.timed(
+                    f"{stage_name}.{method_name}", getattr(stage, method_name),
+                ),
+            )
+
+    def timed(self, key: str, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.seconds[key] += time.perf_counter() - start
+
+        return wrapper
+
+
+def get_peak_rss_mb() -> float:
+    """Highest resident memory use of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on mac, kilobytes elsewhere
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def run_benchmark(
+    spec: CorpusSpec,
+    n_streams: int = 2,
+    latency: float = 0.05,
+    loose: bool = False,
+    max_runs: int = 100,
+) -> dict:
+    """Push spec.n_studies synthetic studies through each of n_streams
+    streams, and measure
+
+    Parameters
+    ----------
+    spec: CorpusSpec
+        Studies to generate for each stream
+    n_streams: int, optional
+        Number of streams. Defaults to 2
+    latency: float, optional
+        Seconds that each IDIS call takes. Defaults to 0.05
+    loose: bool, optional
+        Write loose files instead of a folder per study. Defaults to False
+    max_runs: int, optional
+        Give up after this many pipeline runs. Defaults to 100
+
+    Returns
+    -------
+    dict
+        Measurements. All times in seconds
+    """
+    with tempfile.TemporaryDirectory() as base_path, override_settings(
+        PIPELINE_BASE_PATH=base_path,
+        PIPELINE_LOCAL_PATH=base_path,
+        PIPELINE_RECORDS_DB_URL="django://",
+        PIPELINE_GROUP_LOOSE_FILES=loose,
+    ), transaction.atomic():
+        profile = Profile.objects.create(title="benchmark")
+        streams = [
+            Stream.objects.create(
+                name=f"benchmark_{i}",
+                output_folder=r"\\benchmark\output",
+                idis_profile=profile,
+            )
+            for i in range(n_streams)
+        ]
+        pipeline = init_pipeline(streams=streams)
+        client_tool = LatencyMockAnonClientTool(latency=latency)
+        pipeline.pending.idis_connection.client_tool = client_tool
+        if pipeline.pending.dispatcher:
+            pipeline.pending.dispatcher.client_tool = client_tool
+        pipeline.assert_all_paths()
+
+        generate_start = time.perf_counter()
+        n_files = 0
+        for stream in streams:
+            n_files += len(
+                generate_corpus(
+                    pipeline.incoming.get_path_for_stream(stream),
+                    spec,
+                    loose=loose,
+                )
+            )
+        generate_seconds = time.perf_counter() - generate_start
+
+        timer = StageTimer()
+        timer.instrument(pipeline)
+        expected = spec.n_studies * n_streams
+        run_seconds = []
+        while len(run_seconds) < max_runs:
+            start = time.perf_counter()
+            pipeline.run_once()
+            run_seconds.append(time.perf_counter() - start)
+            if len(pipeline.finished.get_all_studies()) >= expected:
+                break
+        finished = len(pipeline.finished.get_all_studies())
+
+        transaction.set_rollback(True)
+
+    total = sum(run_seconds)
+    return {
+        "corpus": str(spec),
+        "streams": n_streams,
+        "latency": latency,
+        "files": n_files,
+        "studies": expected,
+        "finished_studies": finished,
+        "generate_seconds": generate_seconds,
+        "runs": len(run_seconds),
+        "run_seconds": run_seconds,
+        "total_seconds": total,
+        "files_per_second": n_files / total if total else 0,
+        "stage_seconds": dict(timer.seconds),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
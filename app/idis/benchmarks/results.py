@@ -0,0 +1,80 @@
+""" Saving benchmark results and comparing them between releases
+
+Results are dicts that map the name of each measurement to seconds under the
+key 'seconds', as returned by idis.benchmarks.jobs.run_benchmark. They are
+saved as JSON with the IDIS version that produced them.
+"""
+import json
+from pathlib import Path
+from typing import List
+
+from idis import __version__
+
+
+class Comparison:
+    """A single measurement in an old and a new set of results"""
+
+    def __init__(self, name: str, old: float, new: float):
+        self.name = name
+        self.old = old
+        self.new = new
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.old:.4f} s -> {self.new:.4f} s "
+            f"({self.change:+.1%})"
+        )
+
+    @property
+    def change(self) -> float:
+        """Relative change in time taken. 0.1 means 10% slower"""
+        if not self.old:
+            return 0.0
+        return self.new / self.old - 1
+
+    def is_slowdown(self, threshold: float, min_seconds: float = 0) -> bool:
+        """Is new more than threshold slower than old, relatively, and more
+        than min_seconds slower in absolute terms?"""
+        return self.change > threshold and self.new - self.old > min_seconds
+
+
+def save_results(results: dict, path: Path):
+    """Write results to path as JSON, with the current IDIS version"""
+    results = dict(results, version=__version__)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: Path) -> dict:
+    """Read results saved with save_results
+
+    Raises
+    ------
+    BenchmarkResultsException
+        If path does not contain benchmark results
+    """
+    try:
+        with open(path) as f:
+            results = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BenchmarkResultsException(f"Cannot read {path}: {e}") from e
+    if not isinstance(results, dict) or not isinstance(
+        results.get("seconds"), dict
+    ):
+        raise BenchmarkResultsException(
+            f"{path} does not contain benchmark results"
+        )
+    return results
+
+
+def compare(old: dict, new: dict) -> List[Comparison]:
+    """Compare each measurement that is in both old and new results"""
+    return [
+        Comparison(name, old["seconds"][name], new["seconds"][name])
+        for name in old["seconds"]
+        if name in new["seconds"]
+    ]
+
+
+class BenchmarkResultsException(Exception):
+    pass
@@ -0,0 +1,121 @@
+""" Measuring how long web and worker processes take to import their code
+
+Each entry point is started in a fresh python process with -X importtime,
+which prints the time spent importing each module. Startup time is the sum of
+these, so it does not include connecting to the database or broker.
+
+Heavy dependencies that only the pipeline and CTP code need are listed in
+LAZY_MODULES. They should be imported on first use, not when a process starts.
+"""
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+from django.conf import settings
+
+# What each kind of process imports before it can do any work
+ENTRY_POINTS = {
+    "worker": (
+        "import django; django.setup(); "
+        "from config.celery import app; app.loader.import_default_modules()"
+    ),
+    "web": "import django; django.setup(); import config.urls",
+}
+
+# Not imported on start by any entry point
+LAZY_MODULES = ("anonapi", "idissend", "pydicom", "sqlalchemy")
+
+# Seconds. Generous, as machines differ. Lower these when startup improves
+STARTUP_BUDGETS = {"worker": 3.0, "web": 3.0}
+
+
+class ImportTimes:
+    """Import times of a single process, as printed by python -X importtime"""
+
+    def __init__(self, modules: Dict[str, float]):
+        """
+
+        Parameters
+        ----------
+        modules: Dict[str, float]
+            Seconds spent importing each module itself, excluding the modules
+            it imported
+        """
+        self.modules = modules
+
+    @classmethod
+    def parse(cls, output: str) -> "ImportTimes":
+        """Read the stderr output of python -X importtime"""
+        modules = {}
+        for line in output.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            own, _, name = line.partition(":")[2].split("|")
+            if own.strip().isdigit():  # skip the header line
+                modules[name.strip()] = int(own) / 1_000_000
+        return cls(modules)
+
+    @property
+    def total(self) -> float:
+        """Seconds spent importing all modules"""
+        return sum(self.modules.values())
+
+    def get_top_level(self) -> Dict[str, float]:
+        """Seconds per top level package, slowest first"""
+        packages = {}
+        for name, seconds in self.modules.items():
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + seconds
+        return dict(sorted(packages.items(), key=lambda x: -x[1]))
+
+    def get_imported(self, names) -> List[str]:
+        """Those of names that were imported"""
+        return [x for x in names if x in self.modules]
+
+
+def measure_imports(code: str) -> ImportTimes:
+    """Run code in a new python process and time its imports. Uses the
+    DJANGO_SETTINGS_MODULE of this process
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If code fails
+    """
+    env = dict(
+        os.environ, PYTHONPATH=os.pathsep.join(x for x in sys.path if x)
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=settings.SITE_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return ImportTimes.parse(process.stderr)
+
+
+def run_benchmark(repeat: int = 3) -> dict:
+    """Time the imports of each entry point. Keeps the fastest of repeat
+    runs, as slower runs mostly measure other load on the machine
+
+    Returns
+    -------
+    dict
+        'seconds' per entry point, for compare_benchmarks. 'packages' with
+        seconds per top level package and 'lazy' with the LAZY_MODULES that
+        were imported, for each entry point
+    """
+    results = {"seconds": {}, "packages": {}, "lazy": {}}
+    for name, code in ENTRY_POINTS.items():
+        times = min(
+            (measure_imports(code) for _ in range(repeat)),
+            key=lambda x: x.total,
+        )
+        results["seconds"][f"startup[{name}]"] = times.total
+        results["packages"][name] = times.get_top_level()
+        results["lazy"][name] = times.get_imported(LAZY_MODULES)
+    return results
@@ -0,0 +1 @@
+default_app_config = "idis.core.apps.CoreConfig"
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    name = "idis.core"
+
+    def ready(self):
+        # connect celery signal receivers
+        import idis.core.profiling  # noqa: F401
+        import idis.core.taskmetrics  # noqa: F401
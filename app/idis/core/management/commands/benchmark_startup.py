@@ -0,0 +1,51 @@
+from django.core.management import BaseCommand, CommandError
+
+from idis.benchmarks.results import save_results
+from idis.benchmarks.startup import STARTUP_BUDGETS, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the imports that web and worker processes do on start. Fails "
+        "if a process imports a heavy dependency that should load lazily, or "
+        "takes longer than its budget. Compare saved results between "
+        "releases with compare_benchmarks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Keep the fastest of this many runs per process",
+        )
+        parser.add_argument(
+            "--packages",
+            type=int,
+            default=10,
+            help="Show this many of the slowest packages to import",
+        )
+        parser.add_argument("--output", help="Write results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = run_benchmark(repeat=options["repeat"])
+        problems = []
+        for name, packages in results["packages"].items():
+            seconds = results["seconds"][f"startup[{name}]"]
+            self.stdout.write(
+                f"{name}: {seconds:.3f} s (budget {STARTUP_BUDGETS[name]} s)"
+            )
+            for package, package_seconds in list(packages.items())[
+                : options["packages"]
+            ]:
+                self.stdout.write(f"  {package:<40} {package_seconds:8.3f} s")
+            if results["lazy"][name]:
+                problems.append(
+                    f"{name} imports {', '.join(results['lazy'][name])}"
+                )
+            if seconds > STARTUP_BUDGETS[name]:
+                problems.append(f"{name} takes {seconds:.3f} s to import")
+        if options["output"]:
+            save_results(results, options["output"])
+        if problems:
+            raise CommandError(". ".join(problems))
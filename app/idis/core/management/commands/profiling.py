@@ -0,0 +1,72 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from idis.core.profiling import get_store, set_sample_rate
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the latest profiles of sampled web requests and celery tasks, "
+        "or change the fraction that is sampled in all running processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Profile this fraction of requests and tasks from now on, "
+            "between 0 and 1. 0 switches profiling off",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Go back to the sample rate in settings",
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="Remove all stored profiles"
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=10,
+            help="Show this many of the latest profiles",
+        )
+        parser.add_argument(
+            "--functions",
+            type=int,
+            default=10,
+            help="Show this many functions of each profile",
+        )
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if options["rate"] is not None or options["reset"]:
+            try:
+                set_sample_rate(None if options["reset"] else options["rate"])
+            except ValueError as e:
+                raise CommandError(e)
+        if options["clear"]:
+            store.clear()
+
+        rate = store.get_rate()
+        if rate is None:
+            self.stdout.write(
+                f"Sample rate {settings.PROFILING_SAMPLE_RATE:g} (settings)"
+            )
+        else:
+            self.stdout.write(f"Sample rate {rate:g}")
+
+        for sample in store.get_samples()[: options["limit"]]:
+            at = datetime.fromtimestamp(sample["time"])
+            self.stdout.write(
+                f"\n{at:%Y-%m-%d %H:%M:%S} {sample['kind']} "
+                f"{sample['name']} {sample['seconds']:.3f}s"
+            )
+            for function in sample["top"][: options["functions"]]:
+                self.stdout.write(
+                    f"  {function['cumulative_seconds']:8.3f}s "
+                    f"{function['own_seconds']:8.3f}s "
+                    f"{function['calls']:8d} {function['function']}"
+                )
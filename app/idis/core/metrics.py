@@ -0,0 +1,547 @@
+""" Counters, gauges and histograms for monitoring IDIS
+
+Metrics are defined once, at the bottom of this module, and updated from
+wherever the work happens: celery workers, the pipeline and the web app. Their
+values are kept in a store shared by all these processes, so that the
+Prometheus text served by the web app covers all of them.
+
+Which store is used depends on settings.METRICS_URL:
+
+* redis://...  Values in redis, aggregated across all processes and hosts
+* memory://    Values in this process only. For testing and single process
+               setups
+
+Any other value, including an empty one, switches metrics off. METRICS_URL
+defaults to the celery broker url, which need not be redis.
+
+Failing to update a metric is logged and otherwise ignored. Monitoring should
+never stop the work that it monitors. Updates that happen for every file go
+through the buffer of this process instead of straight to the store.
+
+Some values, such as the number of jobs in each state, are cheaper to collect
+when metrics are requested than to keep up to date. The functions listed in
+settings.METRICS_COLLECTORS are called just before rendering for this.
+"""
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "idis.metrics"
+
+# Seconds. From a quick API call up to a slow scrape of a large quarantine
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+
+class MemoryMetricsStore:
+    """Metric values in memory. Only aggregates threads within this process"""
+
+    def __init__(self):
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def incr_many(self, amounts: Dict[str, float]):
+        with self.mutex:
+            for key, amount in amounts.items():
+                self.values[key] = self.values.get(key, 0) + amount
+
+    def set_value(self, key: str, value: float):
+        with self.mutex:
+            self.values[key] = value
+
+    def replace(self, name: str, values: Dict[str, float]):
+        with self.mutex:
+            for key in [x for x in self.values if is_sample_of(x, name)]:
+                del self.values[key]
+            self.values.update(values)
+
+    def get_values(self) -> Dict[str, float]:
+        with self.mutex:
+            return dict(self.values)
+
+    def clear(self):
+        with self.mutex:
+            self.values = {}
+
+
+class NullMetricsStore:
+    """Drops all updates. Used when metrics are switched off"""
+
+    def incr_many(self, amounts: Dict[str, float]):
+        pass
+
+    def set_value(self, key: str, value: float):
+        pass
+
+    def replace(self, name: str, values: Dict[str, float]):
+        pass
+
+    def get_values(self) -> Dict[str, float]:
+        return {}
+
+    def clear(self):
+        pass
+
+
+class RedisMetricsStore:
+    """Metric values in redis. Aggregates all processes that use the same
+    redis server"""
+
+    def __init__(self, url: str):
+        self.redis = redis.Redis.from_url(url)
+
+    def incr_many(self, amounts: Dict[str, float]):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, amount in amounts.items():
+            pipe.hincrbyfloat(METRICS_KEY, key, amount)
+        pipe.execute()
+
+    def set_value(self, key: str, value: float):
+        self.redis.hset(METRICS_KEY, key, value)
+
+    def replace(self, name: str, values: Dict[str, float]):
+        stale = [
+            x
+            for x in (y.decode() for y in self.redis.hkeys(METRICS_KEY))
+            if is_sample_of(x, name) and x not in values
+        ]
+        pipe = self.redis.pipeline(transaction=False)
+        if stale:
+            pipe.hdel(METRICS_KEY, *stale)
+        for key, value in values.items():
+            pipe.hset(METRICS_KEY, key, value)
+        pipe.execute()
+
+    def get_values(self) -> Dict[str, float]:
+        return {
+            key.decode(): float(value)
+            for key, value in self.redis.hgetall(METRICS_KEY).items()
+        }
+
+    def clear(self):
+        self.redis.delete(METRICS_KEY)
+
+
+@lru_cache(maxsize=None)
+def get_store_for_url(url: str):
+    """Metrics store for url. Only one is created per url per process. Urls
+    that are not supported switch metrics off"""
+    if url.startswith("memory://"):
+        return MemoryMetricsStore()
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisMetricsStore(url)
+    else:
+        if url:
+            logger.warning(
+                f"Unsupported METRICS_URL '{url}'. Use redis:// or memory://. "
+                f"Metrics are off"
+            )
+        return NullMetricsStore()
+
+
+def get_store():
+    """The metrics store configured in settings.METRICS_URL"""
+    return get_store_for_url(settings.METRICS_URL)
+
+
+def is_sample_of(key: str, name: str) -> bool:
+    """Is key a sample of the metric called name, with any labels?"""
+    return key.partition("{")[0] == name
+
+
+def escape_label_value(value) -> str:
+    return (
+        str(value)
+        .replace("\\", r"\\")
+        .replace("\n", r"\n")
+        .replace('"', r"\"")
+    )
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named value, or a value per combination of labels"""
+
+    type = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ):
+        """
+
+        Parameters
+        ----------
+        name: str
+            Prometheus metric name, such as idis_jobs
+        documentation: str
+            Served as help text
+        labelnames: Iterable[str], optional
+            Each update has to give a value for each of these labels. Defaults
+            to no labels
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def __str__(self):
+        return f"{self.type} {self.name}"
+
+    @property
+    def sample_names(self) -> List[str]:
+        """Names of the time series that this metric writes"""
+        return [self.name]
+
+    def get_key(self, labels: Dict[str, object], suffix: str = "", **extra):
+        """Key of the sample for labels, in Prometheus text format
+
+        Raises
+        ------
+        ValueError
+            If labels do not match the label names of this metric
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self} takes labels {self.labelnames}, not {tuple(labels)}"
+            )
+        pairs = [(x, labels[x]) for x in self.labelnames] + list(extra.items())
+        if not pairs:
+            return self.name + suffix
+        formatted = ",".join(
+            f'{x}="{escape_label_value(y)}"' for x, y in pairs
+        )
+        return f"{self.name}{suffix}{{{formatted}}}"
+
+    def sort_key(self, key: str):
+        return key
+
+    def incr_many(self, amounts: Dict[str, float]):
+        try:
+            get_store().incr_many(amounts)
+        except redis.exceptions.RedisError as e:
+            logger.debug(f"Could not update {self}: {e}")
+
+    def set_value(self, key: str, value: float):
+        try:
+            get_store().set_value(key, value)
+        except redis.exceptions.RedisError as e:
+            logger.debug(f"Could not update {self}: {e}")
+
+
+class Counter(Metric):
+    """A total that only goes up, such as the number of bytes moved"""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        if not name.endswith("_total"):
+            raise ValueError(f"Counter name {name} should end in _total")
+        super().__init__(name, documentation, labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError(f"{self} cannot decrease")
+        self.incr_many({self.get_key(labels): amount})
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the number of files in a
+    folder"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.set_value(self.get_key(labels), value)
+
+    def set_all(self, values: List[Tuple[float, Dict[str, object]]]):
+        """Set a value for each set of labels, and remove the values for all
+        other labels. For labels that can go away, such as deleted streams
+
+        Parameters
+        ----------
+        values: List[Tuple[float, Dict[str, object]]]
+            Value and labels for each sample to keep
+        """
+        samples = {self.get_key(labels): value for value, labels in values}
+        try:
+            get_store().replace(self.name, samples)
+        except redis.exceptions.RedisError as e:
+            logger.debug(f"Could not update {self}: {e}")
+
+    def inc(self, amount: float = 1, **labels):
+        self.incr_many({self.get_key(labels): amount})
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Counts observations, such as durations, in buckets"""
+
+    type = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        if "le" in self.labelnames:
+            raise ValueError(f"{name}: 'le' is reserved for buckets")
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    @property
+    def sample_names(self) -> List[str]:
+        return [self.name + x for x in ("_bucket", "_count", "_sum")]
+
+    def observe(self, value: float, **labels):
+        """Count value in each bucket it fits in. All updates are sent at
+        once"""
+        self.incr_many(self.get_amounts(value, labels))
+
+    def get_amounts(self, value: float, labels) -> Dict[str, float]:
+        """Increments to sample values for observing value"""
+        amounts = {
+            self.get_key(labels, "_bucket", le=format_value(x)): 1
+            for x in self.buckets
+            if value <= x
+        }
+        amounts[self.get_key(labels, "_count")] = 1
+        amounts[self.get_key(labels, "_sum")] = value
+        return amounts
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the number of seconds taken by the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def sort_key(self, key: str):
+        """Buckets in ascending order, then count and sum, for each set of
+        labels"""
+        name, _, labels = key.partition("{")
+        labels = labels.rstrip("}")
+        match = re.search(r'(^|,)le="([^"]*)"', labels)
+        bound = math.inf
+        if match:
+            bound = float(match.group(2))
+            labels = labels.replace(match.group(0), "")
+        return labels, self.sample_names.index(name), bound
+
+
+class MetricsBuffer:
+    """Adds up updates to counters and histograms in this process, and sends
+    them to the store in one go at most every flush_interval seconds. For
+    updates that happen too often to send each one"""
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        """
+
+        Parameters
+        ----------
+        flush_interval: float, optional
+            Seconds between sends. Defaults to settings.METRICS_FLUSH_INTERVAL
+        """
+        self._flush_interval = flush_interval
+        self.amounts: Dict[str, float] = {}
+        self.mutex = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is None:
+            return settings.METRICS_FLUSH_INTERVAL
+        return self._flush_interval
+
+    def inc(self, counter: Counter, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError(f"{counter} cannot decrease")
+        self.add({counter.get_key(labels): amount})
+
+    def observe(self, histogram: Histogram, value: float, **labels):
+        self.add(histogram.get_amounts(value, labels))
+
+    def add(self, amounts: Dict[str, float]):
+        with self.mutex:
+            for key, amount in amounts.items():
+                self.amounts[key] = self.amounts.get(key, 0) + amount
+
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Send everything added since the last flush. Updates that cannot be
+        sent are dropped"""
+        with self.mutex:
+            amounts, self.amounts = self.amounts, {}
+            self.last_flush = time.monotonic()
+        if not amounts:
+            return
+        try:
+            get_store().incr_many(amounts)
+        except redis.exceptions.RedisError as e:
+            logger.debug(f"Could not send {len(amounts)} metric updates: {e}")
+
+
+class MetricsRegistry:
+    """All metrics that IDIS exposes"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add metric. Returns the metric
+
+        Raises
+        ------
+        ValueError
+            If another metric with the same name is registered already
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} exists already")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets)
+        )
+
+    def collect(self, collectors: Optional[List[str]] = None):
+        """Call each collector, by dotted path. Defaults to
+        settings.METRICS_COLLECTORS"""
+        if collectors is None:
+            collectors = settings.METRICS_COLLECTORS
+        for path in collectors:
+            try:
+                import_string(path)()
+            except Exception as e:
+                logger.warning(f"Metrics collector {path} failed: {e}")
+
+    def render(self, values: Optional[Dict[str, float]] = None) -> str:
+        """All metrics in Prometheus text format
+
+        Parameters
+        ----------
+        values: Dict[str, float], optional
+            Sample values by key. Defaults to all values in the store
+        """
+        if values is None:
+            values = get_store().get_values()
+        per_name = {}
+        for key, value in values.items():
+            per_name.setdefault(key.partition("{")[0], []).append((key, value))
+
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            samples: List[Tuple[str, float]] = []
+            for sample_name in metric.sample_names:
+                samples += per_name.get(sample_name, [])
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in sorted(
+                samples, key=lambda x: metric.sort_key(x[0])
+            ):
+                lines.append(f"{key} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+PIPELINE_STUDIES = registry.gauge(
+    "idis_pipeline_studies",
+    "Studies in each pipeline stage, counted every "
+    "PIPELINE_STAGE_METRICS_INTERVAL seconds",
+    ["stage", "stream"],
+)
+PIPELINE_FILES = registry.gauge(
+    "idis_pipeline_files", "Files in each pipeline stage", ["stage", "stream"],
+)
+PIPELINE_RUN_SECONDS = registry.histogram(
+    "idis_pipeline_run_seconds", "Duration of pipeline runs"
+)
+PIPELINE_STATS = registry.gauge(
+    "idis_pipeline_stats", "Run statistics of the pipeline", ["key"]
+)
+IDIS_API_SECONDS = registry.histogram(
+    "idis_api_request_seconds",
+    "Duration of calls to the IDIS web API",
+    ["server", "call", "outcome"],
+)
+JOB_FILES = registry.counter(
+    "idis_job_files_total", "Job files moved or copied", ["operation"]
+)
+FILE_BYTES = registry.counter(
+    "idis_job_file_bytes_total", "Bytes of job files copied", ["operation"]
+)
+QUARANTINE_FILES = registry.gauge(
+    "idis_quarantine_files",
+    "Files in each active IDIS quarantine folder, after the last scrape",
+    ["folder"],
+)
+QUARANTINE_SCRAPED_FILES = registry.counter(
+    "idis_quarantine_scraped_files_total",
+    "Files moved out of CTP quarantine folders",
+    ["folder"],
+)
+QUARANTINE_SCRAPE_SECONDS = registry.histogram(
+    "idis_quarantine_scrape_seconds", "Duration of CTP quarantine scrapes"
+)
+JOBS = registry.gauge("idis_jobs", "Jobs in each state", ["status"])
+TASK_QUEUE_SECONDS = registry.histogram(
+    "idis_task_queue_wait_seconds",
+    "Time between a celery task being due and a worker starting it",
+    ["task"],
+)
+TASK_RUN_SECONDS = registry.histogram(
+    "idis_task_run_seconds",
+    "Run time of celery tasks, per end state such as SUCCESS, RETRY or "
+    "FAILURE",
+    ["task", "state"],
+)
+
+# Updates from this process that are sent in one go. Flushed after each celery
+# task and when a worker process stops, see idis.core.taskmetrics
+buffer = MetricsBuffer()
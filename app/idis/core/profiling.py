@@ -0,0 +1,270 @@
+""" Profiling a sample of web requests and celery tasks
+
+Profiling every request is too slow for production. Instead, a fraction of
+requests and tasks, set by settings.PROFILING_SAMPLE_RATE, is run under
+cProfile. For each of these, the functions with the highest cumulative time
+are kept in a ring buffer of the last settings.PROFILING_BUFFER_SIZE profiles.
+
+The sample rate can be changed at runtime with the profiling management
+command. The new rate is kept in the store, and each process picks it up
+within settings.PROFILING_RATE_CHECK_INTERVAL seconds.
+
+Which store is used depends on settings.PROFILING_URL:
+
+* redis://...  Profiles of all processes and hosts in one buffer
+* memory://    Profiles of this process only. For testing and single process
+               setups
+
+Like metrics, failing to store a profile is logged and otherwise ignored.
+
+Importing this module connects the celery signal receivers. It is imported by
+the celery app and by the idis.core app config.
+"""
+import cProfile
+import json
+import logging
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import redis
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_KEY = "idis.profiling.rate"
+SAMPLES_KEY = "idis.profiling.samples"
+
+
+class MemoryProfileStore:
+    """Profiles in memory. Only sees profiles made in this process"""
+
+    def __init__(self):
+        self.rate = None
+        self.samples = deque()
+        self.mutex = threading.Lock()
+
+    def get_rate(self) -> Optional[float]:
+        return self.rate
+
+    def set_rate(self, rate: Optional[float]):
+        self.rate = rate
+
+    def push(self, sample: Dict, size: int):
+        with self.mutex:
+            self.samples.appendleft(sample)
+            while len(self.samples) > size:
+                self.samples.pop()
+
+    def get_samples(self) -> List[Dict]:
+        with self.mutex:
+            return list(self.samples)
+
+    def clear(self):
+        with self.mutex:
+            self.samples.clear()
+
+
+class RedisProfileStore:
+    """Profiles in redis, shared by all processes that use the same redis
+    server"""
+
+    def __init__(self, url: str):
+        self.redis = redis.Redis.from_url(url)
+
+    def get_rate(self) -> Optional[float]:
+        rate = self.redis.get(RATE_KEY)
+        return None if rate is None else float(rate)
+
+    def set_rate(self, rate: Optional[float]):
+        if rate is None:
+            self.redis.delete(RATE_KEY)
+        else:
+            self.redis.set(RATE_KEY, rate)
+
+    def push(self, sample: Dict, size: int):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.lpush(SAMPLES_KEY, json.dumps(sample))
+        pipe.ltrim(SAMPLES_KEY, 0, size - 1)
+        pipe.execute()
+
+    def get_samples(self) -> List[Dict]:
+        return [json.loads(x) for x in self.redis.lrange(SAMPLES_KEY, 0, -1)]
+
+    def clear(self):
+        self.redis.delete(SAMPLES_KEY)
+
+
+@lru_cache(maxsize=None)
+def get_store_for_url(url: str):
+    """Profile store for url. Only one is created per url per process. Urls
+    that are not supported keep profiles in this process only, like metrics
+    these should never stop a request or task"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisProfileStore(url)
+    if not url.startswith("memory://"):
+        logger.warning(
+            f"Unsupported PROFILING_URL '{url}'. Use redis:// or memory://. "
+            f"Keeping profiles in this process only"
+        )
+    return MemoryProfileStore()
+
+
+def get_store():
+    """The profile store configured in settings.PROFILING_URL"""
+    return get_store_for_url(settings.PROFILING_URL)
+
+
+def set_sample_rate(rate: Optional[float]):
+    """Set the fraction of requests and tasks to profile in all processes.
+    None goes back to settings.PROFILING_SAMPLE_RATE
+
+    Raises
+    ------
+    ValueError
+        If rate is not between 0 and 1
+    """
+    if rate is not None and not 0 <= rate <= 1:
+        raise ValueError(f"Sample rate should be between 0 and 1, not {rate}")
+    get_store().set_rate(rate)
+    sampler.expire()
+
+
+def get_top_functions(profiler: cProfile.Profile, n: int) -> List[Dict]:
+    """The n functions with the highest cumulative time in profiler"""
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda x: x[1][3], reverse=True)[:n]
+    return [
+        {
+            "function": pstats.func_std_string(function),
+            "calls": calls,
+            "own_seconds": own_time,
+            "cumulative_seconds": cumulative_time,
+        }
+        for function, (_, calls, own_time, cumulative_time, _) in top
+    ]
+
+
+class Sampler:
+    """Decides what to profile, and stores the profiles. Only one profile
+    runs at a time in each thread"""
+
+    def __init__(self):
+        self.rate = None
+        self.checked_at = None
+        self.local = threading.local()
+
+    def expire(self):
+        """Read the sample rate from the store again on the next check"""
+        self.checked_at = None
+
+    def get_rate(self) -> float:
+        """The current sample rate. Read from the store at most every
+        settings.PROFILING_RATE_CHECK_INTERVAL seconds"""
+        now = time.monotonic()
+        if (
+            self.checked_at is None
+            or now - self.checked_at > settings.PROFILING_RATE_CHECK_INTERVAL
+        ):
+            self.checked_at = now
+            try:
+                self.rate = get_store().get_rate()
+            except redis.exceptions.RedisError as e:
+                logger.debug(f"Could not read profiling sample rate: {e}")
+                self.rate = None
+        if self.rate is None:
+            return settings.PROFILING_SAMPLE_RATE
+        return self.rate
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """Start profiling this thread, if it is picked as a sample
+
+        Returns
+        -------
+        cProfile.Profile or None
+            The running profiler. None if this thread is not profiled
+        """
+        if getattr(self.local, "active", False):
+            return None  # a task run eagerly inside a profiled request
+        rate = self.get_rate()
+        if rate <= 0 or random.random() >= rate:
+            return None
+        self.local.active = True
+        self.local.started = time.perf_counter()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler: cProfile.Profile, kind: str, name: str):
+        """Stop profiler and store its top functions
+
+        Parameters
+        ----------
+        profiler: cProfile.Profile
+            As returned by start()
+        kind: str
+            What was profiled, 'request' or 'task'
+        name: str
+            Which request or task was profiled
+        """
+        profiler.disable()
+        self.local.active = False
+        sample = {
+            "kind": kind,
+            "name": name,
+            "time": time.time(),
+            "seconds": time.perf_counter() - self.local.started,
+            "top": get_top_functions(profiler, settings.PROFILING_TOP_N),
+        }
+        try:
+            get_store().push(sample, settings.PROFILING_BUFFER_SIZE)
+        except redis.exceptions.RedisError as e:
+            logger.debug(f"Could not store profile of {name}: {e}")
+
+    @contextmanager
+    def profile(self, kind: str, name: str):
+        """Profile the with block, if it is picked as a sample"""
+        profiler = self.start()
+        try:
+            yield
+        finally:
+            if profiler:
+                self.stop(profiler, kind, name)
+
+
+sampler = Sampler()
+
+
+class SamplingProfilerMiddleware:
+    """Profiles a fraction of requests, see idis.core.profiling"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with sampler.profile("request", f"{request.method} {request.path}"):
+            return self.get_response(request)
+
+
+# running task profilers in this process, by task id
+task_profilers: Dict[str, cProfile.Profile] = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, **kwargs):
+    profiler = sampler.start()
+    if profiler:
+        task_profilers[task_id] = profiler
+
+
+@task_postrun.connect
+def stop_task_profile(task_id=None, task=None, **kwargs):
+    profiler = task_profilers.pop(task_id, None)
+    if profiler:
+        sampler.stop(profiler, "task", task.name)
@@ -0,0 +1,90 @@
+""" Timing of celery tasks
+
+Tells apart tasks that wait long in the queue from tasks that run long in the
+worker. When a task is published, the time it becomes due (now, or its eta) is
+added to its message headers. The worker that runs it records the time from
+then until the start as queue wait, and the time from start to end as run
+time, per task name and end state. Retries and failures show as run times
+with state RETRY and FAILURE.
+
+Publisher clocks are trusted to be close to worker clocks. Negative waits are
+counted as zero.
+
+Timings are added up in the metrics buffer of each worker process. This is
+sent to the metrics store at most every settings.METRICS_FLUSH_INTERVAL
+seconds, and when the process stops.
+
+Importing this module connects the signal receivers. It is imported by the
+celery app and by the idis.core app config, so that both workers and
+publishers have them.
+"""
+import time
+from datetime import datetime
+from typing import Dict
+
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_process_shutdown,
+)
+
+from idis.core.metrics import TASK_QUEUE_SECONDS, TASK_RUN_SECONDS, buffer
+
+READY_AT_HEADER = "idis_ready_at"
+# monotonic start time of each task running in this process, by task id
+started: Dict[str, float] = {}
+
+
+def get_ready_at(eta) -> float:
+    """Unix time at which a task with eta can start. Now if eta is not set
+    or cannot be read"""
+    now = time.time()
+    if not eta:
+        return now
+    try:
+        if not isinstance(eta, datetime):
+            eta = datetime.fromisoformat(eta)
+        return max(now, eta.timestamp())
+    except (TypeError, ValueError):
+        return now
+
+
+@before_task_publish.connect
+def add_ready_at(headers=None, **kwargs):
+    if headers is None:
+        return  # task message protocol 1 has no headers
+    headers[READY_AT_HEADER] = get_ready_at(headers.get("eta"))
+
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **kwargs):
+    started[task_id] = time.monotonic()
+    # custom headers end up nested in 'headers' in some celery versions
+    ready_at = task.request.get(READY_AT_HEADER) or (
+        task.request.get("headers") or {}
+    ).get(READY_AT_HEADER)
+    if ready_at is not None:
+        buffer.observe(
+            TASK_QUEUE_SECONDS,
+            max(time.time() - float(ready_at), 0),
+            task=task.name,
+        )
+
+
+@task_postrun.connect
+def record_run_time(task_id=None, task=None, state=None, **kwargs):
+    start = started.pop(task_id, None)
+    if start is not None:
+        buffer.observe(
+            TASK_RUN_SECONDS,
+            time.monotonic() - start,
+            task=task.name,
+            state=state or "UNKNOWN",
+        )
+    buffer.flush_if_due()
+
+
+@worker_process_shutdown.connect
+def flush_task_metrics(**kwargs):
+    buffer.flush()
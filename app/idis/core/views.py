@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+
+from idis.core.metrics import registry
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@never_cache
+@require_GET
+def metrics(request):
+    """All metrics in Prometheus text format. If settings.METRICS_TOKEN is
+    set, it has to be given as bearer token"""
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.META.get("HTTP_AUTHORIZATION", ""),
+        f"Bearer {settings.METRICS_TOKEN}",
+    ):
+        return HttpResponseForbidden()
+    registry.collect()
+    return HttpResponse(
+        registry.render(), content_type=PROMETHEUS_CONTENT_TYPE
+    )
@@ -2,6 +2,7 @@ from django.contrib import admin
 
 from idis.jobs.models import (
     Job,
+    JobSpan,
     Profile,
     WadoServer,
     NetworkShare,
@@ -11,6 +12,7 @@ from idis.jobs.models import (
 )
 
 admin.site.register(Job)
+admin.site.register(JobSpan)
 admin.site.register(Profile)
 admin.site.register(WadoServer)
 admin.site.register(NetworkShare)
@@ -7,6 +7,11 @@ from typing import List
 
 import pydicom
 
+from idis.core.metrics import (
+    QUARANTINE_FILES,
+    QUARANTINE_SCRAPED_FILES,
+    QUARANTINE_SCRAPE_SECONDS,
+)
 from idis.jobs.filehandling import (
     JobFolder,
     JobFile,
@@ -288,15 +293,29 @@ class IDISCTPQuarantine:
     def scrape(self):
         """Move all files from CTP quarantine to this folder
 
+        Returns
+        -------
+        List[JobFile]
+            All files that were moved, with the paths they were moved from
+
         Notes
         -----
         Reads DICOM tags from each file to determine job id
         """
-        for ctp_folder, idis_folder in self.ctp_folder_mapping.items():
-            ctp_folder: CTPQuarantineFolder
-            job_files = ctp_folder.get_job_files()
-            for job_file in job_files:
-                move_job_file(job_file, destination=idis_folder)
+        scraped = []
+        with QUARANTINE_SCRAPE_SECONDS.time():
+            for ctp_folder, idis_folder in self.ctp_folder_mapping.items():
+                ctp_folder: CTPQuarantineFolder
+                job_files = ctp_folder.get_job_files()
+                for job_file in job_files:
+                    move_job_file(job_file, destination=idis_folder)
+                scraped += job_files
+                name = idis_folder.path.name
+                QUARANTINE_SCRAPED_FILES.inc(len(job_files), folder=name)
+                QUARANTINE_FILES.set(
+                    idis_folder.get_total_file_count(), folder=name
+                )
+        return scraped
 
     def archive(self, job_id):
         """Move all files for this job from activate to archive
@@ -308,6 +327,9 @@ class IDISCTPQuarantine:
         """
         for active, archive in self.archive_mapping.items():
             move_job_data(job_id=job_id, source=active, destination=archive)
+            QUARANTINE_FILES.set(
+                active.get_total_file_count(), folder=active.path.name
+            )
 
     def get_files(self, job_id):
         """Get all files belonging to the given job from this quarantine
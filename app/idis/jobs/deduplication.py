@@ -0,0 +1,179 @@
+""" Recognising jobs that have been submitted before, and reusing their output
+
+Two jobs with the same input files and the same profile options produce the
+same output. The fingerprint of a job captures exactly this. A new job with a
+fingerprint that matches a job that is still running waits for that job.
+A new job matching a job that is done re-uses its output, as long as that
+output is still retained in the results folder.
+"""
+import hashlib
+import json
+import logging
+import os
+from shutil import copyfile
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+
+from idis.jobs.filehandling import JobFile, JobFolder
+from idis.jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS_STATUSES = [Job.PENDING, Job.DOWNLOADING, Job.PROCESSING]
+
+
+def compute_fingerprint(identifiers: Iterable[str], options: Dict[str, bool]):
+    """Hash of input file identifiers and profile options. Order of
+    identifiers does not matter
+
+    Parameters
+    ----------
+    identifiers: Iterable[str]
+        Identifier of each input file, from FileInfo.get_identifier()
+    options: Dict[str, bool]
+        De-identification options, from Profile.get_options()
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    content = json.dumps(
+        {"inputs": sorted(identifiers), "options": options}, sort_keys=True
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def get_fingerprint(job: Job):
+    """Fingerprint for the input files and profile of job"""
+    options = job.profile.get_options() if job.profile else {}
+    return compute_fingerprint(
+        (x.get_identifier() for x in job.get_file_infos()), options
+    )
+
+
+def get_results_folder():
+    """Folder in which the output of finished jobs is retained"""
+    return JobFolder(settings.IDIS_RESULTS_FOLDER)
+
+
+def has_retained_output(job: Job):
+    """Is the output of this finished job still in the results folder?"""
+    return get_results_folder().get_file_count(job.pk) > 0
+
+
+def find_equivalent_job(job: Job) -> Optional[Job]:
+    """Find an earlier job with the same fingerprint whose output can be used
+    for job. Prefers a finished job with retained output over a job that is
+    still in progress
+
+    Returns
+    -------
+    Job or None
+        None if no usable job exists
+    """
+    candidates = (
+        Job.objects.filter(fingerprint=job.fingerprint)
+        .exclude(pk=job.pk)
+        .filter(duplicate_of__isnull=True)
+        .order_by("-created")
+    )
+    for candidate in candidates.filter(status=Job.DONE):
+        if has_retained_output(candidate):
+            return candidate
+    return candidates.filter(status__in=IN_PROGRESS_STATUSES).first()
+
+
+def deduplicate_job(job: Job) -> Optional[Job]:
+    """Set fingerprint for a newly submitted job and link it to an equivalent
+    earlier job if there is one.
+
+    If the equivalent job is done, its output is materialised for job and job
+    is done immediately. If it is still in progress, job waits for it. Call
+    resolve_duplicates() when the equivalent job finishes.
+
+    Parameters
+    ----------
+    job: Job
+        A job with all its input files added
+
+    Returns
+    -------
+    Job or None
+        The job that is reused, or None if job should be processed normally
+    """
+    job.fingerprint = get_fingerprint(job)
+    job.save(update_fields=["fingerprint"])
+    if not job.fingerprint:
+        return None
+
+    original = find_equivalent_job(job)
+    if not original:
+        return None
+
+    logger.info(f"{job} is identical to {original}. Reusing")
+    job.duplicate_of = original
+    job.save(update_fields=["duplicate_of"])
+    if original.status == Job.DONE:
+        materialise_output(original, job)
+    return original
+
+
+def resolve_duplicates(original: Job):
+    """Finish all jobs waiting for original, now that original is finished.
+
+    Waiting jobs get a copy of the output if original is done. If original
+    failed they are detached, so they can be processed by themselves. Queueing
+    them again is up to the caller, see idis.jobs.tasks.finish_job
+
+    Returns
+    -------
+    List[Job]
+        The jobs that were waiting
+    """
+    waiting = list(original.duplicates.filter(status__in=IN_PROGRESS_STATUSES))
+    for job in waiting:
+        if original.status == Job.DONE and has_retained_output(original):
+            materialise_output(original, job)
+        else:
+            logger.info(f"{original} did not finish. Detaching {job}")
+            job.duplicate_of = None
+            job.save(update_fields=["duplicate_of"])
+    return waiting
+
+
+def retain_output(job: Job, files: Iterable[JobFile]):
+    """Keep the delivered output files of job in the results folder, so that
+    later identical jobs can reuse them"""
+    link_files(files, job_id=job.pk)
+
+
+def materialise_output(original: Job, job: Job):
+    """Make the retained output of original available as output of job and
+    mark job done.
+    """
+    files = get_results_folder().get_files(original.pk)
+    link_files(files, job_id=job.pk)
+
+    job.status = Job.DONE
+    job.files_processed = len(files)
+    job.save(update_fields=["status", "files_processed"])
+
+
+def link_files(files: Iterable[JobFile], job_id: int):
+    """Put files in the results folder for job_id.
+
+    Files are hard linked where possible, so no data is copied. If the file
+    system does not support this, files are copied.
+    """
+    folder = get_results_folder()
+    for job_file in files:
+        destination = folder.get_available_path(
+            JobFile(job_id=job_id, path=job_file.path)
+        )
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(job_file.path, destination)
+        except OSError:
+            copyfile(str(job_file.path), str(destination))
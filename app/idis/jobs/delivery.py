@@ -0,0 +1,127 @@
+""" Sending the output of a job to its destination in batches
+
+"""
+import logging
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from idis.jobs.filehandling import JobFile
+from idis.jobs.transfers import run_sync, transfer_all
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryResult:
+    """Outcome of sending a single file"""
+
+    def __init__(
+        self,
+        job_file: JobFile,
+        destination: Optional[Path] = None,
+        error: Optional[str] = None,
+    ):
+        """
+
+        Parameters
+        ----------
+        job_file: JobFile
+            The file that was sent
+        destination: Path, optional
+            Where the file ended up. None if sending failed
+        error: str, optional
+            What went wrong. None if sending succeeded
+        """
+        self.job_file = job_file
+        self.destination = destination
+        self.error = error
+
+    def __str__(self):
+        if self.succeeded:
+            return f"{self.job_file} delivered to '{self.destination}'"
+        else:
+            return f"{self.job_file} failed: {self.error}"
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class DeliveryReport:
+    """Outcome of sending a batch of files. Sending does not stop at the first
+    failure, so a job can retry just the files that failed
+    """
+
+    def __init__(self, results: List[DeliveryResult]):
+        self.results = results
+
+    def __str__(self):
+        return (
+            f"Delivery of {len(self.results)} files: "
+            f"{len(self.succeeded)} succeeded, {len(self.failed)} failed"
+        )
+
+    @property
+    def succeeded(self) -> List[DeliveryResult]:
+        return [x for x in self.results if x.succeeded]
+
+    @property
+    def failed(self) -> List[DeliveryResult]:
+        return [x for x in self.results if not x.succeeded]
+
+    @property
+    def all_succeeded(self):
+        return not self.failed
+
+    def get_failed_files(self) -> List[JobFile]:
+        """The files that could not be delivered. Input for a retry"""
+        return [x.job_file for x in self.failed]
+
+
+async def deliver_files_async(
+    job_files: List[JobFile],
+    send_function: Callable[[JobFile], Path],
+    max_workers: int,
+) -> DeliveryReport:
+    """Send all job files using send_function, with at most max_workers
+    transfers at the same time
+
+    Parameters
+    ----------
+    job_files: List[JobFile]
+        The files to send
+    send_function: Callable[[JobFile], Path]
+        Sends a single file and returns the path it was written to. Should
+        raise an exception if sending fails
+    max_workers: int
+        Send at most this many files at the same time
+
+    Returns
+    -------
+    DeliveryReport
+        A result for each file, in the same order as job_files
+
+    """
+    results = await transfer_all(
+        send_function, job_files, max_concurrent=max_workers
+    )
+    report = DeliveryReport(
+        [
+            DeliveryResult(x.item, destination=x.value, error=x.error)
+            for x in results
+        ]
+    )
+    logger.info(str(report))
+    return report
+
+
+def deliver_files(
+    job_files: List[JobFile],
+    send_function: Callable[[JobFile], Path],
+    max_workers: int,
+) -> DeliveryReport:
+    """Blocking version of deliver_files_async()"""
+    return run_sync(
+        deliver_files_async(
+            job_files, send_function=send_function, max_workers=max_workers
+        )
+    )
@@ -1,10 +1,20 @@
 """ Classes for working with files that are associated to job_ids
 
 """
+import hashlib
+import logging
 import os
 import uuid
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from pathlib import Path
 from shutil import copyfile
+from typing import Iterator, List, Optional, Tuple
+
+from idis.core.metrics import FILE_BYTES, JOB_FILES, buffer
+
+logger = logging.getLogger(__name__)
 
 
 class JobFile:
@@ -246,6 +256,25 @@ class JobFolder(SafeFolder):
         else:
             return len([x for x in job_path.iterdir() if x.is_file()])
 
+    def get_total_file_count(self):
+        """get number of files in this folder for all jobs, including files
+        that could not be associated with a job
+
+        Returns
+        -------
+        int
+           number of files
+
+        """
+        if not self.path.exists():
+            return 0
+        count = 0
+        for job_path in self.path.iterdir():
+            if job_path.is_dir():
+                with os.scandir(job_path) as entries:
+                    count += sum(1 for x in entries if x.is_file())
+        return count
+
 
 def move_job_file(job_file: JobFile, destination: SafeFolder):
     """Move file to folder, creates folder path if needed
@@ -262,6 +291,7 @@ def move_job_file(job_file: JobFile, destination: SafeFolder):
         job_file, destination
     )
     source_path.rename(destination_path)
+    count_job_file("move")
 
 
 def copy_job_file(job_file: JobFile, destination: SafeFolder):
@@ -274,11 +304,202 @@ def copy_job_file(job_file: JobFile, destination: SafeFolder):
     destination: SafeFolder
         To this folder
 
+    Returns
+    -------
+    Path
+        Path the file was written to
+
     """
     source_path, destination_path = prepare_job_file_operation(
         job_file, destination
     )
     copyfile(str(source_path), str(destination_path))
+    count_job_file("copy", destination_path)
+    return destination_path
+
+
+def copy_job_file_atomic(
+    job_file: JobFile, destination: SafeFolder, verify_checksum=False
+):
+    """Copy file to folder in such a way that the file never appears
+    half-written in the destination. Creates folder path if needed
+
+    The file is first copied to a hidden temporary file next to the final
+    destination, and then renamed. A rename within one folder is atomic, so
+    anyone reading the destination folder sees either no file or the
+    complete file. Copies running at the same time never take the same name,
+    see atomic_write_path.
+
+    Parameters
+    ----------
+    job_file: JobFile
+        Copy this file
+    destination: SafeFolder
+        To this folder
+    verify_checksum: bool, optional
+        If True, compare checksums of the source file and the written copy
+        before renaming. Defaults to False
+
+    Raises
+    ------
+    ChecksumException
+        If verify_checksum is True and the copy differs from the source
+    OSError
+        If copying fails for any other reason
+
+    Returns
+    -------
+    Path
+        Path the file was written to
+
+    """
+    source_path, destination_path = prepare_job_file_operation(
+        job_file, destination
+    )
+    with atomic_write_path(destination_path) as write:
+        copyfile(str(source_path), str(write.temp_path))
+        if verify_checksum:
+            source_checksum = get_checksum(source_path)
+            copy_checksum = get_checksum(write.temp_path)
+            if source_checksum != copy_checksum:
+                raise ChecksumException(
+                    f"Checksum of copy {copy_checksum} does not match "
+                    f"{source_checksum} for {job_file}"
+                )
+    count_job_file("copy", write.path)
+    return write.path
+
+
+def count_job_file(operation: str, copy: Optional[Path] = None):
+    """Count a moved or copied job file in the metrics buffer of this process.
+    Bytes are only counted for copies. A move within one file system does not
+    read the file, so it is not worth a stat
+
+    Parameters
+    ----------
+    operation: str
+        'move' or 'copy'
+    copy: Path, optional
+        The file that was written by a copy. Defaults to None
+    """
+    buffer.inc(JOB_FILES, operation=operation)
+    if copy:
+        buffer.inc(FILE_BYTES, copy.stat().st_size, operation=operation)
+    buffer.flush_if_due()
+
+
+class AtomicWrite:
+    """A file being written by atomic_write_path"""
+
+    def __init__(self, temp_path: Path, path: Path):
+        """
+
+        Parameters
+        ----------
+        temp_path: Path
+            Write the file here
+        path: Path
+            Where the complete file should go. Once the write has completed,
+            where it went
+        """
+        self.temp_path = temp_path
+        self.path = path
+
+
+@contextmanager
+def atomic_write_path(destination_path: Path) -> Iterator[AtomicWrite]:
+    """Context manager giving a hidden temporary path next to destination_path
+    to write to. When the with block completes the temporary file is given the
+    name destination_path, or a random name next to it if destination_path
+    exists already. When an exception is raised it is removed instead.
+
+    The name is claimed in the same step that the file appears, see
+    claim_path. Writers running at the same time never get the same name,
+    and never overwrite each other
+
+    Parameters
+    ----------
+    destination_path: Path
+        The path that should only ever contain a complete file. Parent folder
+        should exist
+
+    Examples
+    --------
+    with atomic_write_path(path) as write:
+        write.temp_path.write_bytes(data)
+    written_to = write.path
+
+    """
+    write = AtomicWrite(
+        temp_path=destination_path.parent
+        / f".{destination_path.name}.{uuid.uuid4().hex}.part",
+        path=destination_path,
+    )
+    try:
+        yield write
+        write.path = claim_path(write.temp_path, destination_path)
+    except BaseException:
+        # never leave partial files in the destination
+        if write.temp_path.exists():
+            write.temp_path.unlink()
+        raise
+
+
+def claim_path(temp_path: Path, path: Path) -> Path:
+    """Give the file at temp_path the name path, or a random name next to it if
+    path is taken. Checking that a name is free and taking it is one step, so
+    this never overwrites a file
+
+    A hard link to the file is made first, which fails if the name is taken.
+    File systems without hard links get an empty file under the name first,
+    which is then replaced by the complete file
+
+    Returns
+    -------
+    Path
+        The path the file now has
+    """
+    while True:
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            path = path.parent / str(uuid.uuid4())
+            continue
+        except OSError:
+            break  # no hard links on this file system
+        os.unlink(temp_path)
+        return path
+
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            path = path.parent / str(uuid.uuid4())
+            continue
+        os.replace(temp_path, path)
+        return path
+
+
+def get_checksum(path, chunk_size=1024 * 1024):
+    """SHA-256 checksum of the file at path
+
+    Parameters
+    ----------
+    path: Path or str
+        full path to file
+    chunk_size: int, optional
+        Read this many bytes at a time. Defaults to 1MB
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
 
 
 def prepare_job_file_operation(job_file: JobFile, destination: SafeFolder):
@@ -330,6 +551,181 @@ def move_job_data(job_id: int, source: JobFolder, destination: SafeFolder):
         source.remove_empty_job_id(job_id)
 
 
+class FileFilter:
+    """Decides which files to keep while walking a folder tree
+
+    Filters are checked cheapest first. Suffix only needs the file name, size and
+    modification time need a stat call, which is only done if these are set.
+    """
+
+    def __init__(
+        self,
+        suffixes: Optional[List[str]] = None,
+        min_size: Optional[int] = None,
+        modified_after: Optional[datetime] = None,
+        modified_before: Optional[datetime] = None,
+    ):
+        """
+
+        Parameters
+        ----------
+        suffixes: List[str], optional
+            Only keep files ending in one of these, like '.dcm'. Case
+            insensitive. Defaults to keeping all files
+        min_size: int, optional
+            Only keep files of at least this many bytes
+        modified_after: datetime, optional
+            Only keep files last modified at or after this time
+        modified_before: datetime, optional
+            Only keep files last modified before this time
+        """
+        self.suffixes = (
+            tuple(x.lower() for x in suffixes) if suffixes else None
+        )
+        self.min_size = min_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+
+    @property
+    def needs_stat(self):
+        """True if checking this filter requires a stat call for each file"""
+        return (
+            self.min_size is not None
+            or self.modified_after is not None
+            or self.modified_before is not None
+        )
+
+    def matches(self, entry: os.DirEntry):
+        """Should the file in entry be kept?
+
+        Parameters
+        ----------
+        entry: os.DirEntry
+            A file found by os.scandir
+
+        Returns
+        -------
+        bool
+        """
+        if self.suffixes and not entry.name.lower().endswith(self.suffixes):
+            return False
+        if not self.needs_stat:
+            return True
+
+        stat = entry.stat()
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if (
+            self.modified_after is not None
+            and stat.st_mtime < self.modified_after.timestamp()
+        ):
+            return False
+        if (
+            self.modified_before is not None
+            and stat.st_mtime >= self.modified_before.timestamp()
+        ):
+            return False
+        return True
+
+
+def iterate_files(
+    path, file_filter: FileFilter = None, max_workers: int = 8
+) -> Iterator[Path]:
+    """Walk all files in path and its sub folders, yielding each file as soon as
+    the folder it is in has been listed.
+
+    Sub folders are listed in parallel with a bounded thread pool. Listing
+    folders on network shares is dominated by latency, so this is much faster
+    than os.walk for deep trees.
+
+    Parameters
+    ----------
+    path: Path or str
+        Folder to walk
+    file_filter: FileFilter, optional
+        Only yield files matching this filter. Defaults to yielding all files
+    max_workers: int, optional
+        List at most this many folders at the same time. Defaults to 8
+
+    Raises
+    ------
+    FileNotFoundError
+        If path does not exist
+    NotADirectoryError
+        If path is not a folder
+
+    Returns
+    -------
+    Iterator[Path]
+        Full path to each file. Order is not defined
+
+    Notes
+    -----
+    Sub folders that cannot be listed are logged and skipped. Symlinks to
+    folders are not followed.
+    """
+    # listing the root folder directly lets any errors for path itself surface
+    files, folders = _scan_folder(Path(path), file_filter)
+    yield from files
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {
+        executor.submit(_scan_folder_safe, folder, file_filter)
+        for folder in folders
+    }
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, folders = future.result()
+                pending.update(
+                    executor.submit(_scan_folder_safe, folder, file_filter)
+                    for folder in folders
+                )
+                yield from files
+    finally:
+        # caller might stop iterating early. Do not list any more folders
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _scan_folder(
+    path: Path, file_filter: Optional[FileFilter]
+) -> Tuple[List[Path], List[Path]]:
+    """List files and sub folders directly in path. Files are filtered"""
+    files = []
+    folders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                folders.append(Path(entry.path))
+            elif entry.is_file() and _matches(entry, file_filter):
+                files.append(Path(entry.path))
+    return files, folders
+
+
+def _matches(entry: os.DirEntry, file_filter: Optional[FileFilter]):
+    """Check filter. Files that disappear while checking do not match"""
+    if file_filter is None:
+        return True
+    try:
+        return file_filter.matches(entry)
+    except FileNotFoundError:
+        return False
+
+
+def _scan_folder_safe(
+    path: Path, file_filter: Optional[FileFilter]
+) -> Tuple[List[Path], List[Path]]:
+    """Like _scan_folder, but log and skip any folder that cannot be listed"""
+    try:
+        return _scan_folder(path, file_filter)
+    except OSError as e:
+        logger.warning(f"Skipping folder {path} while walking files: {e}")
+        return [], []
+
+
 class IDISServer:
     """Representation of the important
 
@@ -362,3 +758,7 @@ class IDISServer:
 
 class JobFolderException(Exception):
     pass
+
+
+class ChecksumException(Exception):
+    pass
@@ -0,0 +1,36 @@
+from django.core.management import BaseCommand
+
+from idis.benchmarks.jobs import DEFAULT_SIZES, run_benchmark
+from idis.benchmarks.results import save_results
+
+
+class Command(BaseCommand):
+    help = (
+        "Time scraping, archiving, moving and copying job files on synthetic "
+        "CTP quarantines of several sizes. Save results with --output and "
+        "compare them between releases with compare_benchmarks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=DEFAULT_SIZES,
+            help="Number of files in each quarantine",
+        )
+        parser.add_argument("--folders", type=int, default=4)
+        parser.add_argument("--jobs", type=int, default=10)
+        parser.add_argument("--output", help="Write results to this JSON file")
+
+    def handle(self, *args, **options):
+        results = run_benchmark(
+            sizes=options["sizes"],
+            n_folders=options["folders"],
+            n_jobs=options["jobs"],
+        )
+        for name, seconds in results["seconds"].items():
+            self.stdout.write(f"  {name:<52} {seconds:8.3f} s")
+        self.stdout.write(f"Peak RSS {results['peak_rss_mb']:.1f} MB")
+        if options["output"]:
+            save_results(results, options["output"])
@@ -0,0 +1,58 @@
+from django.core.management import BaseCommand, CommandError
+
+from idis.benchmarks.results import (
+    BenchmarkResultsException,
+    compare,
+    load_results,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare two benchmark result files, such as written by "
+        "benchmark_jobs --output. Fails if anything got slower than the "
+        "threshold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("old", help="Results of the earlier release")
+        parser.add_argument("new", help="Results to check")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Flag measurements that are more than this fraction slower",
+        )
+        parser.add_argument(
+            "--min-seconds",
+            type=float,
+            default=0.01,
+            help="Ignore slowdowns of less than this many seconds, which are "
+            "mostly noise",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            old = load_results(options["old"])
+            new = load_results(options["new"])
+        except BenchmarkResultsException as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            f"Comparing {old.get('version', 'unknown')} to "
+            f"{new.get('version', 'unknown')}"
+        )
+        slowdowns = []
+        for comparison in compare(old, new):
+            if comparison.is_slowdown(
+                options["threshold"], options["min_seconds"]
+            ):
+                slowdowns.append(comparison)
+                self.stdout.write(f"  SLOWER {comparison}")
+            else:
+                self.stdout.write(f"         {comparison}")
+        if slowdowns:
+            raise CommandError(
+                f"{len(slowdowns)} measurements are more than "
+                f"{options['threshold']:.0%} slower"
+            )
@@ -0,0 +1,18 @@
+""" Metrics about jobs that are collected when metrics are requested. See
+idis.core.metrics
+"""
+from django.db.models import Count
+
+from idis.core.metrics import JOBS
+from idis.jobs.models import Job
+
+
+def collect_job_states():
+    """Set the number of jobs in each state, including states without jobs"""
+    count = dict(
+        Job.objects.order_by()
+        .values_list("status")
+        .annotate(count=Count("pk"))
+    )
+    for status, _ in Job.JOB_STATUS_CHOICES:
+        JOBS.set(count.get(status, 0), status=status)
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0003_auto_20200421_1117"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="networkshare",
+            name="max_parallel_transfers",
+            field=models.PositiveIntegerField(
+                default=4,
+                help_text="Send at most this many files to this share at the same time",
+            ),
+        ),
+    ]
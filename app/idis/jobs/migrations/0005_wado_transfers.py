@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0004_networkshare_max_parallel_transfers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="wadofile",
+            name="series_uid",
+            field=models.CharField(
+                default="",
+                help_text="UID of the series this file belongs to",
+                max_length=512,
+            ),
+        ),
+        migrations.AddField(
+            model_name="wadoserver",
+            name="max_parallel_transfers",
+            field=models.PositiveIntegerField(
+                default=64,
+                help_text="Download at most this many files from this server at the same time",
+            ),
+        ),
+    ]
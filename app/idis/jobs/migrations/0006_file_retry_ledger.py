@@ -0,0 +1,97 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0005_wado_transfers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileondisk",
+            name="attempts",
+            field=models.IntegerField(
+                blank=True,
+                default=0,
+                help_text="Number of failed attempts to process this file",
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileondisk",
+            name="last_error",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Error message of the last failed attempt, if any",
+                max_length=1024,
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileondisk",
+            name="next_attempt",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Do not retry processing this file before this time",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="fileondisk",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pending"),
+                    ("DONE", "Done"),
+                    ("FAILED", "Failed, will retry"),
+                    ("ERROR", "Error, gave up"),
+                ],
+                default="PENDING",
+                max_length=32,
+            ),
+        ),
+        migrations.AddField(
+            model_name="wadofile",
+            name="attempts",
+            field=models.IntegerField(
+                blank=True,
+                default=0,
+                help_text="Number of failed attempts to process this file",
+            ),
+        ),
+        migrations.AddField(
+            model_name="wadofile",
+            name="last_error",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Error message of the last failed attempt, if any",
+                max_length=1024,
+            ),
+        ),
+        migrations.AddField(
+            model_name="wadofile",
+            name="next_attempt",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="Do not retry processing this file before this time",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="wadofile",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pending"),
+                    ("DONE", "Done"),
+                    ("FAILED", "Failed, will retry"),
+                    ("ERROR", "Error, gave up"),
+                ],
+                default="PENDING",
+                max_length=32,
+            ),
+        ),
+    ]
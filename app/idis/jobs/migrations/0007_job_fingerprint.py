@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0006_file_retry_ledger"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Identical job whose output is reused for this job",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="jobs.Job",
+            ),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                help_text="Hash of input files and profile options. Jobs with the same fingerprint produce the same output",
+                max_length=64,
+            ),
+        ),
+    ]
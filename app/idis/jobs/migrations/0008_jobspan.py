@@ -0,0 +1,74 @@
+# Generated by Django 3.0.14 on 2026-10-19 09:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jobs", "0007_job_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobSpan",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "phase",
+                    models.CharField(
+                        choices=[
+                            ("PREFETCH", "Prefetch input files"),
+                            ("CTP_INPUT", "Hand off to CTP"),
+                            ("CTP_OUTPUT", "Collect CTP output"),
+                            ("QUARANTINE", "Scrape quarantine"),
+                            ("DELIVERY", "Deliver output"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("started", models.DateTimeField()),
+                ("finished", models.DateTimeField()),
+                (
+                    "file_count",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Number of files handled in this phase",
+                    ),
+                ),
+                (
+                    "error",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="Error message, if the phase failed",
+                        max_length=1024,
+                    ),
+                ),
+                (
+                    "job",
+                    models.ForeignKey(
+                        help_text="The job that this phase ran for",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="spans",
+                        to="jobs.Job",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="jobspan",
+            index=models.Index(
+                fields=["started"], name="jobs_jobspa_started_7c2ae3_idx"
+            ),
+        ),
+    ]
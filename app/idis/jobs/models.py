@@ -1,11 +1,31 @@
 import abc
+import base64
 import os
+from collections import Counter
 from pathlib import Path
+from shutil import copyfileobj
+from typing import List
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
 
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
+from django.utils import timezone
 
-from idis.jobs.filehandling import JobFile, SafeFolder, copy_job_file
+from idis.jobs.delivery import DeliveryReport, deliver_files_async
+from idis.jobs.filehandling import (
+    FileFilter,
+    JobFile,
+    SafeFolder,
+    atomic_write_path,
+    copy_job_file,
+    copy_job_file_atomic,
+    iterate_files,
+)
+from idis.jobs.transfers import TransferResult, run_sync, transfer_all
 
 
 class Profile(models.Model):
@@ -87,6 +107,21 @@ class Profile(models.Model):
         help_text="Keep private tags that are explicitly marked as not containing any patient information",
     )
 
+    def get_options(self):
+        """The de-identification options of this profile. Excludes title and
+        description
+
+        Returns
+        -------
+        Dict[str, bool]
+            option name: value
+        """
+        return {
+            field.name: getattr(self, field.name)
+            for field in self._meta.get_fields()
+            if isinstance(field, models.BooleanField)
+        }
+
 
 class FileBatch(models.Model):
     """A collection of files under a single description.
@@ -178,6 +213,169 @@ class Job(models.Model):
         on_delete=models.SET_NULL,
         help_text="The files that are processed in this job",
     )
+    fingerprint = models.CharField(
+        max_length=64,
+        default="",
+        blank=True,
+        db_index=True,
+        help_text="Hash of input files and profile options. Jobs with the "
+        "same fingerprint produce the same output",
+    )
+    duplicate_of = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="duplicates",
+        help_text="Identical job whose output is reused for this job",
+    )
+
+    def get_file_infos(self):
+        """All files that are processed in this job
+
+        Returns
+        -------
+        List[FileInfo]
+        """
+        return list(self.fileondisk_set.all()) + list(self.wadofile_set.all())
+
+    def get_due_file_infos(self):
+        """Files in this job that still need processing and may be tried now.
+        Skips files that are done, that have been given up on and that are
+        waiting for their next retry
+
+        Returns
+        -------
+        List[FileInfo]
+        """
+        due = Q(status__in=[FileInfo.PENDING, FileInfo.FAILED]) & (
+            Q(next_attempt__isnull=True) | Q(next_attempt__lte=timezone.now())
+        )
+        return list(
+            self.fileondisk_set.filter(due).select_related("source")
+        ) + list(self.wadofile_set.filter(due).select_related("source"))
+
+    def update_status_from_files(self):
+        """Set status of this job based on the status of its input files and
+        save.
+
+        The job moves on to PROCESSING when all files have been downloaded,
+        and is ERROR when all files are either downloaded or given up on,
+        with at least one given up on. While any file still needs downloading
+        the job status is not changed, except from PENDING to DOWNLOADING.
+        A job is only DONE once its output has been delivered
+        """
+        file_infos = self.get_file_infos()
+        if not file_infos:
+            return
+        count = Counter(x.status for x in file_infos)
+        self.files_downloaded = count[FileInfo.DONE]
+        if count[FileInfo.PENDING] or count[FileInfo.FAILED]:
+            if self.status == self.PENDING:
+                self.status = self.DOWNLOADING
+        elif count[FileInfo.ERROR]:
+            last_error = next(
+                x.last_error for x in file_infos if x.status == FileInfo.ERROR
+            )
+            self.status = self.ERROR
+            self.error = (
+                f"{count[FileInfo.ERROR]} of {len(file_infos)} files failed. "
+                f"Last error: {last_error}"
+            )[:1024]
+        elif self.status in (self.PENDING, self.DOWNLOADING):
+            self.status = self.PROCESSING
+        self.save(update_fields=["status", "error", "files_downloaded"])
+
+
+class JobSpan(models.Model):
+    """The time a single phase took for a job, and the files it handled.
+    See idis.jobs.tracing"""
+
+    PREFETCH = "PREFETCH"
+    CTP_INPUT = "CTP_INPUT"
+    CTP_OUTPUT = "CTP_OUTPUT"
+    QUARANTINE = "QUARANTINE"
+    DELIVERY = "DELIVERY"
+
+    PHASE_CHOICES = (
+        (PREFETCH, "Prefetch input files"),
+        (CTP_INPUT, "Hand off to CTP"),
+        (CTP_OUTPUT, "Collect CTP output"),
+        (QUARANTINE, "Scrape quarantine"),
+        (DELIVERY, "Deliver output"),
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["started"])]
+
+    def __str__(self):
+        return f"{self.phase} span of {self.job_id}"
+
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.CASCADE,
+        related_name="spans",
+        help_text="The job that this phase ran for",
+    )
+    phase = models.CharField(choices=PHASE_CHOICES, max_length=16)
+    started = models.DateTimeField()
+    finished = models.DateTimeField()
+    file_count = models.IntegerField(
+        default=0, help_text="Number of files handled in this phase"
+    )
+    error = models.CharField(
+        max_length=1024,
+        default="",
+        blank=True,
+        help_text="Error message, if the phase failed",
+    )
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to finish"""
+        return (self.finished - self.started).total_seconds()
+
+    @classmethod
+    def record(cls, phase, started, finished, file_counts, errors=None):
+        """Save a span for each job in file_counts, in one query. Jobs that
+        do not exist are skipped
+
+        Parameters
+        ----------
+        phase: str
+            One of PHASE_CHOICES
+        started: datetime
+            Start of the phase, the same for each job
+        finished: datetime
+            End of the phase, the same for each job
+        file_counts: Dict[int, int]
+            Number of files handled for each job id
+        errors: Dict[int, str], optional
+            Error message per job id. Defaults to no errors
+        """
+        # job ids that come from folder names are strings
+        file_counts = {
+            int(x): y for x, y in file_counts.items() if str(x).isdigit()
+        }
+        errors = {
+            int(x): y for x, y in (errors or {}).items() if str(x).isdigit()
+        }
+        existing = Job.objects.filter(pk__in=list(file_counts)).values_list(
+            "pk", flat=True
+        )
+        return cls.objects.bulk_create(
+            [
+                cls(
+                    job_id=job_id,
+                    phase=phase,
+                    started=started,
+                    finished=finished,
+                    file_count=file_counts[job_id],
+                    error=errors.get(job_id, "")[:1024],
+                )
+                for job_id in existing
+            ]
+        )
 
 
 class Storage(models.Model):
@@ -226,6 +424,45 @@ class Storage(models.Model):
             )
         )
 
+    async def download_many(
+        self, file_infos, folder, max_concurrent=None
+    ) -> List[TransferResult]:
+        """Download all files described in file_infos to folder, running many
+        downloads at the same time. A failed download does not stop the others
+
+        Parameters
+        ----------
+        file_infos: List[FileInfo]
+            information uniquely defining each file to download
+        folder: SafeFolder
+            download to this folder
+        max_concurrent: int, optional
+            Run at most this many downloads at the same time. Defaults to
+            max_parallel_transfers of the child class
+
+        Returns
+        -------
+        List[idis.jobs.transfers.TransferResult]
+            Result for each file_info, in the same order. TransferResult.value
+            is the downloaded JobFile
+
+        """
+        return await transfer_all(
+            lambda x: self.download_file_to(file_info=x, folder=folder),
+            file_infos,
+            max_concurrent=max_concurrent or self.max_parallel_transfers,
+        )
+
+    def download_files_to(
+        self, file_infos, folder, max_concurrent=None
+    ) -> List[TransferResult]:
+        """Blocking version of download_many()"""
+        return run_sync(
+            self.download_many(
+                file_infos, folder=folder, max_concurrent=max_concurrent
+            )
+        )
+
 
 class FileInfo(models.Model):
     """"Describes a single remote file and how to get it.
@@ -235,6 +472,21 @@ class FileInfo(models.Model):
     class Meta:
         abstract = True
 
+    PENDING = "PENDING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    ERROR = "ERROR"
+
+    FILE_STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (DONE, "Done"),
+        (FAILED, "Failed, will retry"),
+        (ERROR, "Error, gave up"),
+    )
+
+    # fields that record processing attempts for this file
+    LEDGER_FIELDS = ["status", "attempts", "last_error", "next_attempt"]
+
     job = models.ForeignKey(
         Job,
         on_delete=models.SET_NULL,
@@ -254,6 +506,63 @@ class FileInfo(models.Model):
         null=True,
         help_text="Optional collection of files that this file belongs to",
     )
+    status = models.CharField(
+        choices=FILE_STATUS_CHOICES, default=PENDING, max_length=32
+    )
+    attempts = models.IntegerField(
+        default=0,
+        blank=True,
+        help_text="Number of failed attempts to process this file",
+    )
+    last_error = models.CharField(
+        max_length=1024,
+        default="",
+        blank=True,
+        help_text="Error message of the last failed attempt, if any",
+    )
+    next_attempt = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Do not retry processing this file before this time",
+    )
+
+    def record_success(self):
+        """Mark this file as done. Does not save"""
+        self.status = self.DONE
+        self.last_error = ""
+        self.next_attempt = None
+
+    def record_failure(self, error, policy):
+        """Register a failed attempt. Schedule a retry, or give up if there
+        have been too many attempts. Does not save
+
+        Parameters
+        ----------
+        error: str
+            What went wrong
+        policy: idis.jobs.retries.RetryPolicy
+            Determines when to retry and when to give up
+        """
+        self.attempts += 1
+        self.last_error = str(error)[:1024]
+        if policy.should_give_up(self.attempts):
+            self.status = self.ERROR
+            self.next_attempt = None
+        else:
+            self.status = self.FAILED
+            self.next_attempt = timezone.now() + policy.get_delay(
+                self.attempts
+            )
+
+    @abc.abstractmethod
+    def get_identifier(self):
+        """String that uniquely identifies the remote file, regardless of job
+
+        Returns
+        -------
+        str
+        """
+        return
 
     @abc.abstractmethod
     def file_name(self):
@@ -311,6 +620,41 @@ class WadoServer(Storage):
         max_length=128, help_text="Connect with this password"
     )
     port = models.IntegerField(help_text="Port to use for connecting")
+    max_parallel_transfers = models.PositiveIntegerField(
+        default=64,
+        help_text="Download at most this many files from this server at the "
+        "same time",
+    )
+
+    # seconds to wait for a response from the server
+    TIMEOUT = 60
+
+    def get_wado_url(self, file_info):
+        """WADO-URI url to retrieve the DICOM object described in file_info
+
+        Parameters
+        ----------
+        file_info: WADOFile
+            information to download a single file from WADO
+
+        Returns
+        -------
+        str
+        """
+        if "://" in self.hostname:
+            base_url = self.hostname
+        else:
+            base_url = f"http://{self.hostname}"
+        query = urlencode(
+            {
+                "requestType": "WADO",
+                "studyUID": file_info.study_uid,
+                "seriesUID": file_info.series_uid,
+                "objectUID": file_info.object_uid,
+                "contentType": "application/dicom",
+            }
+        )
+        return f"{base_url}:{self.port}/wado?{query}"
 
     def download_file_to(self, file_info, folder):
         """Get file described in file_info
@@ -319,7 +663,13 @@ class WadoServer(Storage):
         ----------
         file_info: WADOFile
             information to download a single file from WADO
-        folder: Folder
+        folder: SafeFolder
+            path to download to
+
+        Raises
+        ------
+        FileNotFoundError
+            If file cannot be retrieved
 
         Returns
         -------
@@ -327,9 +677,28 @@ class WadoServer(Storage):
             The file
 
         """
-        # create wado connection
-        # Download to
-        pass
+        request = Request(self.get_wado_url(file_info))
+        if self.username:
+            credentials = base64.b64encode(
+                f"{self.username}:{self.password}".encode()
+            ).decode()
+            request.add_header("Authorization", f"Basic {credentials}")
+
+        # use job_id instead of job to avoid a database query per file
+        job_file = JobFile(job_id=file_info.job_id, path=file_info.file_name())
+        destination_path = folder.get_available_path(job_file)
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with atomic_write_path(destination_path) as write:
+                with urlopen(request, timeout=self.TIMEOUT) as response:
+                    with open(write.temp_path, "wb") as f:
+                        copyfileobj(response, f)
+        except URLError as e:
+            raise FileNotFoundError(
+                f"Could not retrieve {file_info.object_uid} from {self}: {e}"
+            )
+
+        return JobFile(job_id=file_info.job_id, path=write.path)
 
     def send_file(self, job_file, location):
         """Send the given file to the destination
@@ -367,6 +736,10 @@ class NetworkShare(Storage):
         blank=True,
         help_text="Optional. Connect with this password",
     )
+    max_parallel_transfers = models.PositiveIntegerField(
+        default=4,
+        help_text="Send at most this many files to this share at the same time",
+    )
 
     def __str__(self):
         return self.path
@@ -400,8 +773,45 @@ class NetworkShare(Storage):
 
         """
 
-        job_file = JobFile(job_id=file_info.job.id, path=file_info.path)
-        copy_job_file(job_file, destination=folder)
+        # use job_id instead of job to avoid a database query per file
+        job_file = JobFile(job_id=file_info.job_id, path=file_info.path)
+        return JobFile(
+            job_id=file_info.job_id,
+            path=copy_job_file(job_file, destination=folder),
+        )
+
+    def send_file(self, job_file, relative_path="", verify_checksum=False):
+        """Write the given file to a folder on this share. The file only appears
+        in the folder once it has been written completely
+
+        Parameters
+        ----------
+        job_file: idis.jobs.filehandling.JobFile
+            send this file
+        relative_path: str, optional
+            To this folder on the share. Defaults to the root of the share
+        verify_checksum: bool, optional
+            If True, check that the written file is identical to job_file.
+            Defaults to False
+
+        Raises
+        ------
+        idis.jobs.filehandling.ChecksumException
+            If verify_checksum is True and the written file differs
+        OSError
+            If the file cannot be written
+
+        Returns
+        -------
+        Path
+            Full path the file was written to
+
+        """
+        return copy_job_file_atomic(
+            job_file,
+            destination=SafeFolder(Path(self.path) / relative_path),
+            verify_checksum=verify_checksum,
+        )
 
 
 class FileOnDisk(FileInfo):
@@ -418,6 +828,9 @@ class FileOnDisk(FileInfo):
         help_text="Where this data is coming from",
     )
 
+    def get_identifier(self):
+        return f"share:{self.source_id}:{self.path}"
+
     def file_name(self):
         """Returns a filename under which this file can be saved
 
@@ -445,12 +858,24 @@ class WADOFile(FileInfo):
         help_text="UID of the study this file belongs to",
     )
 
+    series_uid = models.CharField(
+        max_length=512,
+        default="",
+        help_text="UID of the series this file belongs to",
+    )
+
     object_uid = models.CharField(
         max_length=512,
         default="",
         help_text="Object Unique Identifier for this file",
     )
 
+    def get_identifier(self):
+        return (
+            f"wado:{self.source_id}:{self.study_uid}/{self.series_uid}/"
+            f"{self.object_uid}"
+        )
+
     def file_name(self):
         """Returns a the filename under which this file can be saved
 
@@ -496,16 +921,67 @@ class Location(models.Model):
             )
         )
 
-    def get_all_files(self):
+    async def send_many(self, files, verify_checksums=False) -> DeliveryReport:
+        """Send all given files to this location, several at the same time.
+        A failing file does not stop the others from being sent.
+
+        Parameters
+        ----------
+        files: List[JobFile]
+            files to send
+        verify_checksums: bool, optional
+            If True, verify the checksum of each file after writing. Defaults
+            to False
+
+        Returns
+        -------
+        DeliveryReport
+            Result for each file. Use DeliveryReport.get_failed_files() to
+            retry only the files that failed
+
+        """
+        raise (
+            NotImplementedError(
+                "This is an abstract base class. Call a child class"
+            )
+        )
+
+    def send_files(self, files, verify_checksums=False) -> DeliveryReport:
+        """Blocking version of send_many(). Records a delivery span for each
+        job that files belong to"""
+        started = timezone.now()
+        report = run_sync(
+            self.send_many(files, verify_checksums=verify_checksums)
+        )
+        failed = Counter(x.job_id for x in report.get_failed_files())
+        JobSpan.record(
+            JobSpan.DELIVERY,
+            started=started,
+            finished=timezone.now(),
+            file_counts=Counter(x.job_id for x in files if x.job_id),
+            errors={x: f"{y} files failed" for x, y in failed.items()},
+        )
+        return report
+
+    def get_all_files(self, file_filter: FileFilter = None):
         """Get all paths to the files at this location
 
+        Parameters
+        ----------
+        file_filter: FileFilter, optional
+            Only return files matching this filter. Defaults to all files
+
         Returns
         -------
-        List<str>
-            list of full paths
+        Iterator[Path]
+            full path to each file
 
         """
-        pass
+        raise (
+            NotImplementedError(
+                "This is an abstract base class. Call a child class"
+            )
+        )
 
 
 class Folder(Location):
@@ -534,17 +1010,78 @@ class Folder(Location):
             file to send
         Returns
         -------
+        Path
+            Full path the file was written to
 
         """
-        self.share.send_file(file, self.relative_path)
+        return self.storage.send_file(file, self.relative_path)
 
-    def get_all_files(self):
-        """Get all paths to the files at this location
+    async def send_many(self, files, verify_checksums=False) -> DeliveryReport:
+        """Send all given files to this location, several at the same time.
+
+        The number of simultaneous transfers is set per share by
+        NetworkShare.max_parallel_transfers. A failing file does not stop the
+        others from being sent.
+
+        Parameters
+        ----------
+        files: List[JobFile]
+            files to send
+        verify_checksums: bool, optional
+            If True, verify the checksum of each file after writing. Defaults
+            to False
+
+        Returns
+        -------
+        DeliveryReport
+            Result for each file. Use DeliveryReport.get_failed_files() to
+            retry only the files that failed
+
+        """
+        # Database queries are not allowed from the event loop
+        share = await sync_to_async(lambda: self.storage)()
+        return await deliver_files_async(
+            files,
+            send_function=lambda x: share.send_file(
+                x, self.relative_path, verify_checksum=verify_checksums
+            ),
+            max_workers=share.max_parallel_transfers,
+        )
+
+    @property
+    def path(self):
+        """Full path to this folder, including share
+
+        Returns
+        -------
+        Path
+        """
+        return Path(self.storage.path) / self.relative_path
+
+    def get_all_files(self, file_filter: FileFilter = None, max_workers=8):
+        """Get all paths to the files in this folder and all its sub folders.
+
+        Files are yielded while the folder tree is still being walked, so
+        processing can start before very large folders have been fully listed.
+
+        Parameters
+        ----------
+        file_filter: FileFilter, optional
+            Only return files matching this filter. Defaults to all files
+        max_workers: int, optional
+            List at most this many sub folders in parallel. Defaults to 8
 
         Returns
         -------
-        List<str>
-            list of full paths
+        Iterator[Path]
+            full path to each file
+
+        Raises
+        ------
+        FileNotFoundError
+            If this folder does not exist
 
         """
-        pass
+        return iterate_files(
+            self.path, file_filter=file_filter, max_workers=max_workers
+        )
@@ -0,0 +1,173 @@
+""" Retrying single files instead of whole jobs
+
+Each FileInfo keeps its own number of attempts, last error and the earliest
+time it may be tried again. Only files that failed are retried, with an
+exponentially growing delay so that a server that is struggling is not
+hammered.
+"""
+import logging
+import random
+from datetime import timedelta
+from itertools import groupby
+from typing import List
+
+from django.conf import settings
+from django.utils import timezone
+
+from idis.jobs.filehandling import SafeFolder
+from idis.jobs.models import JobSpan
+from idis.jobs.tracing import trace
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """How often and how quickly to retry a failing file"""
+
+    def __init__(
+        self, base_delay=30, max_delay=60 * 60, max_attempts=5, jitter=0.5
+    ):
+        """
+
+        Parameters
+        ----------
+        base_delay: float, optional
+            Seconds to wait after the first failure. Doubles with each failure.
+            Defaults to 30
+        max_delay: float, optional
+            Never wait longer than this many seconds. Defaults to one hour
+        max_attempts: int, optional
+            Give up on a file after this many failed attempts. Defaults to 5
+        jitter: float, optional
+            Randomly shorten each delay by up to this fraction, so files
+            that failed together are not all retried at the same moment.
+            Defaults to 0.5
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.jitter = jitter
+
+    @classmethod
+    def from_settings(cls):
+        """The policy defined in django settings"""
+        return cls(
+            base_delay=settings.IDIS_FILE_RETRY_BASE_DELAY,
+            max_delay=settings.IDIS_FILE_RETRY_MAX_DELAY,
+            max_attempts=settings.IDIS_FILE_RETRY_MAX_ATTEMPTS,
+        )
+
+    def get_delay(self, attempts: int) -> timedelta:
+        """How long to wait before the next try
+
+        Parameters
+        ----------
+        attempts: int
+            Number of failed attempts so far
+
+        Returns
+        -------
+        timedelta
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        delay = delay * (1 - random.uniform(0, self.jitter))
+        return timedelta(seconds=delay)
+
+    def should_give_up(self, attempts: int):
+        return attempts >= self.max_attempts
+
+
+def download_job_files(
+    job, folder: SafeFolder, policy: RetryPolicy = None
+) -> List:
+    """Download all files for job that have not been downloaded yet and are
+    eligible for a (re)try. Record the outcome for each file
+
+    Files that succeeded earlier are never downloaded again. Files from the
+    same source are downloaded in parallel.
+
+    Parameters
+    ----------
+    job: Job
+        Download files for this job
+    folder: SafeFolder
+        Download to this folder
+    policy: RetryPolicy, optional
+        Determines when to retry failed files. Defaults to the policy in
+        django settings
+
+    Returns
+    -------
+    List[FileInfo]
+        The file infos that were attempted
+    """
+    policy = policy or RetryPolicy.from_settings()
+    due = job.get_due_file_infos()
+    if due:
+        with trace(job, JobSpan.PREFETCH) as span:
+            span.file_count = len(due)
+            failed = download_file_infos(due, folder=folder, policy=policy)
+            if failed:
+                span.error = f"{failed} of {len(due)} files failed"
+
+    job.update_status_from_files()
+    logger.info(f"Tried {len(due)} files for {job}. Status: {job.status}")
+    return due
+
+
+def download_file_infos(
+    file_infos: List, folder: SafeFolder, policy: RetryPolicy
+):
+    """Download file_infos and record the outcome for each. Files from the
+    same source are downloaded in parallel
+
+    Returns
+    -------
+    int
+        Number of files that failed
+    """
+
+    def source_key(file_info):
+        return type(file_info).__name__, file_info.source_id or 0
+
+    for _, group in groupby(
+        sorted(file_infos, key=source_key), key=source_key
+    ):
+        group = list(group)
+        source = group[0].source
+        if source is None:
+            results = [None] * len(group)
+            error = "File has no source to download from"
+        else:
+            results = source.download_files_to(group, folder=folder)
+            error = None
+        for file_info, result in zip(group, results):
+            if result is not None and result.succeeded:
+                file_info.record_success()
+            else:
+                file_info.record_failure(error or result.error, policy=policy)
+        type(group[0]).objects.bulk_update(
+            group, fields=group[0].LEDGER_FIELDS
+        )
+    return len([x for x in file_infos if x.status != x.DONE])
+
+
+def get_next_attempt(job):
+    """Earliest time any file of job may be retried
+
+    Returns
+    -------
+    datetime or None
+        None if no files are waiting to be retried
+    """
+    waiting = [
+        x.next_attempt
+        for x in job.get_file_infos()
+        if x.status == x.FAILED and x.next_attempt
+    ]
+    return min(waiting) if waiting else None
+
+
+def seconds_until(moment) -> float:
+    """Seconds from now until moment, or 0 if moment has passed"""
+    return max(0.0, (moment - timezone.now()).total_seconds())
@@ -1,7 +1,36 @@
+import logging
 import uuid
+from typing import Iterable
+
 from celery import shared_task
+from django.conf import settings
 
+from idis.jobs.deduplication import (
+    deduplicate_job,
+    resolve_duplicates,
+    retain_output,
+)
+from idis.jobs.filehandling import JobFile, JobFolder
 from idis.jobs.models import Job
+from idis.jobs.retries import (
+    download_job_files,
+    get_next_attempt,
+    seconds_until,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def submit_job(*, job_pk: uuid.UUID):
+    """Start a new job, once all its input files have been added. A job that
+    is identical to an earlier job reuses its output, or waits for it to
+    finish, instead of being processed itself
+    """
+    job = Job.objects.get(pk=job_pk)
+    if deduplicate_job(job):
+        return
+    fetch_job_files.apply_async(kwargs={"job_pk": job_pk})
 
 
 @shared_task
@@ -14,3 +43,63 @@ def process_job(*, job_pk: uuid.UUID):
     # send to CTP
     # wait for all files to come out on the other end
     # copy data
+    # finish_job() with the delivered files
+
+
+@shared_task
+def fetch_job_files(*, job_pk: uuid.UUID):
+    """Download all files for job that still need downloading. If any files
+    failed, schedule this task again for when the first retry is due. Once
+    all files are in, queue processing
+    """
+    job = Job.objects.get(pk=job_pk)
+    if job.duplicate_of:
+        return  # this job reuses the output of another job
+    attempted = download_job_files(
+        job, folder=JobFolder(settings.IDIS_PRE_FETCHING_FOLDER)
+    )
+    if attempted and job.status == Job.PROCESSING:
+        process_job.apply_async(kwargs={"job_pk": job_pk})
+    elif attempted and job.status == Job.ERROR:
+        release_duplicates(job)
+
+    next_attempt = get_next_attempt(job)
+    if next_attempt:
+        fetch_job_files.apply_async(
+            kwargs={"job_pk": job_pk}, countdown=seconds_until(next_attempt)
+        )
+
+
+def finish_job(job: Job, output_files: Iterable[JobFile] = (), error=""):
+    """Mark job DONE once its output has been delivered, or ERROR if error is
+    given. Output is retained for later identical jobs, and jobs waiting for
+    this one are finished or queued again
+
+    Parameters
+    ----------
+    job: Job
+        The job that finished
+    output_files: Iterable[JobFile], optional
+        The output that was delivered. Defaults to no files
+    error: str, optional
+        Why the job failed. Defaults to no error
+    """
+    if error:
+        job.status = Job.ERROR
+        job.error = error[:1024]
+    else:
+        retain_output(job, output_files)
+        job.status = Job.DONE
+    job.save(update_fields=["status", "error"])
+    release_duplicates(job)
+
+
+def release_duplicates(job: Job):
+    """Hand the outcome of job, which has finished, to the jobs waiting for it.
+    Waiting jobs that cannot reuse its output are fetched and processed by
+    themselves
+    """
+    for waiting in resolve_duplicates(job):
+        if waiting.duplicate_of is None:
+            logger.info(f"Queueing {waiting}, which was waiting for {job}")
+            fetch_job_files.apply_async(kwargs={"job_pk": waiting.pk})
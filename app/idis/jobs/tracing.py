@@ -0,0 +1,129 @@
+""" Timing the phases of jobs
+
+A job goes through prefetching its input files, hand-off to CTP, collecting
+the CTP output, scraping of the CTP quarantine and delivery. Each time a phase
+runs for a job, a JobSpan records when it started and finished and how many
+files it handled. A span is written in a single query when its phase ends.
+
+Phases that handle many jobs at once, such as scraping the quarantine, record
+a span for each job they handled, all with the same start and finish.
+
+Percentiles of span durations per profile and phase show how long each phase
+usually takes, for planning capacity.
+"""
+import logging
+import math
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+from idis.jobs.models import Job, JobSpan
+
+if TYPE_CHECKING:
+    # imports pydicom, which web and worker processes should not load on start
+    from idis.jobs.ctp import IDISCTPQuarantine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+@contextmanager
+def trace(job: Job, phase: str):
+    """Record a span for phase of job, covering the with block. Set
+    file_count on the yielded span to record the files handled.
+
+    If the block raises, the span is recorded with the error and the
+    exception is raised again. Failing to save the span is logged only
+
+    Yields
+    ------
+    JobSpan
+        The span, saved when the block ends
+    """
+    span = JobSpan(job=job, phase=phase, started=timezone.now())
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)[:1024]
+        raise
+    finally:
+        span.finished = timezone.now()
+        try:
+            span.save()
+        except DatabaseError as e:
+            logger.warning(f"Could not save {span}: {e}")
+
+
+def scrape_quarantine(quarantine: "IDISCTPQuarantine") -> List[JobSpan]:
+    """Scrape quarantine and record a quarantine span for each job that had
+    files in it
+
+    Returns
+    -------
+    List[JobSpan]
+        The spans recorded
+    """
+    started = timezone.now()
+    job_files = quarantine.scrape()
+    return JobSpan.record(
+        JobSpan.QUARANTINE,
+        started=started,
+        finished=timezone.now(),
+        file_counts=Counter(x.job_id for x in job_files if x.job_id),
+    )
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """The p-th percentile of sorted values, interpolating between the two
+    nearest values"""
+    if not values:
+        return math.nan
+    rank = (len(values) - 1) * p / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def get_phase_percentiles(
+    since: Optional[datetime] = None,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Percentiles of span durations in seconds, per profile and phase
+
+    Parameters
+    ----------
+    since: datetime, optional
+        Only use spans that started after this. Defaults to all spans
+    percentiles: Sequence[float], optional
+        Percentiles to calculate. Defaults to 50, 90 and 99
+
+    Returns
+    -------
+    Dict[str, Dict[str, Dict[str, float]]]
+        profile title: phase: statistic: value. Statistics are 'count' and
+        'p<percentile>' for each percentile. Jobs without profile are under
+        an empty title
+    """
+    spans = JobSpan.objects.all()
+    if since:
+        spans = spans.filter(started__gte=since)
+    durations = defaultdict(list)
+    for title, phase, started, finished in spans.values_list(
+        "job__profile__title", "phase", "started", "finished"
+    ):
+        durations[(title or "", phase)].append(
+            (finished - started).total_seconds()
+        )
+
+    result = defaultdict(dict)
+    for (title, phase), values in sorted(durations.items()):
+        values.sort()
+        stats = {"count": len(values)}
+        for p in percentiles:
+            stats[f"p{p:g}"] = percentile(values, p)
+        result[title][phase] = stats
+    return dict(result)
@@ -0,0 +1,109 @@
+""" Running many file transfers at the same time from asyncio code
+
+Downloading from WADO servers and copying to and from shares is dominated by
+latency, not bandwidth. Running hundreds of transfers at the same time in a
+single worker process makes much better use of the connection than sending
+files one by one.
+
+The transfer functions themselves are regular blocking functions, like
+Storage.download_file_to. They are run in a thread pool from the event loop.
+This keeps them usable from synchronous code and out of the event loop
+thread, where Django would not allow database access.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TransferResult:
+    """Outcome of transferring a single item"""
+
+    def __init__(self, item, value=None, error: Optional[str] = None):
+        """
+
+        Parameters
+        ----------
+        item:
+            The thing that was transferred, like a FileInfo or JobFile
+        value: optional
+            Whatever the transfer function returned. None if transfer failed
+        error: str, optional
+            What went wrong. None if transfer succeeded
+        """
+        self.item = item
+        self.value = value
+        self.error = error
+
+    def __str__(self):
+        if self.succeeded:
+            return f"Transferred {self.item}"
+        else:
+            return f"Transfer of {self.item} failed: {self.error}"
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+async def transfer_all(
+    function: Callable[[Any], Any], items: Iterable, max_concurrent: int
+) -> List[TransferResult]:
+    """Call function on each item, running at most max_concurrent at the same
+    time. A failing item does not stop the others.
+
+    Parameters
+    ----------
+    function: Callable
+        Blocking function that transfers a single item. Should raise an
+        exception if transfer fails
+    items: Iterable
+        Transfer each of these
+    max_concurrent: int
+        Run at most this many transfers at the same time
+
+    Returns
+    -------
+    List[TransferResult]
+        One result for each item, in the same order as items
+
+    """
+    loop = asyncio.get_event_loop()
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+
+        async def transfer(item):
+            try:
+                value = await loop.run_in_executor(executor, function, item)
+                return TransferResult(item, value=value)
+            except Exception as e:
+                logger.warning(f"Transfer of {item} failed: {e}")
+                return TransferResult(item, error=str(e))
+
+        return list(await asyncio.gather(*(transfer(x) for x in items)))
+
+
+def run_sync(coroutine: Coroutine):
+    """Run coroutine to completion and return its result. For calling the
+    async transfer methods from regular code like celery tasks
+
+    Works both with and without an event loop running in the current thread.
+
+    Parameters
+    ----------
+    coroutine: Coroutine
+        The coroutine to run
+
+    Returns
+    -------
+    Whatever coroutine returns
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # Called from inside an event loop, which cannot be blocked on itself.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
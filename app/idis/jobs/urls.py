@@ -4,4 +4,6 @@ from . import views
 app_name = "jobs"
 urlpatterns = [
     path("", views.index, name="index"),
+    path("<int:pk>/timeline/", views.job_timeline, name="job_timeline"),
+    path("timings/", views.phase_timings, name="phase_timings"),
 ]
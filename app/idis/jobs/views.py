@@ -1,6 +1,61 @@
+from datetime import timedelta
+
+from django.contrib.auth.decorators import login_required
 from django.http.response import HttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+
+from idis.jobs.models import Job, JobSpan
+from idis.jobs.tracing import get_phase_percentiles
 
 
 # Create your views here.
 def index(request):
     return HttpResponse("Hello, world. You're at the jobs index.")
+
+
+@login_required
+def job_timeline(request, pk):
+    """The phases of a single job on a time line, starting when the job was
+    created"""
+    job = get_object_or_404(Job, pk=pk)
+    spans = list(job.spans.order_by("started"))
+    start = min([job.created] + [x.started for x in spans])
+    end = max([start] + [x.finished for x in spans])
+    total = (end - start).total_seconds()
+    scale = 100 / total if total else 0
+    rows = [
+        {
+            "span": x,
+            "offset": (x.started - start).total_seconds() * scale,
+            # wide enough to see, also for very short spans
+            "width": max(x.duration * scale, 0.5),
+        }
+        for x in spans
+    ]
+    return render(
+        request,
+        "jobs/job_timeline.html",
+        {"job": job, "rows": rows, "total_seconds": total},
+    )
+
+
+@login_required
+def phase_timings(request):
+    """Percentiles of the duration of each phase, per profile"""
+    try:
+        days = int(request.GET.get("days", 30))
+    except ValueError:
+        days = 30
+    percentiles = get_phase_percentiles(
+        since=timezone.now() - timedelta(days=days)
+    )
+    phases = dict(JobSpan.PHASE_CHOICES)
+    rows = [
+        {"profile": profile, "phase": phases.get(phase, phase), **stats}
+        for profile, per_phase in percentiles.items()
+        for phase, stats in per_phase.items()
+    ]
+    return render(
+        request, "jobs/phase_timings.html", {"rows": rows, "days": days}
+    )
@@ -0,0 +1 @@
+default_app_config = "idis.pipeline.apps.PipelineConfig"
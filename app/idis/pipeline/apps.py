@@ -2,4 +2,13 @@ from django.apps import AppConfig
 
 
 class PipelineConfig(AppConfig):
-    name = "pipeline"
+    name = "idis.pipeline"
+
+    def ready(self):
+        # connect signal receivers
+        import idis.pipeline.signals  # noqa: F401
+        from django.conf import settings
+        from idis.pipeline.coordination import check_lock_url
+
+        # fail on start, not on every pipeline run
+        check_lock_url(settings.PIPELINE_LOCK_URL)
@@ -0,0 +1,198 @@
+""" Building the pipeline that the tasks in idis.pipeline.tasks run
+
+This imports anonapi, idissend and sqlalchemy. Keep it out of module level
+imports of anything that every web or worker process loads, so that processes
+which never run the pipeline start quickly. See docs/for_developers.rst
+"""
+from functools import partial
+from pathlib import Path
+from typing import List, Optional
+
+from anonapi.objects import RemoteAnonServer
+from anonapi.paths import UNCMapping, UNCMap, UNCPath
+from django.conf import settings
+from idissend.core import Stage
+from idissend.pipeline import IDISPipeline
+from idissend.stages import IDISConnection
+
+from idis.pipeline.cache import PipelineCache
+from idis.pipeline.client import PooledAnonClientTool
+from idis.pipeline.dispatch import ServerDispatcher
+from idis.pipeline.duplicates import DuplicateFilter
+from idis.pipeline.models import Stream
+from idis.pipeline.records import get_records
+from idis.pipeline.stages import (
+    BackgroundTrash,
+    BatchedPendingAnon,
+    GroupingCoolDown,
+    IndexedCoolDown,
+)
+from idis.pipeline.tasks import get_trash_path
+
+# minutes that anonymized studies are kept in the finished stage
+FINISHED_COOL_DOWN = 2 * 60 * 24  # 2 days
+
+
+def get_pipeline() -> IDISPipeline:
+    """The pipeline for this process. Only built again when streams or profiles
+    have changed
+    """
+    return pipeline_cache.get()
+
+
+def get_stream_pipeline(stream_pk: int) -> IDISPipeline:
+    """A pipeline handling only the stream with stream_pk. Cached like
+    get_pipeline()
+    """
+    if stream_pk not in stream_pipeline_caches:
+        stream_pipeline_caches[stream_pk] = PipelineCache(
+            build_function=partial(init_stream_pipeline, stream_pk)
+        )
+    return stream_pipeline_caches[stream_pk].get()
+
+
+def init_stream_pipeline(stream_pk: int) -> IDISPipeline:
+    """Initialise a default pipeline for a single stream"""
+    return init_pipeline(
+        streams=[
+            Stream.objects.select_related("idis_profile").get(pk=stream_pk)
+        ]
+    )
+
+
+def init_pipeline(streams: Optional[List[Stream]] = None) -> IDISPipeline:
+    """Initialise a default pipeline based on django settings
+
+    Parameters
+    ----------
+    streams: List[Stream], optional
+        Handle only these streams. Defaults to all streams
+    """
+
+    # parameters #
+    BASE_PATH = Path(
+        settings.PIPELINE_BASE_PATH
+    )  # all data for all stages goes here
+    STAGES_BASE_PATH = BASE_PATH / "stages"
+
+    # use this to identify with IDIS web API
+    IDIS_USERNAME = settings.PIPELINE_IDIS_USERNAME
+    IDIS_TOKEN = settings.PIPELINE_IDIS_TOKEN
+
+    # Talk to IDIS through these servers
+    IDIS_WEB_API_SERVERS = settings.PIPELINE_IDIS_WEB_API_SERVERS
+
+    RECORDS_DB_URL = settings.PIPELINE_RECORDS_DB_URL
+
+    # init #
+    STAGES_BASE_PATH.mkdir(
+        parents=True, exist_ok=True
+    )  # assert base dir exists
+
+    # Indicate which local paths correspond to which UNC paths.
+    # This makes it possible to expose local data to IDIS servers
+    unc_mapping = UNCMapping(
+        [
+            UNCMap(
+                local=Path(settings.PIPELINE_LOCAL_PATH),
+                unc=UNCPath(settings.PIPELINE_UNC_PATH),
+            )
+        ]
+    )
+
+    # streams #
+    # the different routes data can take through the pipeline. Data will always stay
+    # inside the same stream
+    if streams is None:
+        streams = list(Stream.objects.select_related("idis_profile"))
+
+    # stages #
+    # data in one stream goes through one or more of these stages
+    duplicate_filter = None
+    if settings.PIPELINE_DROP_DUPLICATES:
+        # forget files once their anonymized study has been cleaned up
+        duplicate_filter = DuplicateFilter(ttl=FINISHED_COOL_DOWN * 60)
+    if settings.PIPELINE_GROUP_LOOSE_FILES:
+        incoming = GroupingCoolDown(
+            name="incoming",
+            path=STAGES_BASE_PATH / "incoming",
+            streams=streams,
+            cool_down=5,
+            min_age=settings.PIPELINE_GROUPING_MIN_AGE,
+            duplicate_filter=duplicate_filter,
+        )
+    else:
+        incoming = IndexedCoolDown(
+            name="incoming",
+            path=STAGES_BASE_PATH / "incoming",
+            streams=streams,
+            cool_down=5,
+            duplicate_filter=duplicate_filter,
+        )
+
+    cooled_down = Stage(
+        name="cooled_down",
+        path=STAGES_BASE_PATH / "cooled_down",
+        streams=streams,
+    )
+
+    client_tool = PooledAnonClientTool(
+        username=IDIS_USERNAME,
+        token=IDIS_TOKEN,
+        pool_size=settings.PIPELINE_IDIS_MAX_CONCURRENT_REQUESTS,
+    )
+    servers = [
+        RemoteAnonServer(name=name, url=url)
+        for name, url in IDIS_WEB_API_SERVERS
+    ]
+    connection = IDISConnection(client_tool=client_tool, servers=servers)
+    dispatcher = ServerDispatcher(
+        servers=servers,
+        client_tool=client_tool,
+        retry_interval=settings.PIPELINE_IDIS_SERVER_RETRY_INTERVAL,
+        max_in_flight=settings.PIPELINE_IDIS_SERVER_MAX_IN_FLIGHT,
+    )
+
+    records = get_records(RECORDS_DB_URL)
+
+    pending = BatchedPendingAnon(
+        name="pending",
+        path=STAGES_BASE_PATH / "pending",
+        streams=streams,
+        idis_connection=connection,
+        records=records,
+        unc_mapping=unc_mapping,
+        max_concurrent=settings.PIPELINE_IDIS_MAX_CONCURRENT_REQUESTS,
+        max_poll_interval=settings.PIPELINE_STATUS_POLL_MAX_INTERVAL,
+        dispatcher=dispatcher,
+        max_in_flight_per_stream=settings.PIPELINE_STREAM_MAX_IN_FLIGHT,
+    )
+
+    errored = Stage(
+        name="errored", path=STAGES_BASE_PATH / "errored", streams=streams
+    )
+
+    finished = IndexedCoolDown(
+        name="finished",
+        path=STAGES_BASE_PATH / "finished",
+        streams=streams,
+        cool_down=FINISHED_COOL_DOWN,
+    )
+
+    trash = BackgroundTrash(
+        name="trash", path=get_trash_path(), streams=streams
+    )
+
+    pipeline = IDISPipeline(
+        incoming=incoming,
+        cooled_down=cooled_down,
+        pending=pending,
+        finished=finished,
+        trash=trash,
+        errored=errored,
+    )
+    return pipeline
+
+
+pipeline_cache = PipelineCache(build_function=init_pipeline)
+stream_pipeline_caches = {}
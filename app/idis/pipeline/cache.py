@@ -0,0 +1,76 @@
+""" Keeping a built pipeline around between runs
+
+Building a pipeline queries all streams and creates stage objects, an IDIS
+client and a records database session maker. This is wasteful to do on every
+run when nothing has changed. Each worker process keeps the pipeline it built.
+When streams or profiles change, a version stamp in the django cache is
+changed, so that all processes know to build a new pipeline.
+"""
+import uuid
+
+from django.core.cache import cache
+
+PIPELINE_VERSION_CACHE_KEY = "idis.pipeline.config_version"
+
+
+def get_config_version():
+    """Current version stamp of the pipeline configuration
+
+    Returns
+    -------
+    str or None
+        None if the cache cannot be reached
+    """
+    version = cache.get(PIPELINE_VERSION_CACHE_KEY)
+    if version is None:
+        # first process to ask. Make sure all processes agree from now on
+        cache.add(PIPELINE_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(PIPELINE_VERSION_CACHE_KEY)
+    return version
+
+
+def invalidate_pipelines():
+    """Make all processes build a new pipeline before their next run"""
+    cache.set(PIPELINE_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+    for pipeline_cache in PipelineCache.instances:
+        pipeline_cache.clear()
+
+
+class PipelineCache:
+    """Holds a single built pipeline for this process. Builds a new one when
+    the configuration version has changed
+
+    """
+
+    # all caches in this process. Cleared directly on invalidation, so changes
+    # are picked up in this process even if the django cache is unreachable
+    instances = []
+
+    def __init__(self, build_function):
+        """
+
+        Parameters
+        ----------
+        build_function: Callable[[], IDISPipeline]
+            Builds a new pipeline
+        """
+        self.build_function = build_function
+        self.pipeline = None
+        self.version = None
+        self.instances.append(self)
+
+    def get(self):
+        """The cached pipeline, or a newly built one if configuration changed
+
+        Returns
+        -------
+        IDISPipeline
+        """
+        version = get_config_version()
+        if self.pipeline is None or version != self.version:
+            self.pipeline = self.build_function()
+            self.version = version
+        return self.pipeline
+
+    def clear(self):
+        self.pipeline = None
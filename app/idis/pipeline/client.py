@@ -0,0 +1,53 @@
+""" Talking to the IDIS web API
+
+"""
+import requests
+from anonapi.client import AnonClientTool
+from requests.adapters import HTTPAdapter
+
+
+class PooledAnonClientTool(AnonClientTool):
+    """An AnonClientTool that keeps connections to IDIS servers open.
+
+    AnonClientTool opens a new HTTPS connection for every API call. This tool
+    sends all calls through a single requests session instead, so that
+    connections are reused between calls and between pipeline runs.
+    """
+
+    def __init__(self, username, token, validate_https=True, pool_size=8):
+        """
+
+        Parameters
+        ----------
+        username: str
+            use this when calling API
+        token:
+            API token to use when calling API
+        validate_https: bool, optional
+            If false, ignore all ssl errors
+        pool_size: int, optional
+            Keep at most this many connections open per server. Set this to
+            the number of calls that can be made at the same time. Defaults
+            to 8
+        """
+        super().__init__(
+            username=username, token=token, validate_https=validate_https
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.clients = {}
+
+    def get_client(self, url):
+        """API client for url that uses the shared session
+
+        Returns
+        -------
+        WebAPIClient
+        """
+        if url not in self.clients:
+            client = super().get_client(url)
+            client.requestslib = self.session
+            self.clients[url] = client
+        return self.clients[url]
@@ -0,0 +1,173 @@
+""" Coordinating pipeline runs between celery worker processes
+
+Pipeline runs take locks so that no two runs handle the same files at the same
+time. Run statistics are kept next to the locks so that every worker reports
+the same numbers.
+
+Which backend is used depends on settings.PIPELINE_LOCK_URL:
+
+* redis://...  Locks and statistics in redis. Works across hosts
+* memory://    Locks and statistics in this process only. For testing and
+               single process setups
+
+PIPELINE_LOCK_URL defaults to the celery broker url. Other values are refused
+when django starts, see check_lock_url.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict
+
+import redis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "idis.pipeline.stats"
+REDIS_SCHEMES = ("redis://", "rediss://", "unix://")
+
+
+class MemoryCoordinator:
+    """Locks and statistics in memory. Only coordinates threads within this
+    process"""
+
+    def __init__(self):
+        self.locks = {}
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def get_lock(self, name: str, timeout: int):
+        """A lock with name. Has the same interface as threading.Lock
+
+        Parameters
+        ----------
+        name: str
+            Locks with the same name exclude each other
+        timeout: int
+            Ignored. Memory locks cannot outlive the process holding them
+        """
+        with self.mutex:
+            return self.locks.setdefault(name, threading.Lock())
+
+    def incr(self, key: str, amount: float = 1):
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set_value(self, key: str, value: float):
+        with self.mutex:
+            self.values[key] = value
+
+    def get_values(self) -> Dict[str, float]:
+        with self.mutex:
+            return dict(self.values)
+
+
+class RedisCoordinator:
+    """Locks and statistics in redis. Coordinates all processes using the
+    same redis server"""
+
+    def __init__(self, url: str):
+        self.redis = redis.Redis.from_url(url)
+
+    def get_lock(self, name: str, timeout: int):
+        """A redis lock with name. Has the same interface as threading.Lock
+
+        Parameters
+        ----------
+        name: str
+            Locks with the same name exclude each other
+        timeout: int
+            Release lock automatically after this many seconds. Makes sure a
+            crashed worker cannot hold a lock forever
+        """
+        return self.redis.lock(name, timeout=timeout)
+
+    def incr(self, key: str, amount: float = 1):
+        self.redis.hincrbyfloat(STATS_KEY, key, amount)
+
+    def set_value(self, key: str, value: float):
+        self.redis.hset(STATS_KEY, key, value)
+
+    def get_values(self) -> Dict[str, float]:
+        return {
+            key.decode(): float(value)
+            for key, value in self.redis.hgetall(STATS_KEY).items()
+        }
+
+
+@lru_cache(maxsize=None)
+def get_coordinator_for_url(url: str):
+    """Coordinator for url. Only one is created per url per process
+
+    Raises
+    ------
+    ValueError
+        If url scheme is not supported
+    """
+    if url.startswith("memory://"):
+        return MemoryCoordinator()
+    elif url.startswith(REDIS_SCHEMES):
+        return RedisCoordinator(url)
+    else:
+        raise ValueError(
+            f"Unsupported PIPELINE_LOCK_URL '{url}'. Use redis:// or memory://"
+        )
+
+
+def check_lock_url(url: str):
+    """Make sure pipeline runs can be coordinated through url
+
+    Raises
+    ------
+    ImproperlyConfigured
+        If url scheme is not supported
+    """
+    if not url.startswith(("memory://",) + REDIS_SCHEMES):
+        raise ImproperlyConfigured(
+            f"Unsupported PIPELINE_LOCK_URL '{url}'. This defaults to "
+            f"CELERY_BROKER_URL. Set PIPELINE_LOCK_URL to a redis:// url, or "
+            f"to memory:// when running a single worker process"
+        )
+
+
+def get_coordinator():
+    """The coordinator configured in settings.PIPELINE_LOCK_URL
+
+    Returns
+    -------
+    MemoryCoordinator or RedisCoordinator
+    """
+    return get_coordinator_for_url(settings.PIPELINE_LOCK_URL)
+
+
+@contextmanager
+def try_lock(name: str, timeout: int):
+    """Try to take the lock with name without waiting for it
+
+    Parameters
+    ----------
+    name: str
+        Name of the lock
+    timeout: int
+        Release lock automatically after this many seconds
+
+    Yields
+    ------
+    bool
+        True if the lock was taken, False if it is held by someone else
+    """
+    lock = get_coordinator().get_lock(name, timeout=timeout)
+    acquired = lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                logger.warning(
+                    f"Lock '{name}' expired after {timeout} seconds, before "
+                    f"it was released"
+                )
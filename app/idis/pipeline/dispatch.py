@@ -0,0 +1,185 @@
+""" Spreading new IDIS jobs over several IDIS servers
+
+Each new job goes to the healthy server with the lowest expected wait. This
+is estimated from the number of jobs the pipeline has in flight on each server
+and the recent response time of each server. A server that cannot be reached
+is left alone for a while, then checked before it is used again.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from anonapi.client import AnonClientTool, ServerNotResponding
+from anonapi.objects import RemoteAnonServer
+
+logger = logging.getLogger(__name__)
+
+
+class ServerStats:
+    """What the dispatcher knows about a single server"""
+
+    def __init__(self):
+        self.queue_depth = 0
+        self.latency: Optional[float] = None  # seconds, moving average
+        self.failures = 0
+        self.retry_after = 0.0  # unix time. Do not use before this
+
+    def is_healthy(self, now: float) -> bool:
+        return self.failures == 0 or now >= self.retry_after
+
+
+class ServerDispatcher:
+    """Chooses an IDIS server for each new job"""
+
+    # weight of the newest latency measurement in the moving average
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(
+        self,
+        servers: List[RemoteAnonServer],
+        client_tool: AnonClientTool,
+        retry_interval: int = 60,
+        max_retry_interval: int = 600,
+        max_in_flight: int = 0,
+    ):
+        """
+
+        Parameters
+        ----------
+        servers: List[RemoteAnonServer]
+            Choose from these servers
+        client_tool: AnonClientTool
+            For checking whether a failed server is back
+        retry_interval: int, optional
+            Seconds to wait before checking a failed server again. Doubles with
+            each failure in a row. Defaults to 60
+        max_retry_interval: int, optional
+            Never wait longer than this many seconds. Defaults to 600
+        max_in_flight: int, optional
+            Never choose a server that has this many jobs in flight. 0 means
+            no limit. Defaults to 0
+        """
+        self.servers = servers
+        self.client_tool = client_tool
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_in_flight = max_in_flight
+        self.stats: Dict[str, ServerStats] = {
+            x.name: ServerStats() for x in servers
+        }
+        self.lock = threading.Lock()
+
+    def set_queue_depths(self, queue_depths: Dict[str, int]):
+        """Set number of jobs in flight per server name"""
+        with self.lock:
+            for name, stats in self.stats.items():
+                stats.queue_depth = queue_depths.get(name, 0)
+
+    def choose(
+        self, exclude: Iterable[str] = (), now: Optional[float] = None
+    ) -> Optional[RemoteAnonServer]:
+        """The server that should get the next job. Counts the job as in
+        flight on that server
+
+        Parameters
+        ----------
+        exclude: Iterable[str]
+            Never choose servers with these names
+        now: float, optional
+            Unix time. Defaults to current time
+
+        Returns
+        -------
+        RemoteAnonServer or None
+            None if all servers are full or unavailable
+        """
+        now = time.time() if now is None else now
+        candidates = [
+            x
+            for x in self.servers
+            if x.name not in exclude
+            and not self.is_full(x)
+            and self.check_health(x, now)
+        ]
+        if not candidates:
+            return None
+        with self.lock:
+            chosen = min(candidates, key=self.get_expected_wait)
+            self.stats[chosen.name].queue_depth += 1
+        return chosen
+
+    def is_full(self, server: RemoteAnonServer) -> bool:
+        """Has server reached its maximum number of jobs in flight?"""
+        return bool(
+            self.max_in_flight
+            and self.stats[server.name].queue_depth >= self.max_in_flight
+        )
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """Number of jobs in flight per server name"""
+        return {name: x.queue_depth for name, x in self.stats.items()}
+
+    def get_expected_wait(self, server: RemoteAnonServer) -> float:
+        """Relative measure for how long a new job on server would wait"""
+        stats = self.stats[server.name]
+        known = [x.latency for x in self.stats.values() if x.latency]
+        default_latency = sum(known) / len(known) if known else 1.0
+        return (stats.queue_depth + 1) * (stats.latency or default_latency)
+
+    def check_health(self, server: RemoteAnonServer, now: float) -> bool:
+        """Is server usable? Servers that failed before are asked for their
+        status once their waiting time is over"""
+        stats = self.stats[server.name]
+        if stats.failures == 0:
+            return True
+        if not stats.is_healthy(now):
+            return False
+        status = self.client_tool.get_server_status(server)
+        if status.startswith("OK"):
+            logger.info(f"{server} is back")
+            with self.lock:
+                stats.failures = 0
+            return True
+        self.record_failure(server.name, now=now)
+        return False
+
+    def record_success(self, server_name: str, latency: float):
+        """A call to server took latency seconds"""
+        with self.lock:
+            stats = self.stats[server_name]
+            stats.failures = 0
+            if stats.latency is None:
+                stats.latency = latency
+            else:
+                stats.latency += self.LATENCY_SMOOTHING * (
+                    latency - stats.latency
+                )
+
+    def record_failure(self, server_name: str, now: Optional[float] = None):
+        """Server could not be reached. Do not use it for a while"""
+        now = time.time() if now is None else now
+        with self.lock:
+            stats = self.stats[server_name]
+            stats.failures += 1
+            wait = min(
+                self.retry_interval * 2 ** (stats.failures - 1),
+                self.max_retry_interval,
+            )
+            stats.retry_after = now + wait
+        logger.warning(
+            f"IDIS server {server_name} failed {stats.failures} times in a "
+            f"row. Not using it for {wait} seconds"
+        )
+
+
+def is_unreachable(exception: Exception) -> bool:
+    """Was exception caused by a server not responding at all?
+
+    idissend wraps anonapi exceptions, so the cause is looked up as well
+    """
+    while exception is not None:
+        if isinstance(exception, ServerNotResponding):
+            return True
+        exception = exception.__cause__ or exception.__context__
+    return False
@@ -0,0 +1,158 @@
+""" Dropping DICOM files that have been through the pipeline already
+
+Modalities often send a whole study again after a network problem. Without
+checking, each resent file would be anonymized a second time. DuplicateFilter
+keeps the SOPInstanceUID and a hash of the content of each file that has left
+the incoming stage, per stream. A file with the same UID and the same content
+is an exact duplicate and is deleted before it reaches pending, unless it is
+the very same file (same inode) that was seen before. A file with a known UID
+but different content is kept, as it might be a correction.
+
+Entries are kept in the database for as long as anonymized studies are kept in
+the finished stage, and are then evicted.
+"""
+import hashlib
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Tuple
+
+from django.utils import timezone
+from idissend.core import Study
+
+from idis.pipeline.grouping import read_instance
+from idis.pipeline.models import IndexedInstance, SeenInstance
+
+logger = logging.getLogger(__name__)
+
+# read files in chunks of this many bytes when hashing
+CHUNK_SIZE = 2 ** 20
+
+
+class DuplicateFilter:
+    """Deletes files from a study that have been seen before in its stream"""
+
+    def __init__(self, ttl: int = 2 * 24 * 3600, max_workers: int = 8):
+        """
+
+        Parameters
+        ----------
+        ttl: int, optional
+            Forget files that were first seen more than this many seconds
+            ago. Defaults to 2 days
+        max_workers: int, optional
+            Hash at most this many files at the same time. Defaults to 8
+        """
+        self.ttl = timedelta(seconds=ttl)
+        self.max_workers = max_workers
+
+    def filter_study(self, study: Study) -> bool:
+        """Delete all exact duplicates in study, and remember the other files.
+        Deletes the study folder if nothing is left
+
+        Returns
+        -------
+        bool
+            True if anything is left of study
+        """
+        path = study.get_path()
+        files = [x for x in path.rglob("*") if x.is_file()]
+        # UIDs of files that were grouped. Their headers need not be read
+        indexed = dict(
+            IndexedInstance.objects.filter(
+                stream=study.stream, study_id=study.study_id
+            ).values_list("file_name", "sop_instance_uid")
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            identified = list(
+                executor.map(
+                    lambda x: identify(
+                        x, indexed.get(str(x.relative_to(path)))
+                    ),
+                    files,
+                )
+            )
+        identified = [x for x in identified if x[1]]  # only DICOM
+        # inode of the first file seen with each uid and hash. The same file
+        # can be checked more than once if its study stays in incoming
+        seen = {
+            (uid, content_hash): inode
+            for uid, content_hash, inode in SeenInstance.objects.filter(
+                stream=study.stream,
+                sop_instance_uid__in=[uid for _, uid, _ in identified],
+            ).values_list("sop_instance_uid", "content_hash", "inode")
+        }
+
+        duplicates, new = [], []
+        for file, uid, content_hash in identified:
+            inode = file.stat().st_ino
+            if (uid, content_hash) in seen:
+                if seen[(uid, content_hash)] != inode:
+                    duplicates.append(file)
+            else:
+                seen[(uid, content_hash)] = inode
+                new.append(
+                    SeenInstance(
+                        stream=study.stream,
+                        sop_instance_uid=uid,
+                        content_hash=content_hash,
+                        inode=inode,
+                    )
+                )
+        SeenInstance.objects.bulk_create(new, ignore_conflicts=True)
+
+        for file in duplicates:
+            file.unlink()
+        if duplicates:
+            logger.info(
+                f"Dropped {len(duplicates)} files from {study} that were "
+                f"sent before"
+            )
+        if duplicates and len(duplicates) == len(files):
+            shutil.rmtree(path)
+            return False
+        return True
+
+    def evict(self):
+        """Forget files that were first seen longer ago than ttl"""
+        SeenInstance.objects.filter(
+            first_seen__lt=timezone.now() - self.ttl
+        ).delete()
+
+
+def identify(
+    path: Path, uid: Optional[str] = None
+) -> Tuple[Path, Optional[str], Optional[str]]:
+    """SOPInstanceUID and content hash of the file at path
+
+    Parameters
+    ----------
+    path: Path
+        The file to identify
+    uid: str, optional
+        SOPInstanceUID of the file, if known already. Defaults to reading it
+        from the header
+
+    Returns
+    -------
+    Tuple[Path, Optional[str], Optional[str]]
+        path, SOPInstanceUID and content hash. UID and hash are None if path
+        is not a DICOM file
+    """
+    if not uid:
+        instance = read_instance(path)
+        if not instance:
+            return path, None, None
+        uid = instance.sop_instance_uid
+    return path, uid, get_content_hash(path)
+
+
+def get_content_hash(path: Path) -> str:
+    """sha256 of the contents of the file at path"""
+    content_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
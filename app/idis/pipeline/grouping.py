@@ -0,0 +1,194 @@
+""" Grouping loose DICOM files into a folder per study
+
+Some modalities push loose files into the incoming folder of a stream, in no
+particular order. The pipeline sees each folder as a study, so these files
+have to be put in a folder per study first. Only the UIDs at the start of the
+header of each file are read for this, never the pixel data. The UIDs are kept
+in the database as IndexedInstance so that later steps do not have to read
+the files again.
+"""
+import filecmp
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import pydicom
+from pydicom.errors import InvalidDicomError
+
+from idis.pipeline.models import IndexedInstance
+
+logger = logging.getLogger(__name__)
+
+UID_TAGS = ["StudyInstanceUID", "SeriesInstanceUID", "SOPInstanceUID"]
+
+
+class DICOMInstance:
+    """The UIDs of a single DICOM file"""
+
+    def __init__(
+        self,
+        path: Path,
+        study_instance_uid: str,
+        series_instance_uid: str,
+        sop_instance_uid: str,
+    ):
+        self.path = path
+        self.study_instance_uid = study_instance_uid
+        self.series_instance_uid = series_instance_uid
+        self.sop_instance_uid = sop_instance_uid
+
+    def __str__(self):
+        return f"{self.path} ({self.sop_instance_uid})"
+
+    @property
+    def file_name(self) -> str:
+        """Name for this file inside its study folder"""
+        return f"{self.sop_instance_uid}.dcm"
+
+
+def read_instance(path: Path) -> Optional[DICOMInstance]:
+    """Read the UIDs of the DICOM file at path, stopping before pixel data
+
+    Returns
+    -------
+    DICOMInstance or None
+        None if path is not a DICOM file, or has no UIDs
+    """
+    try:
+        dataset = pydicom.dcmread(
+            str(path), stop_before_pixels=True, specific_tags=UID_TAGS
+        )
+    except (InvalidDicomError, OSError, EOFError, ValueError):
+        return None
+    uids = [str(dataset.get(x, "")) for x in UID_TAGS]
+    if not all(uids) or not all(is_safe_name(x) for x in uids):
+        return None
+    return DICOMInstance(path, *uids)
+
+
+def is_safe_name(uid: str) -> bool:
+    """Can uid be used as a file or folder name?"""
+    return uid not in (".", "..") and Path(uid).name == uid
+
+
+def move_to_study_folder(
+    stream_folder: Path, instance: DICOMInstance
+) -> Optional[DICOMInstance]:
+    """Move the file of instance into the folder for its study, named after
+    its StudyInstanceUID
+
+    Returns
+    -------
+    DICOMInstance or None
+        The instance at its new path. None if it was moved away meanwhile
+    """
+    study_folder = stream_folder / instance.study_instance_uid
+    study_folder.mkdir(exist_ok=True)
+    try:
+        new_path = get_new_path(instance, study_folder)
+        os.replace(instance.path, new_path)
+    except FileNotFoundError:
+        return None  # moved away while reading
+    instance.path = new_path
+    return instance
+
+
+def get_new_path(instance: DICOMInstance, study_folder: Path) -> Path:
+    """Path for the file of instance in study_folder. This is named after its
+    SOPInstanceUID. A file that was resent with the same content replaces the
+    earlier copy. If a different file with the same SOPInstanceUID is there
+    already, both are kept and a warning is logged
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file of instance does not exist
+    """
+    path = study_folder / instance.file_name
+    number = 0
+    while path.exists() and not filecmp.cmp(
+        instance.path, path, shallow=False
+    ):
+        number += 1
+        path = study_folder / f"{instance.sop_instance_uid}_{number}.dcm"
+    if number:
+        logger.warning(
+            f"{instance.path} has the same SOPInstanceUID as "
+            f"{instance.file_name} in {study_folder}, but different content. "
+            f"Keeping both, as {path.name}"
+        )
+    return path
+
+
+def group_loose_files(
+    stream, stream_folder: Path, min_age: float = 10, max_workers: int = 8
+) -> List[DICOMInstance]:
+    """Move each DICOM file directly in stream_folder into a folder for its
+    study and add it to the index. Headers are read in parallel. Files that
+    are not DICOM are left where they are.
+
+    Parameters
+    ----------
+    stream: Stream
+        The stream that stream_folder belongs to
+    stream_folder: Path
+        Group the files in this folder
+    min_age: float, optional
+        Leave files alone that have been written to in the last this many
+        seconds. They might not be complete. Defaults to 10
+    max_workers: int, optional
+        Read at most this many headers at the same time. Defaults to 8
+
+    Returns
+    -------
+    List[DICOMInstance]
+        All files that were moved
+    """
+    threshold = time.time() - min_age
+    try:
+        with os.scandir(stream_folder) as entries:
+            loose = [
+                Path(x.path)
+                for x in entries
+                if x.is_file(follow_symlinks=False)
+                and x.stat().st_mtime <= threshold
+            ]
+    except FileNotFoundError:
+        return []
+    if not loose:
+        return []
+
+    # read in parallel, move one by one so that name collisions are seen
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        instances = [x for x in executor.map(read_instance, loose) if x]
+    moved = []
+    for instance in instances:
+        if move_to_study_folder(stream_folder, instance):
+            moved.append(instance)
+    # a file resent with the same content replaces the earlier copy, and has
+    # the same uids
+    IndexedInstance.objects.bulk_create(
+        [
+            IndexedInstance(
+                stream=stream,
+                study_id=x.study_instance_uid,
+                file_name=x.path.name,
+                study_instance_uid=x.study_instance_uid,
+                series_instance_uid=x.series_instance_uid,
+                sop_instance_uid=x.sop_instance_uid,
+            )
+            for x in moved
+        ],
+        ignore_conflicts=True,
+    )
+    if moved:
+        per_study = Counter(x.study_instance_uid for x in moved)
+        logger.info(
+            f"Grouped {len(moved)} loose files in {stream_folder} into "
+            f"{len(per_study)} studies"
+        )
+    return moved
@@ -0,0 +1,71 @@
+import json
+
+from django.core.management import BaseCommand
+
+from idis.benchmarks.corpus import CorpusSpec
+from idis.benchmarks.pipeline import run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Push synthetic DICOM studies through the pipeline, with a mock IDIS "
+        "server, and report throughput, time per stage and peak memory use. "
+        "Makes no lasting changes to the database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--studies", type=int, default=10)
+        parser.add_argument("--series", type=int, default=2)
+        parser.add_argument("--instances", type=int, default=10)
+        parser.add_argument(
+            "--pixels",
+            type=int,
+            default=64,
+            help="Rows and columns of each image",
+        )
+        parser.add_argument("--streams", type=int, default=2)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Seconds that each call to the mock IDIS server takes",
+        )
+        parser.add_argument(
+            "--loose",
+            action="store_true",
+            help="Send loose files instead of a folder per study",
+        )
+        parser.add_argument(
+            "--output", help="Also write results to this JSON file"
+        )
+
+    def handle(self, *args, **options):
+        spec = CorpusSpec(
+            n_studies=options["studies"],
+            n_series=options["series"],
+            n_instances=options["instances"],
+            rows=options["pixels"],
+            columns=options["pixels"],
+        )
+        self.stdout.write(
+            f"Benchmarking {options['streams']} streams of {spec}"
+        )
+        results = run_benchmark(
+            spec,
+            n_streams=options["streams"],
+            latency=options["latency"],
+            loose=options["loose"],
+        )
+
+        self.stdout.write(
+            f"{results['finished_studies']}/{results['studies']} studies "
+            f"finished in {results['runs']} runs, "
+            f"{results['total_seconds']:.2f} seconds"
+        )
+        self.stdout.write(f"{results['files_per_second']:.1f} files/second")
+        for key, seconds in sorted(results["stage_seconds"].items()):
+            self.stdout.write(f"  {key:<36} {seconds:8.3f} s")
+        self.stdout.write(f"Peak RSS {results['peak_rss_mb']:.1f} MB")
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
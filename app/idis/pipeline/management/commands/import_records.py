@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+
+from idis.pipeline.records import import_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy idissend records from an sqlalchemy database, such as the "
+        "default records_db.sqlite file, to the django database. Run this "
+        "before setting PIPELINE_RECORDS_DB_URL to django://"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "db_url",
+            help="sqlalchemy url of the database to copy from, for example "
+            "sqlite:////tmp/idissend/records_db.sqlite",
+        )
+
+    def handle(self, *args, **options):
+        copied = import_records(options["db_url"])
+        self.stdout.write(f"Copied {copied} records")
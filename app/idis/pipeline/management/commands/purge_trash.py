@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from idis.pipeline.purge import PurgeResult, TrashPurger, idle_io_priority
+from idis.pipeline.tasks import get_trash_path
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete all studies in the trash stage, at the rate set in settings "
+        "and with idle I/O priority. Can be stopped with ctrl-c at any time. "
+        "Running again continues where the last purge stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--files-per-second",
+            type=int,
+            default=settings.PIPELINE_TRASH_PURGE_FILES_PER_SECOND,
+            help="Delete at most this many files per second. 0 for no limit",
+        )
+        parser.add_argument(
+            "--bytes-per-second",
+            type=int,
+            default=settings.PIPELINE_TRASH_PURGE_BYTES_PER_SECOND,
+            help="Reclaim at most this many bytes per second. 0 for no limit",
+        )
+
+    def handle(self, *args, **options):
+        purger = TrashPurger(
+            path=get_trash_path(),
+            files_per_second=options["files_per_second"],
+            bytes_per_second=options["bytes_per_second"],
+        )
+        result = PurgeResult()
+        with idle_io_priority() as idle:
+            if not idle:
+                self.stdout.write("Could not set idle I/O priority")
+            try:
+                purger.purge(result=result)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(str(result))
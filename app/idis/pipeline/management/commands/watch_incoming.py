@@ -0,0 +1,61 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from idis.pipeline.building import get_pipeline
+from idis.pipeline.coordination import get_coordinator
+from idis.pipeline.scheduling import WATCHER_SEEN
+from idis.pipeline.tasks import queue_study_push
+from idis.pipeline.watcher import StudyActivity, get_watcher
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Watch the incoming folder of each stream. Push studies on as soon as "
+        "no files have been written to them for PIPELINE_WATCHER_QUIET_PERIOD "
+        "seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="Poll folders instead of using inotify. Use this when "
+            "incoming folders are on a network share",
+        )
+
+    def handle(self, *args, **options):
+        activity = StudyActivity()
+        pipeline, watcher = None, None
+        try:
+            while True:
+                current = get_pipeline()
+                if current is not pipeline:  # streams have changed
+                    if watcher:
+                        watcher.close()
+                    pipeline = current
+                    pipeline.incoming.assert_all_paths()
+                    watcher = get_watcher(
+                        pipeline.incoming, activity, poll=options["poll"]
+                    )
+                    logger.info(
+                        f"Watching {len(pipeline.incoming.streams)} streams "
+                        f"with {type(watcher).__name__}"
+                    )
+
+                # scheduled runs only back off while this is recent
+                get_coordinator().set_value(WATCHER_SEEN, time.time())
+                watcher.wait(timeout=settings.PIPELINE_WATCHER_POLL_INTERVAL)
+                for stream, study_id in activity.pop_quiet(
+                    quiet_period=settings.PIPELINE_WATCHER_QUIET_PERIOD,
+                    now=time.time(),
+                ):
+                    logger.info(f"{stream}:{study_id} is complete. Pushing")
+                    queue_study_push(stream, study_id)
+        finally:
+            if watcher:
+                watcher.close()
@@ -0,0 +1,38 @@
+""" Metrics about the pipeline that are collected when metrics are requested.
+See idis.core.metrics
+"""
+import os
+from typing import TYPE_CHECKING
+
+from idis.core.metrics import PIPELINE_FILES, PIPELINE_STATS, PIPELINE_STUDIES
+from idis.pipeline.coordination import get_coordinator
+
+if TYPE_CHECKING:
+    from idissend.pipeline import IDISPipeline
+
+
+def collect_run_statistics():
+    """Expose the run statistics that pipeline runs keep on the coordinator"""
+    for key, value in get_coordinator().get_values().items():
+        PIPELINE_STATS.set(value, key=key)
+
+
+def record_stages(pipeline: "IDISPipeline"):
+    """Report the number of studies and files in each stage of pipeline, per
+    stream. Values for streams that are not in pipeline are removed"""
+    studies, files = [], []
+    for stage in pipeline.stages:
+        for stream in stage.streams:
+            path = stage.get_path_for_stream(stream)
+            if not path.exists():
+                continue
+            labels = {"stage": stage.name, "stream": stream.name}
+            study_count, file_count = 0, 0
+            for dir_path, dir_names, file_names in os.walk(path):
+                if dir_path == str(path):
+                    study_count = len(dir_names)
+                file_count += len(file_names)
+            studies.append((study_count, labels))
+            files.append((file_count, labels))
+    PIPELINE_STUDIES.set_all(studies)
+    PIPELINE_FILES.set_all(files)
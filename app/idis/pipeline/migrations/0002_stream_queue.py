@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="queue",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Celery queue to run this stream on when running per stream. Empty for the default queue",
+                max_length=128,
+            ),
+        ),
+    ]
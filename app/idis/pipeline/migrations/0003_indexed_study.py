@@ -0,0 +1,54 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0002_stream_queue"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexedStudy",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stage_name", models.CharField(max_length=128)),
+                ("study_id", models.CharField(max_length=256)),
+                (
+                    "newest_mtime",
+                    models.FloatField(
+                        help_text="Unix time of the last modification of any file in study"
+                    ),
+                ),
+                (
+                    "stream",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="pipeline.Stream",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="indexedstudy",
+            index=models.Index(
+                fields=["stage_name", "newest_mtime"],
+                name="pipeline_in_stage_n_a8c355_idx",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="indexedstudy",
+            unique_together={("stage_name", "stream", "study_id")},
+        ),
+    ]
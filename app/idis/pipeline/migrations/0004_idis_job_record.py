@@ -0,0 +1,39 @@
+# Generated by Django 3.0.14 on 2026-10-19 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0003_indexed_study"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IDISJobRecord",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("study_id", models.CharField(db_index=True, max_length=256)),
+                ("job_id", models.IntegerField(unique=True)),
+                ("server_name", models.CharField(max_length=256)),
+                (
+                    "last_status",
+                    models.CharField(default=None, max_length=128, null=True),
+                ),
+                (
+                    "last_error_message",
+                    models.CharField(default=None, max_length=1024, null=True),
+                ),
+                ("last_check", models.DateTimeField(default=None, null=True)),
+            ],
+        ),
+    ]
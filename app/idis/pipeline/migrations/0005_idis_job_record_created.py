@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-19 09:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0004_idis_job_record"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="idisjobrecord",
+            name="created",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
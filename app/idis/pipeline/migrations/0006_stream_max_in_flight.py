@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-19 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0005_idis_job_record_created"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="max_in_flight",
+            field=models.PositiveIntegerField(
+                blank=True,
+                default=None,
+                help_text="Send at most this many studies to IDIS at the same time. 0 for no limit. Empty to use PIPELINE_STREAM_MAX_IN_FLIGHT",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.0.14 on 2026-10-19 09:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0006_stream_max_in_flight"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexedInstance",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "study_id",
+                    models.CharField(
+                        help_text="Folder of the study in incoming",
+                        max_length=256,
+                    ),
+                ),
+                ("file_name", models.CharField(max_length=256)),
+                ("study_instance_uid", models.CharField(max_length=64)),
+                ("series_instance_uid", models.CharField(max_length=64)),
+                (
+                    "sop_instance_uid",
+                    models.CharField(db_index=True, max_length=64),
+                ),
+                (
+                    "stream",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="pipeline.Stream",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("stream", "study_id", "file_name")},
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.0.14 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pipeline", "0007_indexed_instance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SeenInstance",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sop_instance_uid", models.CharField(max_length=64)),
+                (
+                    "content_hash",
+                    models.CharField(
+                        help_text="sha256 of the file contents", max_length=64
+                    ),
+                ),
+                (
+                    "inode",
+                    models.BigIntegerField(
+                        help_text="Tells the file that was seen first from copies of it"
+                    ),
+                ),
+                (
+                    "first_seen",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "stream",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="pipeline.Stream",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {
+                    ("stream", "sop_instance_uid", "content_hash")
+                },
+            },
+        ),
+    ]
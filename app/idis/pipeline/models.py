@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 # Create your models here.
 # IncomingFile
@@ -43,6 +44,20 @@ class Stream(models.Model):
         default=None,
         on_delete=models.SET_DEFAULT,
     )
+    queue = models.CharField(
+        blank=True,
+        default="",
+        max_length=128,
+        help_text="Celery queue to run this stream on when running per "
+        "stream. Empty for the default queue",
+    )
+    max_in_flight = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        default=None,
+        help_text="Send at most this many studies to IDIS at the same time. "
+        "0 for no limit. Empty to use PIPELINE_STREAM_MAX_IN_FLIGHT",
+    )
 
     def __str__(self):
         return f"Stream '{self.name}'"
@@ -51,3 +66,87 @@ class Stream(models.Model):
     def idis_profile_name(self) -> str:
         """IDIS profile as string.  For use as key in IDIS"""
         return str(self.idis_profile.title)
+
+
+class IndexedStudy(models.Model):
+    """Newest file modification time of a study folder in a pipeline stage.
+    Kept by IndexedCoolDown so that it does not have to look at the files of
+    every study on every run
+    """
+
+    stage_name = models.CharField(max_length=128)
+    stream = models.ForeignKey(to=Stream, on_delete=models.CASCADE)
+    study_id = models.CharField(max_length=256)
+    newest_mtime = models.FloatField(
+        help_text="Unix time of the last modification of any file in study"
+    )
+
+    class Meta:
+        unique_together = ("stage_name", "stream", "study_id")
+        indexes = [models.Index(fields=["stage_name", "newest_mtime"])]
+
+    def __str__(self):
+        return f"{self.stage_name}:{self.stream_id}:{self.study_id}"
+
+
+class IndexedInstance(models.Model):
+    """UIDs of a DICOM file in the incoming stage, read from its header when
+    it was moved into the folder for its study
+    """
+
+    stream = models.ForeignKey(to=Stream, on_delete=models.CASCADE)
+    study_id = models.CharField(
+        max_length=256, help_text="Folder of the study in incoming"
+    )
+    file_name = models.CharField(max_length=256)
+    study_instance_uid = models.CharField(max_length=64)
+    series_instance_uid = models.CharField(max_length=64)
+    sop_instance_uid = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        unique_together = ("stream", "study_id", "file_name")
+
+    def __str__(self):
+        return f"{self.stream_id}:{self.study_id}/{self.file_name}"
+
+
+class SeenInstance(models.Model):
+    """A DICOM file that has left the incoming stage of a stream. Used to drop
+    exact duplicates that are sent again later
+    """
+
+    stream = models.ForeignKey(to=Stream, on_delete=models.CASCADE)
+    sop_instance_uid = models.CharField(max_length=64)
+    content_hash = models.CharField(
+        max_length=64, help_text="sha256 of the file contents"
+    )
+    inode = models.BigIntegerField(
+        help_text="Tells the file that was seen first from copies of it"
+    )
+    first_seen = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ("stream", "sop_instance_uid", "content_hash")
+
+    def __str__(self):
+        return f"{self.stream_id}:{self.sop_instance_uid}"
+
+
+class IDISJobRecord(models.Model):
+    """Links a study in the pending stage to the IDIS job anonymizing it.
+    Has the same fields as idissend.orm.IDISRecord so that idissend stages
+    can use it unchanged
+    """
+
+    study_id = models.CharField(max_length=256, db_index=True)
+    job_id = models.IntegerField(unique=True)
+    server_name = models.CharField(max_length=256)
+    last_status = models.CharField(max_length=128, null=True, default=None)
+    last_error_message = models.CharField(
+        max_length=1024, null=True, default=None
+    )
+    last_check = models.DateTimeField(null=True, default=None)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"IDIS job {self.job_id} for {self.study_id}"
@@ -0,0 +1,194 @@
+""" Emptying the trash stage without stalling other disk access
+
+Deleting all studies in trash at once can mean hundreds of GB of unlinks in one
+go, which holds up transfers that are running at the same time. TrashPurger
+deletes file by file instead, at a limited rate and with idle I/O priority
+where the OS supports this. A purge can be stopped at any moment. Everything
+that was not deleted yet is still on disk, so the next purge picks up where
+the last one stopped.
+"""
+import ctypes
+import logging
+import os
+import platform
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# I/O priority, from linux/ioprio.h
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_WHO_PROCESS = 1  # with id 0, this means the calling thread
+# (ioprio_get, ioprio_set) syscall numbers per machine
+IOPRIO_SYSCALLS = {
+    "x86_64": (252, 251),
+    "aarch64": (31, 30),
+    "i686": (290, 289),
+}
+
+
+class PurgeResult:
+    """What a single purge did"""
+
+    def __init__(self, files: int = 0, bytes: int = 0, complete: bool = False):
+        """
+
+        Parameters
+        ----------
+        files: int, optional
+            Number of files deleted
+        bytes: int, optional
+            Total size of the files deleted
+        complete: bool, optional
+            True if trash was empty at the end, False if the purge stopped
+            early
+        """
+        self.files = files
+        self.bytes = bytes
+        self.complete = complete
+
+    def __str__(self):
+        status = "complete" if self.complete else "stopped early"
+        return (
+            f"Purge {status}. Deleted {self.files} files, reclaimed "
+            f"{self.bytes} bytes"
+        )
+
+
+class TrashPurger:
+    """Deletes the studies in a trash folder at a limited rate"""
+
+    def __init__(
+        self, path: Path, files_per_second: int = 0, bytes_per_second: int = 0
+    ):
+        """
+
+        Parameters
+        ----------
+        path: Path
+            The trash folder. Contains a folder per stream, with a folder per
+            study in it. Only study folders are deleted
+        files_per_second: int, optional
+            Delete at most this many files per second on average. 0 means no
+            limit. Defaults to 0
+        bytes_per_second: int, optional
+            Reclaim at most this many bytes per second on average. 0 means no
+            limit. Defaults to 0
+        """
+        self.path = Path(path)
+        self.files_per_second = files_per_second
+        self.bytes_per_second = bytes_per_second
+
+    def purge(
+        self,
+        max_duration: Optional[float] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        result: Optional[PurgeResult] = None,
+    ) -> PurgeResult:
+        """Delete everything in trash, or as much as possible in the given
+        time
+
+        Parameters
+        ----------
+        max_duration: float, optional
+            Stop after this many seconds. Defaults to no limit
+        should_stop: Callable[[], bool], optional
+            Called between files. Stop when this returns True
+        result: PurgeResult, optional
+            Count deleted files in this result, so that progress is known
+            also when the purge is interrupted by an exception. Defaults to a
+            new result
+
+        Returns
+        -------
+        PurgeResult
+        """
+        start = time.monotonic()
+        deadline = None if max_duration is None else start + max_duration
+        result = PurgeResult() if result is None else result
+        done_before = result.files, result.bytes
+
+        for dir_path, dir_names, file_names in os.walk(
+            self.path, topdown=False
+        ):
+            for file_name in file_names:
+                if should_stop and should_stop():
+                    return result
+                delay = self.get_delay(
+                    files=result.files - done_before[0],
+                    bytes=result.bytes - done_before[1],
+                    elapsed=time.monotonic() - start,
+                )
+                if deadline and time.monotonic() + delay > deadline:
+                    return result
+                time.sleep(delay)
+                try:
+                    file_path = os.path.join(dir_path, file_name)
+                    size = os.lstat(file_path).st_size
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    continue  # deleted by someone else
+                result.files += 1
+                result.bytes += size
+            if len(Path(dir_path).relative_to(self.path).parts) >= 2:
+                try:
+                    os.rmdir(dir_path)
+                except OSError:
+                    pass  # something new was written here. Next time
+        result.complete = True
+        return result
+
+    def get_delay(self, files: int, bytes: int, elapsed: float) -> float:
+        """Seconds to wait before deleting the next file, so that the average
+        rate stays within limits after deleting files and bytes in elapsed
+        seconds"""
+        needed = 0.0
+        if self.files_per_second:
+            needed = max(needed, files / self.files_per_second)
+        if self.bytes_per_second:
+            needed = max(needed, bytes / self.bytes_per_second)
+        return max(needed - elapsed, 0.0)
+
+
+@contextmanager
+def idle_io_priority():
+    """Run the calling thread with idle I/O priority, so that its disk access
+    only gets served when no-one else needs the disk. The previous priority is
+    restored afterwards.
+
+    Best effort. Needs linux and an I/O scheduler that supports priorities,
+    such as bfq. Yields whether the priority could be set
+    """
+    syscalls = None
+    if sys.platform.startswith("linux"):
+        syscalls = IOPRIO_SYSCALLS.get(platform.machine())
+    if not syscalls:
+        logger.debug(f"Cannot set I/O priority on {platform.machine()}")
+        yield False
+        return
+
+    get_number, set_number = syscalls
+    libc = ctypes.CDLL(None, use_errno=True)
+    previous = libc.syscall(get_number, IOPRIO_WHO_PROCESS, 0)
+    if previous < 0 or (
+        libc.syscall(
+            set_number,
+            IOPRIO_WHO_PROCESS,
+            0,
+            IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT,
+        )
+        < 0
+    ):
+        logger.debug(
+            f"Could not set I/O priority: {os.strerror(ctypes.get_errno())}"
+        )
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        libc.syscall(set_number, IOPRIO_WHO_PROCESS, 0, previous)
@@ -0,0 +1,188 @@
+""" Keeping idissend records in the django database
+
+idissend keeps the IDIS job id for each pending study in an sqlalchemy
+database. With the default sqlite file, several workers writing at the same
+time block each other. The classes here offer the same interface as
+idissend.persistence.IDISSendRecords, but store IDISJobRecord objects in the
+django database instead. Writes in a session are collected and written in a
+single transaction when the session closes.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from idissend.persistence import IDISSendRecords, get_db_sessionmaker
+from sqlalchemy.exc import SQLAlchemyError
+
+from idis.pipeline.models import IDISJobRecord
+
+DJANGO_RECORDS_URL = "django://"
+UPDATE_FIELDS = [
+    "study_id",
+    "server_name",
+    "last_status",
+    "last_error_message",
+    "last_check",
+]
+
+
+class DjangoRecordsSession:
+    """Same interface as idissend IDISSendRecordsSession. Reads go to the
+    database directly. Writes are done in one go when the session closes
+
+    Examples
+    --------
+    with DjangoRecordsSession() as session:
+        session.do_things()
+    """
+
+    def __init__(self):
+        self.to_save = {}
+        self.to_delete = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_, **__):
+        self.close()
+
+    def close(self):
+        """Write all changes in a single transaction
+
+        Raises
+        ------
+        RecordsDatabaseException
+            If writing fails. This is an SQLAlchemyError, because that is what
+            idissend stages expect from a records session
+        """
+        to_create = [x for x in self.to_save.values() if x.pk is None]
+        to_update = [x for x in self.to_save.values() if x.pk is not None]
+        for record in to_create + to_update:
+            if record.last_check and timezone.is_naive(record.last_check):
+                record.last_check = timezone.make_aware(record.last_check)
+        try:
+            with transaction.atomic():
+                IDISJobRecord.objects.bulk_create(to_create)
+                IDISJobRecord.objects.bulk_update(to_update, UPDATE_FIELDS)
+                IDISJobRecord.objects.filter(pk__in=self.to_delete).delete()
+        except DatabaseError as e:
+            raise RecordsDatabaseException(e) from e
+        finally:
+            self.to_save, self.to_delete = {}, {}
+
+    def get_all(self) -> List[IDISJobRecord]:
+        return list(IDISJobRecord.objects.all())
+
+    def get_for_study_id(self, study_id: str) -> Optional[IDISJobRecord]:
+        """Get first record for the given study id. Returns None if not found"""
+        return IDISJobRecord.objects.filter(study_id=study_id).first()
+
+    def get_for_study_ids(self, study_ids: List[str]) -> List[IDISJobRecord]:
+        """Get records for all given study ids in a single query. Study ids
+        without a record are skipped"""
+        return list(IDISJobRecord.objects.filter(study_id__in=study_ids))
+
+    def get_for_job_id(self, job_id: int) -> Optional[IDISJobRecord]:
+        """Get record for the given job_id. Returns None if not found"""
+        return IDISJobRecord.objects.filter(job_id=job_id).first()
+
+    def add(
+        self,
+        study_id: str,
+        job_id: int,
+        server_name: str,
+        last_status: Optional[str] = None,
+        last_check: Optional[datetime] = None,
+    ) -> IDISJobRecord:
+        """Create a record with the given parameters. Saved on close"""
+        record = IDISJobRecord(
+            study_id=study_id,
+            job_id=job_id,
+            server_name=server_name,
+            last_status=last_status,
+            last_check=last_check,
+        )
+        self.add_record(record)
+        return record
+
+    def add_record(self, record: IDISJobRecord):
+        """Save new or changed record on close"""
+        self.to_save[id(record)] = record
+
+    def delete(self, record: IDISJobRecord):
+        """Delete record on close"""
+        self.to_save.pop(id(record), None)
+        if record.pk is not None:
+            self.to_delete[record.pk] = record
+
+
+class DjangoRecords:
+    """Same interface as idissend IDISSendRecords, for records in the django
+    database"""
+
+    def get_session(self) -> DjangoRecordsSession:
+        return DjangoRecordsSession()
+
+
+def get_records(db_url: str):
+    """Records for the given url
+
+    Parameters
+    ----------
+    db_url: str
+        'django://' for the django database. Any other value is passed to
+        sqlalchemy as database url
+
+    Returns
+    -------
+    DjangoRecords or IDISSendRecords
+    """
+    if db_url == DJANGO_RECORDS_URL:
+        return DjangoRecords()
+    else:
+        return IDISSendRecords(session_maker=get_db_sessionmaker(db_url))
+
+
+def import_records(db_url: str, batch_size: int = 500) -> int:
+    """Copy all records from an sqlalchemy records database to the django
+    database. Records with a job id that is already known are skipped
+
+    Parameters
+    ----------
+    db_url: str
+        sqlalchemy database url of the records to copy
+    batch_size: int, optional
+        Insert this many records per query. Defaults to 500
+
+    Returns
+    -------
+    int
+        Number of records that were copied
+    """
+    with IDISSendRecords(
+        session_maker=get_db_sessionmaker(db_url)
+    ).get_session() as session:
+        records = session.get_all()
+
+    known = set(IDISJobRecord.objects.values_list("job_id", flat=True))
+    to_create = [
+        IDISJobRecord(
+            study_id=x.study_id,
+            job_id=x.job_id,
+            server_name=x.server_name,
+            last_status=x.last_status,
+            last_error_message=x.last_error_message,
+            last_check=timezone.make_aware(x.last_check)
+            if x.last_check
+            else None,
+        )
+        for x in records
+        if x.job_id not in known
+    ]
+    IDISJobRecord.objects.bulk_create(to_create, batch_size=batch_size)
+    return len(to_create)
+
+
+class RecordsDatabaseException(SQLAlchemyError):
+    pass
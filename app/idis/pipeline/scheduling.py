@@ -0,0 +1,198 @@
+""" Deciding when the pipeline should run next
+
+Celery beat starts a pipeline run every settings.PIPELINE_RUN_INTERVAL
+seconds. This is not always what is needed. When a run leaves studies that
+could be moved on right away, waiting for the next tick only adds delay. When
+there are no studies in the pipeline at all, running every tick only costs
+disk access. AdaptiveSchedule queues another run immediately in the first
+case and skips ticks, with increasing back off, in the second.
+
+Skipping ticks is only safe while the watch_incoming command is running, as
+it pushes studies on without waiting for a run. The watcher marks that it is
+alive in the coordinator. Without a recent mark, no ticks are skipped, so
+that a new study waits at most PIPELINE_RUN_INTERVAL seconds for a run.
+
+Whether there is work left is decided from what the stages found during the
+run, see IndexedCoolDown and BatchedPendingAnon. Only stages that do not keep
+this are scanned again.
+"""
+import time
+from typing import TYPE_CHECKING, Optional
+
+from django.conf import settings
+
+if TYPE_CHECKING:
+    from idissend.pipeline import IDISPipeline
+
+IDLE_BACKOFF = "idle_backoff"
+NEXT_RUN_AFTER = "next_run_after"
+RERUNS_IN_A_ROW = "reruns_in_a_row"
+# unix time at which the watch_incoming command was last seen running
+WATCHER_SEEN = "watcher_seen"
+
+
+def has_work(pipeline: "IDISPipeline", now: Optional[float] = None) -> bool:
+    """Are there studies that the pipeline could move on right now? Studies
+    held back by in-flight limits have to wait for a later run
+
+    Parameters
+    ----------
+    pipeline: IDISPipeline
+        The pipeline that has just run
+    now: float, optional
+        Unix timestamp. Defaults to current time
+    """
+    now = time.time() if now is None else now
+    held_back = getattr(pipeline.pending, "held_back", {})
+    left = getattr(pipeline.pending, "left", None)
+    waiting = getattr(pipeline.incoming, "waiting", None)
+    if left is not None and waiting is not None:
+        next_cooled_at = pipeline.incoming.next_cooled_at
+        return left > len(held_back) or (
+            next_cooled_at is not None and next_cooled_at <= now
+        )
+
+    return bool(
+        any(
+            x.study_id not in held_back
+            for x in pipeline.cooled_down.get_all_studies()
+        )
+        or pipeline.incoming.get_all_cooled_studies()
+    )
+
+
+def is_idle(pipeline: "IDISPipeline") -> bool:
+    """Are there no studies on their way through the pipeline at all?"""
+    in_stage = getattr(pipeline.pending, "in_stage", None)
+    waiting = getattr(pipeline.incoming, "waiting", None)
+    if in_stage is not None and waiting is not None:
+        return not (in_stage or pipeline.pending.left or waiting)
+
+    return not any(
+        stage.get_all_studies()
+        for stage in (
+            pipeline.incoming,
+            pipeline.cooled_down,
+            pipeline.pending,
+        )
+    )
+
+
+class AdaptiveSchedule:
+    """Decides whether to run now, run again immediately, or skip runs.
+
+    State is kept in the coordinator so that all workers share it
+    """
+
+    def __init__(
+        self,
+        coordinator,
+        interval: int,
+        max_idle_backoff: int,
+        max_reruns_in_a_row: int,
+        prefix: str = "",
+        watcher_timeout: int = 0,
+    ):
+        """
+
+        Parameters
+        ----------
+        coordinator: MemoryCoordinator or RedisCoordinator
+            Keep state here
+        interval: int
+            Seconds between runs started by celery beat
+        max_idle_backoff: int
+            Never skip runs for longer than this many seconds when idle. Only
+            applies while the incoming watcher is running
+        max_reruns_in_a_row: int
+            Queue at most this many runs immediately after each other. Keeps
+            a study that cannot be moved on from keeping a worker busy
+        prefix: str, optional
+            Prefix for state keys. Schedules with different prefixes do not
+            influence each other. Defaults to no prefix
+        watcher_timeout: int, optional
+            Consider the incoming watcher stopped when it has not been seen
+            for this many seconds. Defaults to 0, never skipping runs
+        """
+        self.coordinator = coordinator
+        self.interval = interval
+        self.max_idle_backoff = max_idle_backoff
+        self.max_reruns_in_a_row = max_reruns_in_a_row
+        self.prefix = prefix
+        self.watcher_timeout = watcher_timeout
+
+    @classmethod
+    def from_settings(
+        cls, coordinator, prefix: str = ""
+    ) -> "AdaptiveSchedule":
+        return cls(
+            coordinator=coordinator,
+            interval=settings.PIPELINE_RUN_INTERVAL,
+            max_idle_backoff=settings.PIPELINE_MAX_IDLE_BACKOFF,
+            max_reruns_in_a_row=settings.PIPELINE_MAX_IMMEDIATE_RERUNS,
+            prefix=prefix,
+            watcher_timeout=3 * settings.PIPELINE_WATCHER_POLL_INTERVAL,
+        )
+
+    def get(self, key: str) -> float:
+        return self.coordinator.get_values().get(self.prefix + key, 0)
+
+    def set(self, key: str, value: float):
+        self.coordinator.set_value(self.prefix + key, value)
+
+    def is_watched(self, now: float) -> bool:
+        """Has the incoming watcher been seen recently?"""
+        seen = self.coordinator.get_values().get(WATCHER_SEEN, 0)
+        return now - seen <= self.watcher_timeout
+
+    def is_due(self, now: Optional[float] = None) -> bool:
+        """Should a run that is started by celery beat go ahead?
+
+        Parameters
+        ----------
+        now: float, optional
+            Unix timestamp. Defaults to current time
+        """
+        now = time.time() if now is None else now
+        return now >= self.get(NEXT_RUN_AFTER)
+
+    def update(
+        self, pipeline: "IDISPipeline", now: Optional[float] = None
+    ) -> bool:
+        """Look at pipeline after a run and decide when to run next
+
+        Parameters
+        ----------
+        pipeline: IDISPipeline
+            The pipeline that has just run
+        now: float, optional
+            Unix timestamp. Defaults to current time
+
+        Returns
+        -------
+        bool
+            True if another run should be queued immediately
+        """
+        now = time.time() if now is None else now
+        if has_work(pipeline, now=now):
+            self.set(IDLE_BACKOFF, 0)
+            self.set(NEXT_RUN_AFTER, 0)
+            reruns = self.get(RERUNS_IN_A_ROW)
+            if reruns < self.max_reruns_in_a_row:
+                self.set(RERUNS_IN_A_ROW, reruns + 1)
+                return True
+            self.set(RERUNS_IN_A_ROW, 0)
+            return False
+
+        self.set(RERUNS_IN_A_ROW, 0)
+        if is_idle(pipeline) and self.is_watched(now):
+            backoff = min(
+                max(self.get(IDLE_BACKOFF) * 2, self.interval),
+                self.max_idle_backoff,
+            )
+            self.set(IDLE_BACKOFF, backoff)
+            self.set(NEXT_RUN_AFTER, now + backoff)
+        else:
+            self.set(IDLE_BACKOFF, 0)
+            self.set(NEXT_RUN_AFTER, 0)
+        return False
@@ -0,0 +1,20 @@
+""" Keep cached pipelines up to date when the objects they are built from
+change
+
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from idis.jobs.models import Profile
+from idis.pipeline.cache import invalidate_pipelines
+from idis.pipeline.models import Stream
+
+
+@receiver(post_save, sender=Stream)
+@receiver(post_delete, sender=Stream)
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def pipeline_config_changed(sender, **kwargs):
+    # after commit, so that no process rebuilds from the old configuration
+    transaction.on_commit(invalidate_pipelines)
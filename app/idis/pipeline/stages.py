@@ -0,0 +1,784 @@
+""" idissend stages adapted for running in IDIS
+
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from anonapi.objects import RemoteAnonServer
+from anonapi.responses import JobInfo
+from django.db.models import Count, Min
+from django.utils import timezone
+from idissend.core import (
+    PushStudyCallbackException,
+    Study,
+    StudyPushException,
+)
+from idissend.exceptions import IDISSendException
+from idissend.stages import (
+    CoolDown,
+    IDISCommunicationException,
+    PendingAnon,
+    RecordNotFoundException,
+    Trash,
+)
+from sqlalchemy.exc import SQLAlchemyError
+
+from idis.core.metrics import IDIS_API_SECONDS
+from idis.jobs.transfers import run_sync, transfer_all
+from idis.pipeline.dispatch import ServerDispatcher, is_unreachable
+from idis.pipeline.duplicates import DuplicateFilter
+from idis.pipeline.grouping import group_loose_files
+from idis.pipeline.models import IndexedInstance, IndexedStudy
+from idis.pipeline.records import DjangoRecords
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedCoolDown(CoolDown):
+    """A CoolDown stage that keeps the newest file modification time of each
+    study in the database.
+
+    The files of a study are only looked at when it first appears, and again
+    when its cool down might have expired. A run therefore costs one folder
+    listing per stream, plus a look at the studies that are new or ready.
+    Writes to a study after it was first indexed are caught by the second
+    look, so no study is returned before it has cooled down
+
+    After each check, the number of studies still cooling down and the time
+    the first of these will have cooled down are kept, so that the scheduler
+    does not have to look at the files again
+    """
+
+    def __init__(
+        self,
+        *args,
+        duplicate_filter: Optional[DuplicateFilter] = None,
+        **kwargs,
+    ):
+        """Takes the same parameters as CoolDown, plus
+
+        Parameters
+        ----------
+        duplicate_filter: DuplicateFilter, optional
+            If given, drop files from cooled down studies that have been
+            sent before. Defaults to None
+        """
+        super().__init__(*args, **kwargs)
+        self.duplicate_filter = duplicate_filter
+        # studies still cooling down at the last check, None before any check
+        self.waiting: Optional[int] = None
+        # unix time at which the first waiting study will have cooled down
+        self.next_cooled_at: Optional[float] = None
+
+    def remove_duplicates(self, study: Study) -> bool:
+        """Drop files in study that have been sent before
+
+        Returns
+        -------
+        bool
+            True if anything is left of study
+        """
+        if not self.duplicate_filter:
+            return True
+        return self.duplicate_filter.filter_study(study)
+
+    def get_all_cooled_studies(self) -> List[Study]:
+        """Get all studies which have not changed in the cool down period.
+        Exact duplicates of files sent before are dropped"""
+        if self.duplicate_filter:
+            self.duplicate_filter.evict()
+        return [
+            x for x in self.get_cooled_studies() if self.remove_duplicates(x)
+        ]
+
+    def get_cooled_studies(self) -> List[Study]:
+        """Get all studies which have not changed in the cool down period"""
+        self.update_index()
+        threshold = time.time() - self.cool_down * 60
+        streams = {x.pk: x for x in self.streams}
+        candidates = IndexedStudy.objects.filter(
+            stage_name=self.name,
+            stream__in=self.streams,
+            newest_mtime__lte=threshold,
+        )
+
+        cooled, changed, gone = [], [], []
+        for entry in candidates:
+            study = Study(
+                study_id=entry.study_id,
+                stream=streams[entry.stream_id],
+                stage=self,
+            )
+            try:
+                newest_mtime = get_newest_file_mtime(study.get_path())
+            except FileNotFoundError:
+                gone.append(entry.pk)
+                continue
+            if newest_mtime <= threshold:
+                cooled.append(study)
+            else:  # written to after indexing
+                entry.newest_mtime = newest_mtime
+                changed.append(entry)
+
+        IndexedStudy.objects.bulk_update(changed, ["newest_mtime"])
+        IndexedStudy.objects.filter(pk__in=gone).delete()
+        self.record_waiting(threshold)
+        return cooled
+
+    def record_waiting(self, threshold: float):
+        """Keep the number of indexed studies with files newer than threshold,
+        and when the first of these will have cooled down"""
+        waiting = IndexedStudy.objects.filter(
+            stage_name=self.name,
+            stream__in=self.streams,
+            newest_mtime__gt=threshold,
+        ).aggregate(count=Count("pk"), oldest=Min("newest_mtime"))
+        self.waiting = waiting["count"]
+        if waiting["oldest"] is None:
+            self.next_cooled_at = None
+        else:
+            self.next_cooled_at = waiting["oldest"] + self.cool_down * 60
+
+    def update_index(self):
+        """Add studies that have appeared to the index and remove studies that
+        have left. Does not look at studies that are already indexed. Only
+        folders are studies, files directly in a stream folder are left alone
+        """
+        for stream in self.streams:
+            indexed = IndexedStudy.objects.filter(
+                stage_name=self.name, stream=stream
+            )
+            known = set(indexed.values_list("study_id", flat=True))
+            try:
+                with os.scandir(self.get_path_for_stream(stream)) as entries:
+                    # loose files are not studies
+                    on_disk = {x.name for x in entries if x.is_dir()}
+            except FileNotFoundError:
+                on_disk = set()
+
+            indexed.filter(study_id__in=known - on_disk).delete()
+            new_entries = []
+            for study_id in on_disk - known:
+                try:
+                    newest_mtime = get_newest_file_mtime(
+                        self.get_path_for_stream(stream) / study_id
+                    )
+                except FileNotFoundError:
+                    continue  # moved away while indexing
+                new_entries.append(
+                    IndexedStudy(
+                        stage_name=self.name,
+                        stream=stream,
+                        study_id=study_id,
+                        newest_mtime=newest_mtime,
+                    )
+                )
+            # another worker might be indexing the same stage
+            IndexedStudy.objects.bulk_create(
+                new_entries, ignore_conflicts=True
+            )
+
+
+class GroupingCoolDown(IndexedCoolDown):
+    """An IndexedCoolDown stage that first moves loose DICOM files in each
+    stream folder into a folder per study. See idis.pipeline.grouping
+    """
+
+    def __init__(
+        self, *args, min_age: float = 10, max_workers: int = 8, **kwargs
+    ):
+        """Takes the same parameters as CoolDown, plus
+
+        Parameters
+        ----------
+        min_age: float, optional
+            Leave loose files alone that have been written to in the last
+            this many seconds. Defaults to 10
+        max_workers: int, optional
+            Read at most this many DICOM headers at the same time. Defaults
+            to 8
+        """
+        super().__init__(*args, **kwargs)
+        self.min_age = min_age
+        self.max_workers = max_workers
+
+    def get_all_cooled_studies(self) -> List[Study]:
+        self.group_loose_files()
+        return super().get_all_cooled_studies()
+
+    def group_loose_files(self):
+        """Move loose files into study folders, and forget the files of
+        studies that have left this stage"""
+        for stream in self.streams:
+            folder = self.get_path_for_stream(stream)
+            group_loose_files(
+                stream,
+                folder,
+                min_age=self.min_age,
+                max_workers=self.max_workers,
+            )
+            try:
+                with os.scandir(folder) as entries:
+                    on_disk = [x.name for x in entries if x.is_dir()]
+            except FileNotFoundError:
+                on_disk = []
+            IndexedInstance.objects.filter(stream=stream).exclude(
+                study_id__in=on_disk
+            ).delete()
+
+
+class IDISRequest:
+    """A study that has been moved into pending, waiting for its IDIS job to
+    be created or reset"""
+
+    def __init__(
+        self, original: Study, study: Study, server_name: str, record=None,
+    ):
+        """
+
+        Parameters
+        ----------
+        original: Study
+            The study as it was before it was moved
+        study: Study
+            The study in the pending stage
+        server_name: str
+            Send the request to this IDIS server
+        record: IDISRecord or IDISJobRecord, optional
+            Existing record for this study. If given, reset the job in it
+            instead of creating a new one. Defaults to None
+        """
+        self.original = original
+        self.study = study
+        self.server_name = server_name
+        self.record = record
+        self.job_info: Optional[JobInfo] = None
+
+    def __str__(self):
+        return str(self.study)
+
+
+class BatchedPendingAnon(PendingAnon):
+    """A PendingAnon stage that pushes many studies at once.
+
+    PendingAnon creates the IDIS job for each pushed study with its own API
+    call, one after the other. This stage first moves all studies in, then
+    calls IDIS for all of them at the same time, at most max_concurrent per
+    server. All new records are written in a single records session. Studies
+    for which the IDIS call failed are moved back.
+
+    When updating status, only jobs that are due are checked with IDIS. The
+    longer a job has been running, the less often it is checked. For other
+    jobs the status from the last check is used.
+
+    The number of studies in this stage can be limited per stream and, through
+    the dispatcher, per server. Studies that would go over a limit are held
+    back. They stay where they are and are pushed in a later run.
+
+    After each push, the number of studies in this stage and the number of
+    studies that were not pushed are kept for the scheduler.
+    """
+
+    # Check a job again after this fraction of the time it has been running
+    POLL_INTERVAL_FRACTION = 0.1
+
+    def __init__(
+        self,
+        *args,
+        max_concurrent: int = 8,
+        max_poll_interval: int = 300,
+        dispatcher: Optional[ServerDispatcher] = None,
+        max_in_flight_per_stream: int = 0,
+        **kwargs,
+    ):
+        """Takes the same parameters as PendingAnon, plus
+
+        Parameters
+        ----------
+        max_concurrent: int, optional
+            Make at most this many calls to a single IDIS server at the same
+            time. Defaults to 8
+        max_poll_interval: int, optional
+            Check the status of each job at least every this many seconds.
+            Defaults to 300
+        dispatcher: ServerDispatcher, optional
+            Spreads new jobs over all IDIS servers, and moves them to another
+            server if one cannot be reached. Defaults to creating all jobs on
+            the first server
+        max_in_flight_per_stream: int, optional
+            Hold back studies of a stream that has this many studies in this
+            stage already. Overridden by the max_in_flight of a stream, if set.
+            0 means no limit. Defaults to 0
+        """
+        super().__init__(*args, **kwargs)
+        self.max_concurrent = max_concurrent
+        self.max_poll_interval = timedelta(seconds=max_poll_interval)
+        self.dispatcher = dispatcher
+        self.max_in_flight_per_stream = max_in_flight_per_stream
+        # study_id -> unix time it was first held back, for studies held back
+        # in the last push
+        self.held_back: Dict[str, float] = {}
+        # studies in this stage and studies not pushed after the last push.
+        # None before any push
+        self.in_stage: Optional[int] = None
+        self.left: Optional[int] = None
+
+    def choose_server(self, study: Study) -> Optional[RemoteAnonServer]:
+        """The IDIS server to create a new job for study on. None if all
+        servers are full or unavailable"""
+        if not self.dispatcher:
+            return self.idis_connection.servers[0]
+        return self.dispatcher.choose()
+
+    def get_stream_limit(self, stream) -> int:
+        """Maximum number of studies of stream in this stage. 0 means no
+        limit"""
+        limit = getattr(stream, "max_in_flight", None)
+        return self.max_in_flight_per_stream if limit is None else limit
+
+    def hold_back(self, studies: List[Study], now: Optional[float] = None):
+        """Remember studies that could not be pushed because of in-flight
+        limits, and since when"""
+        now = time.time() if now is None else now
+        self.held_back = {
+            x.study_id: self.held_back.get(x.study_id, now) for x in studies
+        }
+        if studies:
+            self.logger.info(
+                f"In-flight limits reached. Holding back {len(studies)} "
+                f"studies, longest for {self.get_longest_wait(now):.0f} "
+                f"seconds"
+            )
+
+    def get_longest_wait(self, now: Optional[float] = None) -> float:
+        """Seconds the longest held back study has been waiting"""
+        now = time.time() if now is None else now
+        return max((now - x for x in self.held_back.values()), default=0)
+
+    def push_studies(self, studies: List[Study]) -> List[Study]:
+        """Insert each study into this stage and create or reset its IDIS job
+
+        Raises
+        ------
+        StudyPushException:
+            If any study could not be pushed. All other studies are pushed
+            regardless
+        """
+        if self.dispatcher:
+            self.dispatcher.set_queue_depths(self.get_queue_depths())
+        existing = self.get_existing_records([x.study_id for x in studies])
+        per_stream = Counter(x.stream for x in self.get_all_studies())
+
+        requests, held_back, errors = [], [], []
+        for study in studies:
+            limit = self.get_stream_limit(study.stream)
+            if limit and per_stream[study.stream] >= limit:
+                held_back.append(study)
+                continue
+            record = existing.get(study.study_id)
+            if record:
+                server_name = record.server_name
+            else:
+                server = self.choose_server(study)
+                if not server:
+                    held_back.append(study)
+                    continue
+                server_name = server.name
+            try:
+                requests.append(
+                    IDISRequest(
+                        original=study,
+                        study=self.move_in(study),
+                        server_name=server_name,
+                        record=record,
+                    )
+                )
+                per_stream[study.stream] += 1
+            except StudyPushException as e:
+                errors.append(f"{study}: {e}")
+        self.hold_back(held_back)
+        self.in_stage = sum(per_stream.values())
+        self.left = len(studies) - len(requests)
+        if not requests:
+            self.raise_for_errors(errors)
+            return []
+
+        sent = []
+        for result in self.send_requests(requests):
+            if result.succeeded:
+                sent.append(result.item)
+            else:
+                errors.append(f"{result.item}: {result.error}")
+                self.move_back(result.item)
+
+        created = [x for x in sent if x.record is None]
+        try:
+            with self.records.get_session() as session:
+                for request in created:
+                    session.add(
+                        study_id=request.study.study_id,
+                        job_id=request.job_info.job_id,
+                        server_name=request.server_name,
+                    )
+        except SQLAlchemyError as e:
+            for request in created:
+                errors.append(f"{request}: could not save record: {e}")
+                self.move_back(request)
+            sent = [x for x in sent if x.record is not None]
+
+        self.in_stage -= len(requests) - len(sent)
+        self.left += len(requests) - len(sent)
+        self.raise_for_errors(errors)
+        return [x.study for x in sent]
+
+    def get_existing_records(self, study_ids: List[str]) -> Dict[str, object]:
+        """Records for the given study ids, if they exist. Uses a single query
+        for records in the django database
+
+        Returns
+        -------
+        Dict[str, IDISRecord or IDISJobRecord]
+            Record per study id. Study ids without a record are left out
+        """
+        with self.records.get_session() as session:
+            if isinstance(self.records, DjangoRecords):
+                records = session.get_for_study_ids(study_ids)
+            else:
+                records = [session.get_for_study_id(x) for x in study_ids]
+        return {x.study_id: x for x in records if x}
+
+    def get_queue_depths(self) -> Dict[str, int]:
+        """Number of studies in this stage per IDIS server name. Counts the
+        studies of all streams, also those not handled by this stage"""
+        study_ids = [x.name for x in self.path.glob("*/*") if x.is_dir()]
+        records = self.get_existing_records(study_ids)
+        return Counter(x.server_name for x in records.values())
+
+    def get_records(self, studies: List[Study]):
+        """Look up the record for each study in local records db
+
+        Raises
+        ------
+        RecordNotFoundException
+            If any study has no record in the records database
+        """
+        found = self.get_existing_records([x.study_id for x in studies])
+        for study in studies:
+            if study.study_id not in found:
+                raise RecordNotFoundException(
+                    f"{str(self)}: There is no record for {study}", study=study
+                )
+        return [found[x.study_id] for x in studies]
+
+    def update_records(
+        self, studies: List[Study]
+    ) -> List[Tuple[Study, object]]:
+        """Get updated status from IDIS for the given studies that are due for
+        a check. Status for other studies is taken from their records
+
+        Raises
+        ------
+        IDISCommunicationException
+            If anything goes wrong getting information from IDIS
+        RecordNotFoundException
+            If any study has no record in the records database
+        """
+        records = self.get_records(studies)
+        now = timezone.now()
+        due = [
+            record
+            for study, record in zip(studies, records)
+            if self.is_due(record, now, self.get_created(study, record))
+        ]
+        if due:
+            self.logger.debug(f"Checking {len(due)} of {len(records)} jobs")
+            self.check_status(due)
+        return list(zip(studies, records))
+
+    @staticmethod
+    def get_created(study: Study, record) -> Optional[datetime]:
+        """When the job for study was created. Records that do not keep this,
+        like the default idissend records, fall back to the modification time
+        of the study folder, which is set when the study is moved in
+
+        Returns
+        -------
+        datetime or None
+            Timezone aware. None if the study folder is gone
+        """
+        created = getattr(record, "created", None)
+        if created is not None:
+            return created
+        try:
+            mtime = study.get_path().stat().st_mtime
+        except FileNotFoundError:
+            return None
+        return datetime.fromtimestamp(mtime, tz=timezone.utc)
+
+    def is_due(
+        self, record, now: datetime, created: Optional[datetime] = None
+    ) -> bool:
+        """Should the status of the job in record be checked with IDIS now?
+
+        Parameters
+        ----------
+        record: IDISRecord or IDISJobRecord
+            Record of the job
+        now: datetime
+            Timezone aware current time
+        created: datetime, optional
+            When the job was created. Defaults to the created time of record
+        """
+        if record.last_check is None or record.last_status is None:
+            return True
+        if created is None:
+            created = getattr(record, "created", None)
+        if created is None:
+            return True  # age unknown. Check every time
+        interval = min(
+            (now - created) * self.POLL_INTERVAL_FRACTION,
+            self.max_poll_interval,
+        )
+        return now - make_aware(record.last_check) >= interval
+
+    def check_status(self, records: List):
+        """Get the status of each record from IDIS and save it. Each server
+        is asked once for all its jobs, servers are asked at the same time
+
+        Raises
+        ------
+        IDISCommunicationException
+            If anything goes wrong getting information from IDIS
+        """
+        per_server = defaultdict(list)
+        for record in records:
+            per_server[record.server_name].append(record)
+
+        def get_job_infos(server_name):
+            try:
+                return self.timed(
+                    server_name,
+                    self.get_job_info_list,
+                    server=self.get_server(server_name),
+                    job_ids=[x.job_id for x in per_server[server_name]],
+                )
+            except IDISCommunicationException as e:
+                if self.dispatcher and is_unreachable(e):
+                    self.logger.warning(
+                        f"{server_name} unreachable. Using last known status"
+                    )
+                    return None
+                raise
+
+        job_infos, unreachable = {}, set()
+        for result in run_sync(
+            transfer_all(get_job_infos, per_server, len(per_server))
+        ):
+            if not result.succeeded:
+                raise IDISCommunicationException(result.error)
+            if result.value is None:
+                unreachable.add(result.item)
+            else:
+                job_infos.update({x.job_id: x for x in result.value})
+
+        with self.records.get_session() as session:
+            for record in records:
+                if record.server_name in unreachable:
+                    continue
+                try:
+                    job_info = job_infos[record.job_id]
+                except KeyError:
+                    raise IDISCommunicationException(
+                        f"{record.study_id} is associated with IDIS job "
+                        f"{record.job_id}, but IDIS server did not return any "
+                        f"info for this job"
+                    )
+                record.last_status = job_info.status
+                record.last_error_message = job_info.error
+                record.last_check = datetime.now()
+                session.add_record(record)
+
+    def send_requests(self, requests: List[IDISRequest]):
+        """Create or reset IDIS jobs for all requests, at most max_concurrent
+        at the same time for each server
+
+        Returns
+        -------
+        List[TransferResult]
+            A result for each request
+        """
+        per_server = defaultdict(list)
+        for request in requests:
+            per_server[request.server_name].append(request)
+
+        async def send_all():
+            results = await asyncio.gather(
+                *(
+                    transfer_all(self.send_request, x, self.max_concurrent)
+                    for x in per_server.values()
+                )
+            )
+            return [x for server_results in results for x in server_results]
+
+        return run_sync(send_all())
+
+    def send_request(self, request: IDISRequest) -> IDISRequest:
+        """Create or reset the IDIS job for a single request
+
+        Raises
+        ------
+        IDISSendException
+            If anything goes wrong talking to IDIS
+        """
+        if request.record:  # existing jobs stay on their server
+            self.timed(
+                request.server_name,
+                self.reset_idis_job,
+                server=self.get_server(request.server_name),
+                job_id=request.record.job_id,
+            )
+            return request
+
+        tried = set()
+        while True:
+            try:
+                request.job_info = self.timed(
+                    request.server_name,
+                    self.create_idis_job,
+                    self.get_server(request.server_name),
+                    request.study,
+                )
+                return request
+            except PushStudyCallbackException as e:
+                if not (self.dispatcher and is_unreachable(e)):
+                    raise
+                tried.add(request.server_name)
+                alternative = self.dispatcher.choose(exclude=tried)
+                if not alternative:
+                    raise
+                self.logger.warning(
+                    f"{request.server_name} unreachable. Creating job for "
+                    f"{request} on {alternative.name} instead"
+                )
+                request.server_name = alternative.name
+
+    def timed(self, server_name: str, function, *args, **kwargs):
+        """Call function and report its duration or failure to reach the
+        server to the dispatcher and to metrics"""
+        start = time.monotonic()
+        call = getattr(function, "__name__", "call")
+        try:
+            result = function(*args, **kwargs)
+        except IDISSendException as e:
+            IDIS_API_SECONDS.observe(
+                time.monotonic() - start,
+                server=server_name,
+                call=call,
+                outcome="error",
+            )
+            if self.dispatcher and is_unreachable(e):
+                self.dispatcher.record_failure(server_name)
+            raise
+        latency = time.monotonic() - start
+        IDIS_API_SECONDS.observe(
+            latency, server=server_name, call=call, outcome="ok"
+        )
+        if self.dispatcher:
+            self.dispatcher.record_success(server_name, latency=latency)
+        return result
+
+    def move_in(self, study: Study) -> Study:
+        """Move the data for study into this stage, without contacting IDIS
+
+        Raises
+        ------
+        StudyPushException:
+            If study cannot be moved here
+        """
+        if study.stream not in self.streams:
+            raise StudyPushException(
+                f"Stream '{study.stream}' does not exist in {self}"
+            )
+        self.assert_path_for_stream(study.stream)
+        new_study = Study(
+            study_id=study.study_id, stream=study.stream, stage=self
+        )
+        if new_study.get_path().exists():
+            raise StudyPushException(
+                f"Study {new_study} at {new_study.get_path()} already exists"
+            )
+        try:
+            shutil.move(str(study.get_path()), str(new_study.get_path()))
+            # marks when the job started, for records without created time
+            os.utime(new_study.get_path())
+        except OSError as e:
+            raise StudyPushException(e)
+        return new_study
+
+    @staticmethod
+    def move_back(request: IDISRequest):
+        """Return study to the stage it came from"""
+        logger.warning(f"Pushing {request} failed. Rolling back")
+        original = request.original
+        shutil.move(
+            str(request.study.get_path()),
+            str(original.stage.get_path_for_stream(original.stream)),
+        )
+
+    @staticmethod
+    def raise_for_errors(errors: List[str]):
+        if errors:
+            raise StudyPushException(
+                f"Could not push {len(errors)} studies: {'; '.join(errors)}"
+            )
+        return []
+
+
+class BackgroundTrash(Trash):
+    """A Trash stage that is not emptied by pipeline runs. Studies are deleted
+    in the background by the purge_trash task, at a limited rate"""
+
+    def delete_all(self):
+        self.logger.debug(
+            f"Leaving {len(self.get_all_studies())} studies for purge_trash"
+        )
+
+
+def make_aware(moment: datetime) -> datetime:
+    """idissend records hold naive local times. Django records hold aware
+    times"""
+    if timezone.is_naive(moment):
+        return timezone.make_aware(moment)
+    return moment
+
+
+def get_newest_file_mtime(path: Path) -> float:
+    """Newest modification time of the files directly in folder. Like
+    idissend Study.is_older_than(), sub folders are not considered
+
+    Returns
+    -------
+    float
+        Unix time. 0 if there are no files, or if path is not a folder
+
+    Raises
+    ------
+    FileNotFoundError
+        If path does not exist
+    """
+    newest = 0.0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    newest = max(newest, entry.stat().st_mtime)
+    except NotADirectoryError:
+        pass
+    return newest
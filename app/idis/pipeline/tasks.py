@@ -1,125 +1,318 @@
-from anonapi.client import AnonClientTool
-from anonapi.objects import RemoteAnonServer
-from anonapi.paths import UNCMapping, UNCMap, UNCPath
+""" Celery tasks that run the pipeline
+
+Every worker and web process imports this module, so it only imports what is
+needed to queue tasks. The pipeline itself, with anonapi, idissend and
+sqlalchemy, is built in idis.pipeline.building and imported the first time a
+task needs it
+"""
+import logging
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
 from celery import shared_task
 from django.conf import settings
+from idis.core.metrics import PIPELINE_RUN_SECONDS
+from idis.pipeline.coordination import get_coordinator, try_lock
 from idis.pipeline.models import Stream
-from idissend.core import Stage
-from idissend.persistence import IDISSendRecords, get_db_sessionmaker
-from idissend.pipeline import IDISPipeline
-from idissend.stages import CoolDown, PendingAnon, IDISConnection, Trash
-from pathlib import Path
+from idis.pipeline.scheduling import AdaptiveSchedule
+from idis.pipeline.purge import TrashPurger, idle_io_priority
+
+if TYPE_CHECKING:
+    from idissend.pipeline import IDISPipeline
+
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_LOCK_NAME = "idis.pipeline.run"
+TRASH_PURGE_LOCK_NAME = "idis.pipeline.purge_trash"
+STAGE_SIZES_LOCK_NAME = "idis.pipeline.record_stage_sizes"
 
 
 @shared_task
-def run_pipeline_once():
+def run_pipeline_once(rerun=False):
     """Check for new files, send to IDIS, send finished on to final distination, etc.
-    """
 
-    pipeline = init_pipeline()
-    pipeline.incoming.assert_all_paths()
-    pipeline.run_once()
+    Only one run happens at a time, across all workers. A run that finds the
+    previous run still going is skipped. When idle, runs started by celery beat
+    are skipped with increasing back off. When work is left after a run, the
+    next run is queued immediately.
 
+    If settings.PIPELINE_PER_STREAM is set, only queues run_stream_once for
+    each stream instead.
 
-def init_pipeline() -> IDISPipeline:
-    """Initialise a default pipeline based on django settings
+    Parameters
+    ----------
+    rerun: bool, optional
+        True if this run was queued by a previous run that left work. These
+        runs are not subject to idle back off. Defaults to False
     """
+    if settings.PIPELINE_PER_STREAM:
+        for stream in Stream.objects.all():
+            queue_stream_run(stream)
+        return
 
-    # parameters #
-    BASE_PATH = Path(
-        settings.PIPELINE_BASE_PATH
-    )  # all data for all stages goes here
-    STAGES_BASE_PATH = BASE_PATH / "stages"
-
-    # use this to identify with IDIS web API
-    IDIS_USERNAME = settings.PIPELINE_IDIS_USERNAME
-    IDIS_TOKEN = settings.PIPELINE_IDIS_TOKEN
-
-    # Talk to IDIS through this connection
-    IDIS_WEB_API_SERVER_NAME = settings.PIPELINE_IDIS_WEB_API_SERVER_NAME
-    IDIS_WEB_API_SERVER_URL = settings.PIPELINE_IDIS_WEB_API_SERVER_URL
-
-    RECORDS_DB_URL = settings.PIPELINE_RECORDS_DB_URL
-
-    # init #
-    STAGES_BASE_PATH.mkdir(
-        parents=True, exist_ok=True
-    )  # assert base dir exists
-
-    # Indicate which local paths correspond to which UNC paths.
-    # This makes it possible to expose local data to IDIS servers
-    unc_mapping = UNCMapping(
-        [
-            UNCMap(
-                local=Path(settings.PIPELINE_LOCAL_PATH),
-                unc=UNCPath(settings.PIPELINE_UNC_PATH),
-            )
-        ]
-    )
+    from idis.pipeline.building import get_pipeline
 
-    # streams #
-    # the different routes data can take through the pipeline. Data will always stay
-    # inside the same stream
-    streams = list(Stream.objects.all())
-
-    # stages #
-    # data in one stream goes through one or more of these stages
-    incoming = CoolDown(
-        name="incoming",
-        path=STAGES_BASE_PATH / "incoming",
-        streams=streams,
-        cool_down=5,
+    run_guarded(
+        lock_name=PIPELINE_LOCK_NAME,
+        get_pipeline_function=get_pipeline,
+        schedule_prefix="",
+        rerun=rerun,
+        queue_rerun=lambda: run_pipeline_once.apply_async(
+            kwargs={"rerun": True}
+        ),
     )
 
-    cooled_down = Stage(
-        name="cooled_down",
-        path=STAGES_BASE_PATH / "cooled_down",
-        streams=streams,
+
+@shared_task
+def run_stream_once(*, stream_pk, rerun=False):
+    """Like run_pipeline_once, but only for the studies in a single stream.
+    Streams do not wait for each other. Only one run per stream happens at a
+    time
+
+    Parameters
+    ----------
+    stream_pk: int
+        Run for this stream
+    rerun: bool, optional
+        True if this run was queued by a previous run that left work. These
+        runs are not subject to idle back off. Defaults to False
+    """
+    try:
+        stream = Stream.objects.get(pk=stream_pk)
+    except Stream.DoesNotExist:
+        logger.info(f"Stream {stream_pk} no longer exists. Not running")
+        return
+
+    from idis.pipeline.building import get_stream_pipeline
+
+    run_guarded(
+        lock_name=get_stream_lock_name(stream_pk),
+        get_pipeline_function=lambda: get_stream_pipeline(stream_pk),
+        schedule_prefix=f"stream.{stream_pk}.",
+        rerun=rerun,
+        queue_rerun=lambda: queue_stream_run(stream, rerun=True),
     )
 
-    connection = IDISConnection(
-        client_tool=AnonClientTool(username=IDIS_USERNAME, token=IDIS_TOKEN),
-        servers=[
-            RemoteAnonServer(
-                name=IDIS_WEB_API_SERVER_NAME, url=IDIS_WEB_API_SERVER_URL
+
+@shared_task
+def push_incoming_study(*, stream_pk, study_id):
+    """Move a single study that has stopped receiving files from incoming on
+    to pending, without scanning any other studies. Queued by the incoming
+    watcher.
+
+    Takes the same lock as the run that handles the stream. If that is held,
+    nothing is done. The study will be picked up by the scheduled run
+
+    Parameters
+    ----------
+    stream_pk: int
+        The stream that the study is in
+    study_id: str
+        Folder name of the study in the incoming stage
+    """
+    from idis.pipeline.building import get_pipeline, get_stream_pipeline
+    from idissend.core import Study, StudyPushException, random_string
+
+    with try_lock(
+        get_stream_lock_name(stream_pk), timeout=settings.PIPELINE_LOCK_TIMEOUT
+    ) as acquired:
+        if not acquired:
+            logger.info(
+                f"Pipeline busy. Leaving {study_id} for the scheduled run"
             )
-        ],
-    )
+            return
+        if settings.PIPELINE_PER_STREAM:
+            pipeline = get_stream_pipeline(stream_pk)
+        else:
+            pipeline = get_pipeline()
+        streams = [x for x in pipeline.incoming.streams if x.pk == stream_pk]
+        if not streams:
+            logger.info(f"Stream {stream_pk} no longer exists. Not pushing")
+            return
 
-    records = IDISSendRecords(
-        session_maker=get_db_sessionmaker(RECORDS_DB_URL)
-    )
+        study = Study(
+            study_id=study_id, stream=streams[0], stage=pipeline.incoming
+        )
+        if not study.get_path().exists():
+            return  # already picked up by a scheduled run
+        if not pipeline.incoming.remove_duplicates(study):
+            return  # all files were sent before
+        new_id = study.study_id + "_" + random_string(8)
+        cooled_down = pipeline.cooled_down.push_study(study, study_id=new_id)
+        try:
+            # push_studies, so that in-flight limits and server choice apply
+            if not pipeline.pending.push_studies([cooled_down]):
+                logger.info(
+                    f"{cooled_down} held back by in-flight limits. Leaving it "
+                    f"for the scheduled run"
+                )
+        except StudyPushException as e:
+            logger.warning(
+                f"Could not push {cooled_down} to pending: {e}. Leaving it "
+                f"for the scheduled run"
+            )
 
-    pending = PendingAnon(
-        name="pending",
-        path=STAGES_BASE_PATH / "pending",
-        streams=streams,
-        idis_connection=connection,
-        records=records,
-        unc_mapping=unc_mapping,
+
+@shared_task
+def purge_trash():
+    """Delete studies in the trash stage at the rate set in settings, with
+    idle I/O priority. Stops after PIPELINE_TRASH_PURGE_INTERVAL seconds. The
+    next scheduled purge continues where this one stopped
+    """
+    with try_lock(
+        TRASH_PURGE_LOCK_NAME, timeout=settings.PIPELINE_LOCK_TIMEOUT
+    ) as acquired:
+        if not acquired:
+            logger.info("Previous purge still running. Skipping")
+            return
+        purger = TrashPurger(
+            path=get_trash_path(),
+            files_per_second=settings.PIPELINE_TRASH_PURGE_FILES_PER_SECOND,
+            bytes_per_second=settings.PIPELINE_TRASH_PURGE_BYTES_PER_SECOND,
+        )
+        with idle_io_priority():
+            result = purger.purge(
+                max_duration=settings.PIPELINE_TRASH_PURGE_INTERVAL
+            )
+        if result.files:
+            logger.info(str(result))
+        coordinator = get_coordinator()
+        coordinator.incr("trash_purged_files", result.files)
+        coordinator.incr("trash_reclaimed_bytes", result.bytes)
+
+
+@shared_task
+def record_stage_sizes():
+    """Count the studies and files in each pipeline stage for metrics.
+    Walking all stages is slow, so this is done by celery beat every
+    PIPELINE_STAGE_METRICS_INTERVAL seconds, not by pipeline runs or when
+    metrics are requested. Skipped while the previous count is still going
+    """
+    from idis.pipeline.building import get_pipeline
+    from idis.pipeline.metrics import record_stages
+
+    with try_lock(
+        STAGE_SIZES_LOCK_NAME, timeout=settings.PIPELINE_LOCK_TIMEOUT
+    ) as acquired:
+        if not acquired:
+            logger.info("Previous count of stage sizes still running")
+            return
+        record_stages(get_pipeline())
+
+
+def get_trash_path() -> Path:
+    """Folder of the trash stage"""
+    return Path(settings.PIPELINE_BASE_PATH) / "stages" / "trash"
+
+
+def queue_study_push(stream: Stream, study_id: str):
+    """Queue push_incoming_study. Goes to the queue of stream when running
+    per stream"""
+    queue = stream.queue if settings.PIPELINE_PER_STREAM else None
+    push_incoming_study.apply_async(
+        kwargs={"stream_pk": stream.pk, "study_id": study_id},
+        queue=queue or None,
     )
 
-    errored = Stage(
-        name="errored", path=STAGES_BASE_PATH / "errored", streams=streams
+
+def get_stream_lock_name(stream_pk: int) -> str:
+    """Name of the lock to take before handling studies in stream. This
+    depends on whether streams run separately"""
+    if settings.PIPELINE_PER_STREAM:
+        return f"{PIPELINE_LOCK_NAME}.stream.{stream_pk}"
+    else:
+        return PIPELINE_LOCK_NAME
+
+
+def queue_stream_run(stream: Stream, rerun: bool = False):
+    """Queue run_stream_once for stream, on the celery queue set for stream
+    if any"""
+    run_stream_once.apply_async(
+        kwargs={"stream_pk": stream.pk, "rerun": rerun},
+        queue=stream.queue or None,
     )
 
-    finished = CoolDown(
-        name="finished",
-        path=STAGES_BASE_PATH / "finished",
-        streams=streams,
-        cool_down=2 * 60 * 24,
-    )  # 2 days
 
-    trash = Trash(
-        name="trash", path=STAGES_BASE_PATH / "trash", streams=streams
+def run_guarded(
+    lock_name: str,
+    get_pipeline_function: Callable[[], "IDISPipeline"],
+    schedule_prefix: str,
+    rerun: bool,
+    queue_rerun: Callable[[], None],
+):
+    """Run a pipeline once under lock, following an adaptive schedule
+
+    Parameters
+    ----------
+    lock_name: str
+        Take this lock for the duration of the run. Skip if already taken
+    get_pipeline_function: Callable[[], IDISPipeline]
+        Returns the pipeline to run
+    schedule_prefix: str
+        Keep schedule state under this prefix
+    rerun: bool
+        If True, ignore idle back off
+    queue_rerun: Callable[[], None]
+        Called when another run should be queued immediately
+    """
+    coordinator = get_coordinator()
+    schedule = AdaptiveSchedule.from_settings(
+        coordinator, prefix=schedule_prefix
     )
+    if not rerun and not schedule.is_due():
+        coordinator.incr("idle_skips")
+        return
+
+    with try_lock(
+        lock_name, timeout=settings.PIPELINE_LOCK_TIMEOUT
+    ) as acquired:
+        if not acquired:
+            logger.info(f"Previous run holding '{lock_name}'. Skipping")
+            coordinator.incr("skipped")
+            return
+
+        start = time.monotonic()
+        pipeline = get_pipeline_function()
+        pipeline.incoming.assert_all_paths()
+        pipeline.run_once()
+        record_run(coordinator, duration=time.monotonic() - start)
+        record_in_flight(coordinator, pipeline, prefix=schedule_prefix)
+        run_again = schedule.update(pipeline)
+
+    if run_again:
+        coordinator.incr("immediate_reruns")
+        queue_rerun()
+
+
+def record_run(coordinator, duration: float):
+    """Update run statistics. A run that takes longer than the scheduling
+    interval is counted as an overrun"""
+    coordinator.incr("runs")
+    coordinator.set_value("last_run_duration", duration)
+    PIPELINE_RUN_SECONDS.observe(duration)
+    coordinator.set_value("last_run_finished", time.time())
+    if duration > settings.PIPELINE_RUN_INTERVAL:
+        logger.warning(
+            f"Pipeline run took {duration:.1f} seconds, longer than the "
+            f"{settings.PIPELINE_RUN_INTERVAL} second interval"
+        )
+        coordinator.incr("overruns")
+
+
+def record_in_flight(coordinator, pipeline: "IDISPipeline", prefix: str = ""):
+    """Report jobs in flight per server and studies held back by in-flight
+    limits"""
+    from idis.pipeline.stages import BatchedPendingAnon
 
-    pipeline = IDISPipeline(
-        incoming=incoming,
-        cooled_down=cooled_down,
-        pending=pending,
-        finished=finished,
-        trash=trash,
-        errored=errored,
+    pending = pipeline.pending
+    if not isinstance(pending, BatchedPendingAnon):
+        return
+    if pending.dispatcher:
+        for name, depth in pending.dispatcher.get_queue_depths().items():
+            coordinator.set_value(f"in_flight.{name}", depth)
+    coordinator.set_value(f"{prefix}held_back", len(pending.held_back))
+    coordinator.set_value(
+        f"{prefix}held_back_longest_wait", pending.get_longest_wait()
     )
-    return pipeline
@@ -0,0 +1,316 @@
+""" Noticing studies in the incoming stage as soon as they are complete
+
+A scheduled pipeline run finds new studies by scanning all incoming folders
+and checking file modification times against the incoming cool down. This
+module watches the incoming folder of each stream instead. It keeps the last
+write time of each study in memory and hands out a study as soon as it has
+been quiet for long enough.
+
+On linux, inotify is used so that no folders need to be scanned at all. Where
+inotify is not available, incoming folders are polled.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (stream, study_id). Stream is an idis.pipeline.models.Stream
+StudyKey = Tuple[object, str]
+
+# inotify event masks, from linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+
+STREAM_FOLDER_MASK = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+STUDY_FOLDER_MASK = (
+    IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class StudyActivity:
+    """Last write time of each study that is being watched"""
+
+    def __init__(self):
+        self.last_write: Dict[StudyKey, float] = {}
+        # last write time of studies that have been handed out already
+        self.handed_out: Dict[StudyKey, float] = {}
+
+    def __len__(self):
+        return len(self.last_write)
+
+    def touch(self, key: StudyKey, when: float):
+        """Record a write to study at unix time when"""
+        if when <= self.handed_out.get(key, float("-inf")):
+            return  # nothing new since this study was handed out
+        self.last_write[key] = max(when, self.last_write.get(key, when))
+
+    def forget(self, key: StudyKey):
+        """Study has left the folder. Stop tracking it"""
+        self.last_write.pop(key, None)
+        self.handed_out.pop(key, None)
+
+    def pop_quiet(self, quiet_period: float, now: float) -> List[StudyKey]:
+        """Studies that have not been written to for quiet_period seconds.
+        These are not returned again unless they are written to again
+
+        Parameters
+        ----------
+        quiet_period: float
+            Seconds without writes
+        now: float
+            Current unix time
+        """
+        quiet = [
+            key
+            for key, last_write in self.last_write.items()
+            if now - last_write >= quiet_period
+        ]
+        for key in quiet:
+            self.handed_out[key] = self.last_write.pop(key)
+        return quiet
+
+
+class Watcher:
+    """Watches the incoming folder of each stream and records writes to
+    studies"""
+
+    def __init__(self, incoming, activity: StudyActivity):
+        """
+
+        Parameters
+        ----------
+        incoming: Stage
+            Watch the folders of all streams in this stage
+        activity: StudyActivity
+            Record writes here
+        """
+        self.incoming = incoming
+        self.activity = activity
+
+    def wait(self, timeout: float):
+        """Wait at most timeout seconds and record any writes"""
+        raise NotImplementedError(
+            "This is an abstract base class. Call a child class"
+        )
+
+    def close(self):
+        pass
+
+    def scan_stream(self, stream) -> Iterable[StudyKey]:
+        """Record the newest modification time of each study in stream, by
+        looking at all files
+
+        Returns
+        -------
+        Iterable[StudyKey]
+            All studies found
+        """
+        found = []
+        try:
+            folders = [
+                x
+                for x in os.scandir(self.incoming.get_path_for_stream(stream))
+                if x.is_dir()
+            ]
+        except FileNotFoundError:
+            return found
+        for folder in folders:
+            key = (stream, folder.name)
+            found.append(key)
+            try:
+                self.activity.touch(key, get_newest_mtime(Path(folder.path)))
+            except FileNotFoundError:
+                pass  # moved away while scanning
+        return found
+
+
+class PollingWatcher(Watcher):
+    """Finds writes by scanning all incoming folders each time"""
+
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+        found = set()
+        for stream in self.incoming.streams:
+            found.update(self.scan_stream(stream))
+        for key in set(self.activity.last_write) | set(
+            self.activity.handed_out
+        ):
+            if key not in found:
+                self.activity.forget(key)
+
+
+class InotifyWatcher(Watcher):
+    """Finds writes through linux inotify events. Folders are only scanned
+    once at start, or when the kernel event queue has overflowed
+
+    Raises
+    ------
+    WatcherException
+        If inotify is not available on this system
+    """
+
+    def __init__(self, incoming, activity: StudyActivity):
+        super().__init__(incoming=incoming, activity=activity)
+        self.libc = get_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatcherException(
+                f"Could not initialise inotify: "
+                f"{os.strerror(ctypes.get_errno())}"
+            )
+        # watch descriptor -> (stream, study_id). study_id is None for stream
+        # folders
+        self.watches: Dict[int, Tuple[object, str]] = {}
+        self.watch_all()
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise FileNotFoundError(
+                f"Could not watch {path}: {os.strerror(ctypes.get_errno())}"
+            )
+        return wd
+
+    def watch_all(self):
+        """Watch all stream folders and studies, and record current state"""
+        for stream in self.incoming.streams:
+            path = self.incoming.get_path_for_stream(stream)
+            self.watches[self.add_watch(path, STREAM_FOLDER_MASK)] = (
+                stream,
+                None,
+            )
+            for key in self.scan_stream(stream):
+                self.watch_study(key)
+
+    def watch_study(self, key: StudyKey):
+        stream, study_id = key
+        path = self.incoming.get_path_for_stream(stream) / study_id
+        try:
+            self.watches[self.add_watch(path, STUDY_FOLDER_MASK)] = key
+        except FileNotFoundError:
+            self.activity.forget(key)
+
+    def wait(self, timeout: float):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        now = time.time()
+        for wd, mask, name in self.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed. Rescanning")
+                self.watch_all()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            stream, study_id = self.watches.get(wd, (None, None))
+            if stream is None:
+                continue
+            if study_id is not None:  # something happened inside a study
+                if mask & IN_DELETE_SELF:
+                    self.activity.forget((stream, study_id))
+                else:
+                    self.activity.touch((stream, study_id), now)
+            elif mask & IN_ISDIR:  # a study folder appeared or left
+                key = (stream, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_study(key)
+                    self.activity.touch(key, now)
+                else:
+                    self.activity.forget(key)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """Read all waiting inotify events
+
+        Returns
+        -------
+        List[Tuple[int, int, str]]
+            watch descriptor, mask and name for each event
+        """
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            start = offset + EVENT_HEADER.size
+            offset = start + length
+            name = os.fsdecode(buffer[start:offset].rstrip(b"\0"))
+            events.append((wd, mask, name))
+        return events
+
+
+def get_libc():
+    """The C library, if it supports inotify
+
+    Raises
+    ------
+    WatcherException
+        If inotify is not available on this system
+    """
+    if not sys.platform.startswith("linux"):
+        raise WatcherException(f"inotify is not available on {sys.platform}")
+    libc = ctypes.CDLL(
+        ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+    )
+    if not hasattr(libc, "inotify_init1"):
+        raise WatcherException("inotify is not available in this C library")
+    return libc
+
+
+def get_watcher(incoming, activity: StudyActivity, poll=False) -> Watcher:
+    """An InotifyWatcher if possible, a PollingWatcher otherwise
+
+    Parameters
+    ----------
+    incoming: Stage
+        Watch the folders of all streams in this stage
+    activity: StudyActivity
+        Record writes here
+    poll: bool, optional
+        Always poll. Needed for network file systems, where inotify does not
+        see writes made by other hosts. Defaults to False
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(incoming=incoming, activity=activity)
+        except WatcherException as e:
+            logger.info(f"{e}. Falling back to polling")
+    return PollingWatcher(incoming=incoming, activity=activity)
+
+
+def get_newest_mtime(path: Path) -> float:
+    """Newest modification time of folder at path and the files in it"""
+    newest = path.stat().st_mtime
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                newest = max(newest, entry.stat().st_mtime)
+    return newest
+
+
+class WatcherException(Exception):
+    pass
@@ -3,6 +3,7 @@ from django.conf import settings
 from django.test import RequestFactory
 
 from idis.jobs.filehandling import JobFolder
+from idis.pipeline.cache import invalidate_pipelines
 
 from tests.factories import UserFactory
 
@@ -12,6 +13,13 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def fresh_pipelines():
+    """Built pipelines are kept per process, and only dropped when a change is
+    committed. Do not let a test use a pipeline built in an earlier test"""
+    invalidate_pipelines()
+
+
 @pytest.fixture
 def user() -> settings.AUTH_USER_MODEL:
     return UserFactory()
@@ -0,0 +1,125 @@
+import pytest
+from django.urls import reverse
+
+from idis.core.metrics import MetricsRegistry, get_store, get_store_for_url
+from idis.core.views import metrics
+from tests.factories import JobFactory
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    get_store().clear()
+    yield
+    get_store().clear()
+
+
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    files = registry.counter("files_total", "Files", ["stage"])
+    folder = registry.gauge("folder_files", "Files in folder")
+
+    files.inc(stage="incoming")
+    files.inc(2, stage="incoming")
+    files.inc(stage='a "quoted"\nstage')
+    folder.set(10)
+    folder.dec(3)
+
+    assert registry.render() == (
+        "# HELP files_total Files\n"
+        "# TYPE files_total counter\n"
+        'files_total{stage="a \\"quoted\\"\\nstage"} 1\n'
+        'files_total{stage="incoming"} 3\n'
+        "# HELP folder_files Files in folder\n"
+        "# TYPE folder_files gauge\n"
+        "folder_files 7\n"
+    )
+
+
+def test_gauge_set_all():
+    """Setting all values of a gauge should remove values for labels that
+    are gone"""
+    registry = MetricsRegistry()
+    folder = registry.gauge("folder_files", "Files in folder", ["folder"])
+    folder.set_all([(1, {"folder": "a"}), (2, {"folder": "b"})])
+    folder.set_all([(3, {"folder": "b"})])
+
+    assert get_store().get_values() == {'folder_files{folder="b"}': 3}
+
+
+def test_metric_errors():
+    registry = MetricsRegistry()
+    files = registry.counter("files_total", "Files", ["stage"])
+
+    with pytest.raises(ValueError):
+        files.inc(stream="a")  # wrong label
+    with pytest.raises(ValueError):
+        files.inc(-1, stage="incoming")
+    with pytest.raises(ValueError):
+        registry.gauge("files_total", "Again")
+    with pytest.raises(ValueError):
+        registry.counter("files", "Counter without _total")
+
+
+def test_unsupported_store_is_off():
+    """A broker url that is not redis should switch metrics off, not fail"""
+    for url in ("sqs://", ""):
+        store = get_store_for_url(url)
+        store.incr_many({"files_total": 1})
+        store.set_value("files", 1)
+        assert store.get_values() == {}
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    latency = registry.histogram(
+        "latency_seconds", "Latency", ["server"], buckets=[0.1, 1]
+    )
+
+    latency.observe(0.05, server="a")
+    latency.observe(0.5, server="a")
+    latency.observe(5, server="a")
+    with latency.time(server="b"):
+        pass
+
+    lines = registry.render().splitlines()
+    assert lines[2:7] == [
+        'latency_seconds_bucket{server="a",le="0.1"} 1',
+        'latency_seconds_bucket{server="a",le="1"} 2',
+        'latency_seconds_bucket{server="a",le="+Inf"} 3',
+        'latency_seconds_count{server="a"} 3',
+        'latency_seconds_sum{server="a"} 5.55',
+    ]
+    assert 'latency_seconds_count{server="b"} 1' in lines
+
+
+@pytest.mark.django_db
+def test_metrics_view(request_factory):
+    JobFactory(status="DONE")
+    JobFactory(status="DONE")
+
+    response = metrics(request_factory.get(reverse("metrics")))
+
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    content = response.content.decode()
+    assert "# TYPE idis_jobs gauge" in content
+    assert 'idis_jobs{status="DONE"} 2' in content
+    assert 'idis_jobs{status="ERROR"} 0' in content
+
+
+@pytest.mark.django_db
+def test_metrics_view_token(request_factory, settings):
+    settings.METRICS_TOKEN = "secret"
+
+    def get(**headers):
+        return metrics(request_factory.get(reverse("metrics"), **headers))
+
+    assert get().status_code == 403
+    assert get(HTTP_AUTHORIZATION="Bearer wrong").status_code == 403
+    assert get(HTTP_AUTHORIZATION="Bearer secret").status_code == 200
+
+
+def test_failing_collector(settings):
+    settings.METRICS_COLLECTORS = ["idis.does.not.exist"]
+
+    MetricsRegistry().collect()  # logs, does not raise
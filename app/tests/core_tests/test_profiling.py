@@ -0,0 +1,111 @@
+from io import StringIO
+
+import pytest
+from celery import shared_task
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+
+from idis.core import profiling
+from idis.core.profiling import (
+    MemoryProfileStore,
+    SamplingProfilerMiddleware,
+    get_store,
+    set_sample_rate,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    get_store().clear()
+    set_sample_rate(None)
+    yield
+    get_store().clear()
+    set_sample_rate(None)
+
+
+@shared_task
+def a_task():
+    return sum(range(1000))
+
+
+def a_view(request):
+    return HttpResponse(str(sum(range(1000))))
+
+
+def test_memory_store_is_bounded():
+    store = MemoryProfileStore()
+    for i in range(5):
+        store.push({"name": i}, size=3)
+
+    assert [x["name"] for x in store.get_samples()] == [4, 3, 2]
+
+
+def test_no_profiling_by_default(request_factory):
+    SamplingProfilerMiddleware(a_view)(request_factory.get("/"))
+    a_task.apply()
+
+    assert get_store().get_samples() == []
+
+
+def test_profile_request(request_factory, settings):
+    settings.PROFILING_SAMPLE_RATE = 1
+    settings.PROFILING_TOP_N = 5
+
+    response = SamplingProfilerMiddleware(a_view)(
+        request_factory.get("/jobs/")
+    )
+
+    assert response.content == b"499500"
+    (sample,) = get_store().get_samples()
+    assert (sample["kind"], sample["name"]) == ("request", "GET /jobs/")
+    assert len(sample["top"]) <= 5
+    assert any("a_view" in x["function"] for x in sample["top"])
+
+
+def test_profile_task():
+    set_sample_rate(1)  # switch on at runtime, without changing settings
+
+    a_task.apply()
+
+    (sample,) = get_store().get_samples()
+    assert (sample["kind"], sample["name"]) == ("task", a_task.name)
+    assert not profiling.task_profilers
+
+
+def test_rate_is_cached(settings):
+    settings.PROFILING_RATE_CHECK_INTERVAL = 60
+    sampler = profiling.Sampler()
+    assert sampler.get_rate() == 0
+
+    get_store().set_rate(0.5)
+    assert sampler.get_rate() == 0  # not checked again yet
+    sampler.expire()
+    assert sampler.get_rate() == 0.5
+
+
+def test_nested_profiles_are_skipped():
+    set_sample_rate(1)
+
+    with profiling.sampler.profile("request", "outer"):
+        a_task.apply()
+
+    assert [x["name"] for x in get_store().get_samples()] == ["outer"]
+
+
+def test_profiling_command():
+    out = StringIO()
+    call_command("profiling", rate=1, stdout=out)
+    with profiling.sampler.profile("request", "GET /jobs/"):
+        sum(range(1000))
+    call_command("profiling", functions=3, stdout=out)
+
+    output = out.getvalue()
+    assert "Sample rate 1" in output
+    assert "request GET /jobs/" in output
+
+    with pytest.raises(CommandError):
+        call_command("profiling", rate=2)
+
+    out = StringIO()
+    call_command("profiling", reset=True, clear=True, stdout=out)
+    assert out.getvalue() == "Sample rate 0 (settings)\n"
@@ -0,0 +1,50 @@
+import pytest
+
+from idis.benchmarks.startup import (
+    ENTRY_POINTS,
+    LAZY_MODULES,
+    STARTUP_BUDGETS,
+    ImportTimes,
+    measure_imports,
+)
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       150 |        150 |     _io
+import time:      2000 |       2150 |   pydicom.uid
+import time:      1000 |       3150 | pydicom
+some other output on stderr
+import time:       500 |        500 | idis.core.metrics
+"""
+
+
+def test_parse_import_times():
+    times = ImportTimes.parse(IMPORTTIME_OUTPUT)
+
+    assert times.total == pytest.approx(0.00365)
+    assert times.get_top_level() == {
+        "pydicom": 0.003,
+        "idis": 0.0005,
+        "_io": 0.00015,
+    }
+    assert times.get_imported(["pydicom", "anonapi"]) == ["pydicom"]
+
+
+@pytest.mark.parametrize("name", ENTRY_POINTS)
+def test_startup_budget(name):
+    """Processes should start without loading pipeline or CTP dependencies,
+    within their budget. If this fails, run the benchmark_startup command to
+    see where the time goes"""
+    times = measure_imports(ENTRY_POINTS[name])
+
+    assert times.get_imported(LAZY_MODULES) == []
+    assert times.total < STARTUP_BUDGETS[name]
+
+
+def test_metrics_collectors_stay_light():
+    """Serving /metrics in a web process should not load the pipeline"""
+    times = measure_imports(
+        ENTRY_POINTS["web"] + "; from idis.core.metrics import registry; "
+        "registry.collect()"
+    )
+
+    assert times.get_imported(LAZY_MODULES) == []
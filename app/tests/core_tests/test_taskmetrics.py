@@ -0,0 +1,92 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from celery import shared_task
+
+from idis.core import taskmetrics
+from idis.core.metrics import (
+    TASK_QUEUE_SECONDS,
+    MetricsBuffer,
+    MetricsRegistry,
+    get_store,
+)
+from idis.core.taskmetrics import READY_AT_HEADER, add_ready_at, get_ready_at
+
+
+@pytest.fixture(autouse=True)
+def empty_store():
+    get_store().clear()
+    yield
+    get_store().clear()
+
+
+@pytest.fixture
+def flush_always(monkeypatch):
+    """Send task timings to the store straight away"""
+    monkeypatch.setattr(taskmetrics, "buffer", MetricsBuffer(flush_interval=0))
+
+
+@shared_task
+def a_task(fail=False):
+    if fail:
+        raise ValueError("Failing on purpose")
+
+
+def test_metrics_buffer():
+    registry = MetricsRegistry()
+    files = registry.counter("files_total", "Files")
+    buffer = MetricsBuffer(flush_interval=60)
+
+    buffer.inc(files)
+    buffer.inc(files, 2)
+    buffer.flush_if_due()
+    assert get_store().get_values() == {}  # not due yet
+
+    buffer.flush()
+    assert get_store().get_values() == {"files_total": 3}
+    with pytest.raises(ValueError):
+        buffer.inc(files, -1)
+
+
+def test_get_ready_at():
+    now = time.time()
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    assert get_ready_at(None) == pytest.approx(now, abs=1)
+    assert get_ready_at("not a date") == pytest.approx(now, abs=1)
+    assert get_ready_at(later.isoformat()) == pytest.approx(later.timestamp())
+
+
+def test_add_ready_at():
+    headers = {"eta": None}
+
+    add_ready_at(headers=headers)
+    add_ready_at(headers=None)  # protocol 1, nothing to do
+
+    assert headers[READY_AT_HEADER] == pytest.approx(time.time(), abs=1)
+
+
+def test_task_run_time(flush_always):
+    a_task.apply()
+    a_task.apply(kwargs={"fail": True})
+
+    values = get_store().get_values()
+    name = a_task.name
+    assert (
+        values[f'idis_task_run_seconds_count{{task="{name}",state="SUCCESS"}}']
+        == 1
+    )
+    assert (
+        values[f'idis_task_run_seconds_count{{task="{name}",state="FAILURE"}}']
+        == 1
+    )
+    assert not taskmetrics.started
+
+
+def test_task_queue_wait(flush_always):
+    a_task.apply(headers={READY_AT_HEADER: time.time() - 5})
+
+    values = get_store().get_values()
+    key = TASK_QUEUE_SECONDS.get_key({"task": a_task.name}, "_sum")
+    assert 5 <= values[key] < 10
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from idis.benchmarks.jobs import (
+    CASES,
+    QuarantineSpec,
+    generate_quarantine,
+    run_benchmark,
+)
+from idis.benchmarks.results import (
+    BenchmarkResultsException,
+    Comparison,
+    compare,
+    load_results,
+    save_results,
+)
+
+
+def test_generate_quarantine(tmpdir):
+    spec = QuarantineSpec(n_files=40, n_folders=2, n_jobs=3, unknown_every=10)
+
+    folders = generate_quarantine(tmpdir, spec)
+
+    job_files = [x for folder in folders for x in folder.get_job_files()]
+    assert len(job_files) == 40
+    assert {x.job_id for x in job_files} == {None, 1, 2, 3}
+    assert len([x for x in job_files if x.job_id is None]) == 4
+
+
+def test_run_benchmark():
+    results = run_benchmark(sizes=[20, 40], n_folders=2, n_jobs=3)
+
+    assert len(results["seconds"]) == 2 * len(CASES)
+    assert results["seconds"]["IDISCTPQuarantine.scrape[40]"] > 0
+
+
+def test_comparison():
+    comparison = Comparison("scrape[1000]", old=1.0, new=1.5)
+
+    assert comparison.change == pytest.approx(0.5)
+    assert comparison.is_slowdown(threshold=0.2)
+    assert not comparison.is_slowdown(threshold=0.6)
+    assert not comparison.is_slowdown(threshold=0.2, min_seconds=1)
+    assert not Comparison("scrape[1000]", old=0, new=1).is_slowdown(0.2)
+
+
+def test_save_and_compare(tmpdir):
+    save_results({"seconds": {"a": 1.0, "b": 1.0}}, tmpdir / "old.json")
+    save_results({"seconds": {"b": 2.0, "c": 1.0}}, tmpdir / "new.json")
+
+    comparisons = compare(
+        load_results(tmpdir / "old.json"), load_results(tmpdir / "new.json")
+    )
+
+    assert [(x.name, x.old, x.new) for x in comparisons] == [("b", 1.0, 2.0)]
+    assert "version" in load_results(tmpdir / "new.json")
+
+
+def test_load_results_invalid(tmpdir):
+    path = tmpdir / "results.json"
+    with pytest.raises(BenchmarkResultsException):
+        load_results(path)  # does not exist
+    path.write_text(json.dumps({"files": 10}), "utf-8")
+    with pytest.raises(BenchmarkResultsException):
+        load_results(path)
+
+
+def test_benchmark_commands(tmpdir):
+    old = tmpdir / "old.json"
+    new = tmpdir / "new.json"
+    call_command("benchmark_jobs", "--sizes", "10", f"--output={old}")
+    call_command("compare_benchmarks", str(old), str(old))
+
+    results = load_results(old)
+    results["seconds"] = {x: y + 10 for x, y in results["seconds"].items()}
+    save_results(results, new)
+    with pytest.raises(CommandError):
+        call_command("compare_benchmarks", str(old), str(new))
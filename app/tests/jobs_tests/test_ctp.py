@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 
+from idis.core.metrics import buffer, get_store
 from idis.jobs.ctp import CTPQuarantineFolder, IDISCTPQuarantine
 from tests.jobs_tests import RESOURCE_PATH
 
@@ -162,3 +163,26 @@ def test_idis_ctp_archiving(idis_ctp_quarantine):
             if x.is_file()
         ]
     ) == len(files_for_job)
+
+
+def test_idis_ctp_quarantine_metrics(idis_ctp_quarantine):
+    """Scraping and archiving should keep quarantine sizes in metrics"""
+    buffer.flush()
+    get_store().clear()
+
+    idis_ctp_quarantine.scrape()
+
+    def total(name):
+        values = get_store().get_values()
+        return sum(y for x, y in values.items() if x.startswith(name + "{"))
+
+    assert total("idis_quarantine_files") == 8
+    assert total("idis_quarantine_scraped_files_total") == 8
+
+    idis_ctp_quarantine.archive(job_id=2)
+    assert total("idis_quarantine_files") == 6
+
+    # per file counts are buffered, and not stored until flushed
+    assert total("idis_job_files_total") == 0
+    buffer.flush()
+    assert total("idis_job_files_total") == 10
@@ -0,0 +1,211 @@
+from pathlib import Path
+
+import pytest
+
+from idis.jobs.deduplication import (
+    deduplicate_job,
+    get_fingerprint,
+    get_results_folder,
+    resolve_duplicates,
+)
+from idis.jobs.filehandling import JobFile, copy_job_file
+from idis.jobs.models import Job
+from idis.jobs.tasks import (
+    fetch_job_files,
+    finish_job,
+    process_job,
+    submit_job,
+)
+from tests.factories import (
+    FileOnDiskFactory,
+    JobFactory,
+    NetworkShareFactory,
+    ProfileFactory,
+)
+from tests.jobs_tests import RESOURCE_PATH
+
+EXISTING_FILE = RESOURCE_PATH / "retrieve_file_from_disk" / "file.dcm"
+
+
+@pytest.fixture(autouse=True)
+def results_folder(settings, tmpdir):
+    settings.IDIS_RESULTS_FOLDER = str(Path(tmpdir) / "results")
+
+
+@pytest.fixture()
+def share():
+    return NetworkShareFactory()
+
+
+def create_job(share, paths, profile=None, status=Job.PENDING):
+    """Job processing the files at paths on share"""
+    job = JobFactory(profile=profile or ProfileFactory(), status=status)
+    for path in paths:
+        FileOnDiskFactory(job=job, source=share, path=path)
+    return job
+
+
+def add_output(job):
+    """Put an output file for job in the results folder"""
+    copy_job_file(
+        JobFile(job_id=job.pk, path=EXISTING_FILE), get_results_folder()
+    )
+
+
+@pytest.fixture()
+def queued(mocker):
+    """Run queued fetch tasks straight away. Returns the pks of jobs queued
+    for processing"""
+    mocker.patch.object(
+        fetch_job_files,
+        "apply_async",
+        side_effect=lambda kwargs, **_: fetch_job_files.apply(kwargs=kwargs),
+    )
+    process = mocker.patch.object(process_job, "apply_async")
+    return lambda: [
+        x.kwargs["kwargs"]["job_pk"] for x in process.call_args_list
+    ]
+
+
+@pytest.mark.django_db
+def test_fingerprint(share):
+    """Order of input does not matter. Profile options do, profile titles not"""
+    job = create_job(share, ["/a", "/b"])
+    assert get_fingerprint(job) == get_fingerprint(
+        create_job(share, ["/b", "/a"])
+    )
+    assert get_fingerprint(job) != get_fingerprint(
+        create_job(share, ["/a", "/b", "/c"])
+    )
+    assert get_fingerprint(job) != get_fingerprint(
+        create_job(share, ["/a", "/b"], profile=ProfileFactory(Basic=False))
+    )
+
+
+@pytest.mark.django_db
+def test_no_duplicate(share):
+    """A new job should be processed normally"""
+    job = create_job(share, ["/a"])
+    assert deduplicate_job(job) is None
+    assert job.fingerprint
+
+
+@pytest.mark.django_db
+def test_reuse_finished_job(share):
+    """Output of a finished job should be hard linked for the new job"""
+    original = create_job(share, ["/a", "/b"], status=Job.DONE)
+    deduplicate_job(original)
+    add_output(original)
+
+    job = create_job(share, ["/b", "/a"])
+    assert deduplicate_job(job) == original
+
+    job.refresh_from_db()
+    assert job.status == Job.DONE
+    assert job.duplicate_of == original
+    original_file = get_results_folder().get_files(original.pk)[0]
+    new_file = get_results_folder().get_files(job.pk)[0]
+    assert new_file.path.stat().st_ino == original_file.path.stat().st_ino
+
+
+@pytest.mark.django_db
+def test_finished_job_output_not_retained(share):
+    """Finished jobs without output in results cannot be reused"""
+    original = create_job(share, ["/a"], status=Job.DONE)
+    deduplicate_job(original)
+
+    assert deduplicate_job(create_job(share, ["/a"])) is None
+
+
+@pytest.mark.django_db
+def test_attach_to_job_in_progress(share):
+    """A job identical to one in progress should wait and get its output"""
+    original = create_job(share, ["/a"], status=Job.PROCESSING)
+    deduplicate_job(original)
+    job = create_job(share, ["/a"])
+
+    assert deduplicate_job(job) == original
+    job.refresh_from_db()
+    assert job.status == Job.PENDING
+
+    original.status = Job.DONE
+    original.save()
+    add_output(original)
+    assert resolve_duplicates(original) == [job]
+
+    job.refresh_from_db()
+    assert job.status == Job.DONE
+    assert get_results_folder().get_file_count(job.pk) == 1
+
+
+@pytest.mark.django_db
+def test_attached_job_detached_on_error(share):
+    """If the job that is waited for fails, the waiting job is on its own"""
+    original = create_job(share, ["/a"], status=Job.PROCESSING)
+    deduplicate_job(original)
+    job = create_job(share, ["/a"])
+    deduplicate_job(job)
+
+    original.status = Job.ERROR
+    original.save()
+    resolve_duplicates(original)
+
+    job.refresh_from_db()
+    assert job.duplicate_of is None
+    assert job.status == Job.PENDING
+
+
+@pytest.mark.django_db
+def test_submit_job(share, queued):
+    """A new job is fetched and queued for processing. An identical job
+    submitted after it waits instead"""
+    original = create_job(share, [str(EXISTING_FILE)])
+    job = create_job(share, [str(EXISTING_FILE)])
+
+    submit_job(job_pk=original.pk)
+    submit_job(job_pk=job.pk)
+
+    original.refresh_from_db()
+    job.refresh_from_db()
+    assert original.status == Job.PROCESSING
+    assert (job.status, job.duplicate_of) == (Job.PENDING, original)
+    assert queued() == [original.pk]
+
+
+@pytest.mark.django_db
+def test_finish_job_reuses_output(share, queued):
+    """Delivered output is handed to waiting jobs and to later jobs"""
+    original = create_job(share, [str(EXISTING_FILE)])
+    waiting = create_job(share, [str(EXISTING_FILE)])
+    submit_job(job_pk=original.pk)
+    submit_job(job_pk=waiting.pk)
+
+    output = JobFile(job_id=original.pk, path=EXISTING_FILE)
+    finish_job(original, output_files=[output])
+
+    later = create_job(share, [str(EXISTING_FILE)])
+    submit_job(job_pk=later.pk)
+    for job in (original, waiting, later):
+        job.refresh_from_db()
+        assert job.status == Job.DONE
+        assert get_results_folder().get_file_count(job.pk) == 1
+    assert queued() == [original.pk]
+
+
+@pytest.mark.django_db
+def test_detached_duplicate_makes_progress(share, queued):
+    """When the job that is waited for fails, the waiting job is fetched and
+    processed by itself"""
+    original = create_job(share, [str(EXISTING_FILE)])
+    waiting = create_job(share, [str(EXISTING_FILE)])
+    submit_job(job_pk=original.pk)
+    submit_job(job_pk=waiting.pk)
+
+    finish_job(original, error="CTP did not return any files")
+
+    original.refresh_from_db()
+    waiting.refresh_from_db()
+    assert original.status == Job.ERROR
+    assert waiting.duplicate_of is None
+    assert waiting.status == Job.PROCESSING
+    assert queued() == [original.pk, waiting.pk]
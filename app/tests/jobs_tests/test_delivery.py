@@ -0,0 +1,189 @@
+import time
+from pathlib import Path
+from shutil import copyfile
+from unittest.mock import PropertyMock
+
+import pytest
+
+from idis.jobs.delivery import deliver_files
+from idis.jobs.filehandling import (
+    ChecksumException,
+    JobFile,
+    SafeFolder,
+    claim_path,
+    copy_job_file_atomic,
+)
+from idis.jobs.models import Folder, NetworkShare
+from tests.factories import JobFactory
+
+
+@pytest.fixture()
+def job_files(tmpdir_factory):
+    """Five small files for job 1"""
+    folder = Path(tmpdir_factory.mktemp("output"))
+    job_files = []
+    for i in range(5):
+        path = folder / f"file{i}.dcm"
+        path.write_bytes(bytes([i]) * 100)
+        job_files.append(JobFile(job_id=1, path=path))
+    return job_files
+
+
+@pytest.fixture()
+def destination_share(tmpdir_factory, mocker):
+    """A network share whose path points to a temp folder"""
+    share_path = Path(tmpdir_factory.mktemp("share"))
+    mocker.patch.object(
+        NetworkShare,
+        "path",
+        new_callable=PropertyMock,
+        return_value=str(share_path),
+    )
+    return NetworkShare(hostname="host", sharename="share")
+
+
+def test_copy_job_file_atomic(job_files, tmpdir):
+    """Copy should end up under the original name, without temp files"""
+    destination = SafeFolder(Path(tmpdir) / "destination")
+    written = copy_job_file_atomic(
+        job_files[0], destination, verify_checksum=True
+    )
+
+    assert written == destination.path / "file0.dcm"
+    assert written.read_bytes() == job_files[0].path.read_bytes()
+    assert [x.name for x in destination.path.iterdir()] == ["file0.dcm"]
+
+
+def test_copy_job_file_atomic_checksum_mismatch(job_files, tmpdir, mocker):
+    """A corrupted copy should never appear in the destination"""
+    mocker.patch("idis.jobs.filehandling.get_checksum", side_effect=["a", "b"])
+    destination = SafeFolder(Path(tmpdir) / "destination")
+    with pytest.raises(ChecksumException):
+        copy_job_file_atomic(job_files[0], destination, verify_checksum=True)
+
+    assert list(destination.path.iterdir()) == []
+
+
+@pytest.fixture()
+def same_named_files(tmpdir_factory):
+    """50 files with different content, all named IM0001"""
+    job_files = []
+    for i in range(50):
+        path = Path(tmpdir_factory.mktemp(f"source{i}")) / "IM0001"
+        path.write_bytes(bytes([i]) * 1000)
+        job_files.append(JobFile(job_id=1, path=path))
+    return job_files
+
+
+def test_claim_path(tmpdir):
+    """A taken name should never be overwritten"""
+    folder = Path(tmpdir)
+    (folder / "IM0001").write_text("first")
+    (folder / ".temp").write_text("second")
+
+    claimed = claim_path(folder / ".temp", folder / "IM0001")
+
+    assert claimed != folder / "IM0001"
+    assert (folder / "IM0001").read_text() == "first"
+    assert claimed.read_text() == "second"
+    assert not (folder / ".temp").exists()
+
+
+def test_claim_path_without_hard_links(tmpdir, mocker):
+    """File systems without hard links should not overwrite either"""
+    mocker.patch("os.link", side_effect=PermissionError("no hard links"))
+    folder = Path(tmpdir)
+    (folder / "IM0001").write_text("first")
+    (folder / ".temp").write_text("second")
+
+    claimed = claim_path(folder / ".temp", folder / "IM0001")
+
+    assert (folder / "IM0001").read_text() == "first"
+    assert claimed.read_text() == "second"
+    assert not (folder / ".temp").exists()
+
+
+@pytest.fixture()
+def slow_copies(mocker):
+    """Copies that take a while, so that copies of same-named files overlap"""
+
+    def slow_copyfile(source, destination):
+        copyfile(source, destination)
+        time.sleep(0.05)
+
+    mocker.patch("idis.jobs.filehandling.copyfile", slow_copyfile)
+
+
+def test_deliver_same_named_files(same_named_files, tmpdir, slow_copies):
+    """Files with the same name sent at the same time should all arrive,
+    each under its own name"""
+    destination = SafeFolder(Path(tmpdir) / "destination")
+
+    report = deliver_files(
+        same_named_files,
+        send_function=lambda x: copy_job_file_atomic(x, destination),
+        max_workers=16,
+    )
+
+    assert report.all_succeeded
+    written = [x.destination for x in report.results]
+    assert len(set(written)) == 50
+    assert sorted(x.read_bytes() for x in written) == sorted(
+        x.path.read_bytes() for x in same_named_files
+    )
+    assert len(list(destination.path.iterdir())) == 50
+
+
+@pytest.mark.django_db
+def test_folder_send_files(job_files, destination_share):
+    """Sending a batch to a folder should deliver each file, and record
+    how long delivery took for the job"""
+    job = JobFactory(pk=1)
+    folder = Folder(storage=destination_share, relative_path="output")
+    report = folder.send_files(job_files, verify_checksums=True)
+
+    assert report.all_succeeded
+    assert len(report.succeeded) == 5
+    assert {x.name for x in folder.path.iterdir()} == {
+        x.name for x in job_files
+    }
+    span = job.spans.get()
+    assert (span.phase, span.file_count, span.error) == ("DELIVERY", 5, "")
+
+
+@pytest.mark.django_db
+def test_folder_send_same_named_files(
+    same_named_files, destination_share, slow_copies
+):
+    """Same-named files sent to a folder in parallel should not overwrite
+    each other"""
+    JobFactory(pk=1)
+    destination_share.max_parallel_transfers = 16
+    folder = Folder(storage=destination_share, relative_path="output")
+
+    report = folder.send_files(same_named_files)
+
+    assert report.all_succeeded
+    assert len({x.destination for x in report.results}) == 50
+    assert sorted(x.read_bytes() for x in folder.path.iterdir()) == sorted(
+        x.path.read_bytes() for x in same_named_files
+    )
+
+
+def test_deliver_files_partial_failure(job_files, tmpdir):
+    """One failing file should not stop the rest. Failed files are reported
+    so they can be retried"""
+    destination = SafeFolder(Path(tmpdir))
+
+    def send(job_file):
+        if job_file.name == "file3.dcm":
+            raise OSError("Share went away")
+        return copy_job_file_atomic(job_file, destination)
+
+    report = deliver_files(job_files, send_function=send, max_workers=3)
+
+    assert len(report.succeeded) == 4
+    assert [x.name for x in report.get_failed_files()] == ["file3.dcm"]
+    assert "Share went away" in report.failed[0].error
+    # results are in the same order as the input
+    assert [x.job_file for x in report.results] == job_files
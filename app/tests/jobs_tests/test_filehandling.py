@@ -1,13 +1,17 @@
+import os
 import pytest
 
+from datetime import datetime, timedelta
 from distutils import dir_util
 from pathlib import Path
 
 from idis.jobs.filehandling import (
+    FileFilter,
     JobFolder,
     SafeFolder,
     JobFile,
     copy_job_file,
+    iterate_files,
 )
 from tests.jobs_tests import RESOURCE_PATH
 
@@ -107,3 +111,74 @@ def test_job_folder_missing_job_id(job_file, job_folder):
 
     assert job_folder.get_job_ids() == []
     assert len(job_folder.get_unknown_job_files()) == 1
+
+
+@pytest.fixture()
+def nested_folder(empty_folder):
+    """A folder with files spread over nested series folders, like a DICOM
+    export:
+
+    study/file0.dcm
+    study/series_0/file0.dcm, file1.dcm, notes.txt
+    study/series_1/file0.dcm, file1.dcm, notes.txt
+    study/series_1/sub/file0.dcm
+    """
+    base = Path(empty_folder)
+    (base / "study").mkdir()
+    (base / "study" / "file0.dcm").write_bytes(b"0" * 10)
+    for series in ("series_0", "series_1"):
+        series_path = base / "study" / series
+        series_path.mkdir()
+        (series_path / "file0.dcm").write_bytes(b"0" * 10)
+        (series_path / "file1.dcm").write_bytes(b"0" * 1000)
+        (series_path / "notes.txt").write_bytes(b"0" * 1000)
+    (base / "study" / "series_1" / "sub").mkdir()
+    (base / "study" / "series_1" / "sub" / "file0.DCM").write_bytes(b"0")
+    return base
+
+
+def test_iterate_files(nested_folder):
+    """All files in all sub folders should be found"""
+    found = list(iterate_files(nested_folder, max_workers=2))
+    assert len(found) == 8
+    assert len(set(found)) == 8
+    assert all(x.is_file() for x in found)
+
+
+def test_iterate_files_filter(nested_folder):
+    """Filters are applied while walking"""
+    dicom_only = FileFilter(suffixes=[".dcm"])
+    assert len(list(iterate_files(nested_folder, dicom_only))) == 6
+
+    large_only = FileFilter(min_size=100)
+    assert len(list(iterate_files(nested_folder, large_only))) == 4
+
+    large_dicom = FileFilter(suffixes=[".dcm"], min_size=100)
+    assert len(list(iterate_files(nested_folder, large_dicom))) == 2
+
+
+def test_iterate_files_filter_mtime(nested_folder):
+    """Files can be filtered on modification time"""
+    old_file = nested_folder / "study" / "file0.dcm"
+    two_days_ago = (datetime.now() - timedelta(days=2)).timestamp()
+    os.utime(old_file, (two_days_ago, two_days_ago))
+
+    yesterday = datetime.now() - timedelta(days=1)
+    recent = FileFilter(modified_after=yesterday)
+    older = FileFilter(modified_before=yesterday)
+
+    assert old_file not in list(iterate_files(nested_folder, recent))
+    assert list(iterate_files(nested_folder, older)) == [old_file]
+
+
+def test_iterate_files_stop_early(nested_folder):
+    """Iterating can be stopped at any time without waiting for the full walk"""
+    files = iterate_files(nested_folder, max_workers=1)
+    assert next(files)
+    files.close()
+
+
+def test_iterate_files_missing_folder(empty_folder):
+    """A non-existent root folder should not silently return nothing"""
+    with pytest.raises(FileNotFoundError):
+        list(iterate_files(Path(empty_folder) / "does_not_exist"))
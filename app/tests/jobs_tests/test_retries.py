@@ -0,0 +1,100 @@
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+from django.utils import timezone
+
+from idis.jobs.filehandling import JobFolder
+from idis.jobs.models import FileOnDisk, Job
+from idis.jobs.retries import RetryPolicy, download_job_files
+from idis.jobs.tasks import fetch_job_files
+from tests.factories import FileOnDiskFactory, JobFactory
+from tests.jobs_tests import RESOURCE_PATH
+
+EXISTING_FILE = RESOURCE_PATH / "retrieve_file_from_disk" / "file.dcm"
+
+
+@pytest.fixture()
+def job_with_flaky_file(tmpdir):
+    """A job with two files that can be downloaded and one that cannot be
+    downloaded yet"""
+    job = JobFactory()
+    FileOnDiskFactory(job=job, path=EXISTING_FILE)
+    FileOnDiskFactory(job=job, path=EXISTING_FILE)
+    FileOnDiskFactory(job=job, path=Path(tmpdir) / "flaky" / "file.dcm")
+    return job
+
+
+def test_retry_policy_delay():
+    """Delay doubles with each attempt until max_delay"""
+    policy = RetryPolicy(base_delay=10, max_delay=100, jitter=0)
+    delays = [policy.get_delay(x).total_seconds() for x in range(1, 6)]
+    assert delays == [10, 20, 40, 80, 100]
+
+
+def test_retry_policy_jitter():
+    """Jitter should only ever shorten delays, by at most the given fraction"""
+    policy = RetryPolicy(base_delay=10, jitter=0.5)
+    delays = {policy.get_delay(2).total_seconds() for _ in range(50)}
+    assert all(10 <= x <= 20 for x in delays)
+    assert len(delays) > 1
+
+
+@pytest.mark.django_db
+def test_download_job_files_retry_only_failed(job_with_flaky_file, tmpdir):
+    """Only the failed file should be tried again. Job status follows files"""
+    job = job_with_flaky_file
+    folder = JobFolder(Path(tmpdir) / "pre_fetch")
+    policy = RetryPolicy(base_delay=60)
+
+    attempted = download_job_files(job, folder, policy=policy)
+    assert len(attempted) == 3
+    statuses = sorted(x.status for x in job.get_file_infos())
+    assert statuses == [FileOnDisk.DONE, FileOnDisk.DONE, FileOnDisk.FAILED]
+    assert Job.objects.get(pk=job.pk).status == Job.DOWNLOADING
+
+    # flaky file is not due yet, so nothing should be tried
+    assert download_job_files(job, folder, policy=policy) == []
+
+    # make the flaky file available and due
+    flaky = FileOnDisk.objects.get(job=job, status=FileOnDisk.FAILED)
+    assert flaky.attempts == 1
+    Path(flaky.path).parent.mkdir()
+    Path(flaky.path).write_bytes(EXISTING_FILE.read_bytes())
+    flaky.next_attempt = timezone.now() - timedelta(seconds=1)
+    flaky.save()
+
+    attempted = download_job_files(job, folder, policy=policy)
+    assert attempted == [flaky]
+    job.refresh_from_db()
+    # downloaded, but not anonymised or delivered yet
+    assert job.status == Job.PROCESSING
+    assert job.files_downloaded == 3
+    # files that succeeded the first time were not downloaded again
+    assert len(folder.get_files(job.pk)) == 3
+
+
+@pytest.mark.django_db
+def test_download_job_files_give_up(job_with_flaky_file, tmpdir):
+    """After too many attempts a file is given up on and the job errors"""
+    job = job_with_flaky_file
+    folder = JobFolder(Path(tmpdir) / "pre_fetch")
+
+    download_job_files(job, folder, policy=RetryPolicy(max_attempts=1))
+
+    job.refresh_from_db()
+    assert job.status == Job.ERROR
+    assert "1 of 3 files failed" in job.error
+    assert job.get_due_file_infos() == []
+
+
+@pytest.mark.django_db
+def test_fetch_job_files_reschedules(job_with_flaky_file, settings, mocker):
+    """Task should schedule itself again when files are waiting for retry"""
+    apply_async = mocker.patch.object(fetch_job_files, "apply_async")
+    settings.IDIS_FILE_RETRY_BASE_DELAY = 60
+
+    fetch_job_files(job_pk=job_with_flaky_file.pk)
+
+    assert apply_async.called
+    assert 0 < apply_async.call_args.kwargs["countdown"] <= 60
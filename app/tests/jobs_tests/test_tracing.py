@@ -0,0 +1,167 @@
+import math
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from idis.benchmarks.jobs import QuarantineSpec, generate_quarantine
+from idis.jobs.ctp import IDISCTPQuarantine
+from idis.jobs.filehandling import JobFolder
+from idis.jobs.models import JobSpan
+from idis.jobs.retries import RetryPolicy, download_job_files
+from idis.jobs.tracing import (
+    get_phase_percentiles,
+    percentile,
+    scrape_quarantine,
+    trace,
+)
+from idis.jobs.views import job_timeline, phase_timings
+from tests.factories import (
+    FileOnDiskFactory,
+    JobFactory,
+    ProfileFactory,
+)
+from tests.jobs_tests.test_retries import EXISTING_FILE
+
+
+def add_span(job, phase, seconds, started=None):
+    started = started or timezone.now()
+    return JobSpan.objects.create(
+        job=job,
+        phase=phase,
+        started=started,
+        finished=started + timedelta(seconds=seconds),
+    )
+
+
+@pytest.mark.django_db
+def test_trace():
+    job = JobFactory()
+
+    with trace(job, JobSpan.CTP_INPUT) as span:
+        span.file_count = 3
+    with pytest.raises(ValueError):
+        with trace(job, JobSpan.CTP_OUTPUT):
+            raise ValueError("CTP output folder missing")
+
+    spans = list(job.spans.order_by("started"))
+    assert [(x.phase, x.file_count, x.error) for x in spans] == [
+        (JobSpan.CTP_INPUT, 3, ""),
+        (JobSpan.CTP_OUTPUT, 0, "CTP output folder missing"),
+    ]
+    assert spans[0].duration >= 0
+
+
+@pytest.mark.django_db
+def test_record_spans():
+    job = JobFactory()
+    now = timezone.now()
+
+    spans = JobSpan.record(
+        JobSpan.DELIVERY,
+        started=now,
+        finished=now,
+        file_counts={str(job.pk): 2, 99999: 1, None: 4},
+        errors={job.pk: "1 files failed"},
+    )
+
+    assert [(x.job_id, x.file_count, x.error) for x in spans] == [
+        (job.pk, 2, "1 files failed")
+    ]
+
+
+@pytest.mark.django_db
+def test_scrape_quarantine(tmpdir):
+    jobs = [JobFactory(pk=x) for x in (1, 2)]  # job 3 does not exist
+    folders = generate_quarantine(
+        Path(tmpdir) / "ctp",
+        QuarantineSpec(n_files=30, n_folders=2, n_jobs=3, unknown_every=10),
+    )
+    quarantine = IDISCTPQuarantine(Path(tmpdir) / "idis", folders)
+
+    spans = scrape_quarantine(quarantine)
+
+    assert {x.job_id: x.file_count for x in spans} == {1: 9, 2: 9}
+    assert all(x.phase == JobSpan.QUARANTINE for x in spans)
+    assert jobs[0].spans.count() == 1
+
+
+@pytest.mark.django_db
+def test_prefetch_span(tmpdir):
+    job = JobFactory()
+    FileOnDiskFactory(job=job, path=EXISTING_FILE)
+    FileOnDiskFactory(job=job, path=Path(tmpdir) / "missing.dcm")
+    folder = JobFolder(Path(tmpdir) / "pre_fetch")
+
+    download_job_files(job, folder, policy=RetryPolicy(base_delay=60))
+    download_job_files(job, folder)  # nothing due, no span
+
+    span = job.spans.get()
+    assert span.phase == JobSpan.PREFETCH
+    assert span.file_count == 2
+    assert span.error == "1 of 2 files failed"
+
+
+def test_percentile():
+    assert math.isnan(percentile([], 50))
+    assert percentile([4], 99) == 4
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile(list(range(101)), 90) == 90
+
+
+@pytest.mark.django_db
+def test_get_phase_percentiles():
+    profile = ProfileFactory(title="research")
+    for seconds in (1, 2, 3, 4):
+        add_span(JobFactory(profile=profile), JobSpan.PREFETCH, seconds)
+    add_span(JobFactory(profile=None), JobSpan.DELIVERY, 10)
+    long_ago = timezone.now() - timedelta(days=100)
+    add_span(JobFactory(profile=profile), JobSpan.PREFETCH, 100, long_ago)
+
+    recent = get_phase_percentiles(
+        since=timezone.now() - timedelta(days=30), percentiles=[50, 100]
+    )
+
+    assert recent == {
+        "": {JobSpan.DELIVERY: {"count": 1, "p50": 10, "p100": 10}},
+        "research": {JobSpan.PREFETCH: {"count": 4, "p50": 2.5, "p100": 4}},
+    }
+    assert get_phase_percentiles()["research"][JobSpan.PREFETCH]["count"] == 5
+
+
+@pytest.fixture
+def plain_static_files(settings):
+    """Render templates without a collected static files manifest"""
+    settings.STATICFILES_STORAGE = (
+        "django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+
+
+@pytest.mark.django_db
+def test_job_timeline_view(request_factory, user, plain_static_files):
+    job = JobFactory()
+    add_span(job, JobSpan.PREFETCH, 2)
+    request = request_factory.get(reverse("jobs:job_timeline", args=[job.pk]))
+    request.user = user
+
+    response = job_timeline(request, pk=job.pk)
+
+    assert response.status_code == 200
+    assert "Prefetch input files" in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_phase_timings_view(request_factory, user, plain_static_files):
+    add_span(
+        JobFactory(profile=ProfileFactory(title="research")), "DELIVERY", 3
+    )
+    request = request_factory.get(reverse("jobs:phase_timings"), {"days": 7})
+    request.user = user
+
+    response = phase_timings(request)
+
+    content = response.content.decode()
+    assert "research" in content
+    assert "Deliver output" in content
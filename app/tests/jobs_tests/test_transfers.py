@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from idis.jobs.filehandling import JobFolder
+from idis.jobs.models import WADOFile
+from idis.jobs.transfers import run_sync, transfer_all
+from tests.factories import FileOnDiskFactory, WadoServerFactory
+from tests.jobs_tests import RESOURCE_PATH
+
+
+def slow_transfer(item):
+    """Pretend to be a latency bound transfer"""
+    time.sleep(0.2)
+    if item == "broken":
+        raise ValueError("Could not transfer")
+    return item.upper()
+
+
+def test_transfer_all_concurrent():
+    """Many slow transfers should run at the same time"""
+    items = [f"item{i}" for i in range(50)]
+    start = time.time()
+    results = run_sync(transfer_all(slow_transfer, items, max_concurrent=50))
+
+    assert time.time() - start < 2  # sequential would take 10 seconds
+    assert [x.value for x in results] == [x.upper() for x in items]
+
+
+def test_transfer_all_errors():
+    """One failing transfer should not affect the others"""
+    results = run_sync(
+        transfer_all(slow_transfer, ["a", "broken", "b"], max_concurrent=2)
+    )
+    assert [x.succeeded for x in results] == [True, False, True]
+    assert "Could not transfer" in results[1].error
+
+
+def test_run_sync_inside_event_loop():
+    """The sync adapter should also work when called from async code"""
+
+    async def call_sync_code():
+        return run_sync(transfer_all(slow_transfer, ["a"], max_concurrent=1))
+
+    results = asyncio.run(call_sync_code())
+    assert results[0].value == "A"
+
+
+@pytest.mark.django_db
+def test_network_share_download_many(tmpdir):
+    """Download several files from a share in one go"""
+    file_infos = [
+        FileOnDiskFactory(
+            path=RESOURCE_PATH / "retrieve_file_from_disk" / "file.dcm"
+        )
+        for _ in range(3)
+    ]
+    file_infos.append(FileOnDiskFactory(path="/does/not/exist"))
+    share = file_infos[0].source
+    folder = JobFolder(Path(tmpdir))
+
+    results = share.download_files_to(file_infos, folder=folder)
+
+    assert [x.succeeded for x in results] == [True, True, True, False]
+    for file_info, result in zip(file_infos, results[:3]):
+        assert result.value.job_id == file_info.job_id
+        assert result.value.path.exists()
+
+
+class WadoHandler(BaseHTTPRequestHandler):
+    """Returns the requested object uid as file content. 404 for 'missing'"""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        object_uid = query["objectUID"][0]
+        if object_uid == "missing":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/dicom")
+        self.end_headers()
+        self.wfile.write(object_uid.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def wado_http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WadoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.django_db
+def test_wado_server_download_many(wado_http_server, tmpdir):
+    """Download from a (local) WADO server"""
+    server = WadoServerFactory(
+        hostname="127.0.0.1", port=wado_http_server.server_address[1]
+    )
+    object_uids = ["1.2.3", "1.2.4", "missing"]
+    file_infos = [
+        WADOFile(source=server, study_uid="1", series_uid="1.2", object_uid=x)
+        for x in object_uids
+    ]
+    folder = JobFolder(Path(tmpdir))
+
+    results = server.download_files_to(file_infos, folder=folder)
+
+    assert [x.succeeded for x in results] == [True, True, False]
+    assert results[0].value.path.read_bytes() == b"1.2.3"
+    assert results[1].value.path.name == "1.2.4"
+    # no partially downloaded files should be left behind
+    assert len(list(Path(tmpdir).rglob("*.part"))) == 0
@@ -1,4 +1,21 @@
+import os
 from pathlib import Path
 
+import pydicom
+
 BASE_PATH = Path(__file__).parent.absolute()
 RESOURCE_PATH = BASE_PATH / "resources"
+
+
+def write_dicom(
+    path: Path, study_uid: str, sop_uid: str, age: float = 60, **elements
+):
+    """Copy of the test DICOM file with the given UIDs and other elements,
+    last written age seconds ago"""
+    dataset = pydicom.dcmread(str(RESOURCE_PATH / "a_dicom_file"))
+    dataset.StudyInstanceUID = study_uid
+    dataset.SOPInstanceUID = sop_uid
+    for keyword, value in elements.items():
+        setattr(dataset, keyword, value)
+    dataset.save_as(str(path))
+    os.utime(path, (0, path.stat().st_mtime - age))
@@ -0,0 +1,53 @@
+import pydicom
+import pytest
+from django.core.management import call_command
+
+from idis.benchmarks.corpus import CorpusSpec, generate_corpus
+from idis.benchmarks.pipeline import run_benchmark
+from idis.pipeline.models import IDISJobRecord, Stream
+
+
+def test_generate_corpus(tmpdir):
+    spec = CorpusSpec(
+        n_studies=2, n_series=2, n_instances=3, rows=8, columns=8
+    )
+
+    files = generate_corpus(tmpdir, spec)
+
+    assert len(files) == spec.n_files == 12
+    assert len({x.parent for x in files}) == 2  # a folder per study
+    dataset = pydicom.dcmread(str(files[0]))
+    assert dataset.Rows == 8
+    assert len(dataset.PixelData) == 8 * 8 * 2
+
+
+@pytest.mark.django_db
+def test_run_benchmark():
+    spec = CorpusSpec(
+        n_studies=3, n_series=1, n_instances=2, rows=8, columns=8
+    )
+
+    results = run_benchmark(spec, n_streams=2, latency=0)
+
+    assert results["files"] == 12
+    assert results["finished_studies"] == 6
+    assert results["files_per_second"] > 0
+    assert results["stage_seconds"]["pending.push_studies"] > 0
+    assert results["peak_rss_mb"] > 0
+    assert not Stream.objects.exists()  # rolled back
+    assert not IDISJobRecord.objects.exists()
+
+
+@pytest.mark.django_db
+def test_benchmark_command(tmpdir):
+    output = tmpdir / "results.json"
+    call_command(
+        "benchmark_pipeline",
+        "--studies=1",
+        "--instances=1",
+        "--latency=0",
+        "--loose",
+        f"--output={output}",
+    )
+
+    assert output.exists()
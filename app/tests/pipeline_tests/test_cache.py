@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+
+from idis.pipeline.cache import PIPELINE_VERSION_CACHE_KEY
+from idis.pipeline.building import get_pipeline, settings
+from tests.factories import StreamFactory
+
+
+@pytest.fixture
+def pipeline_settings(monkeypatch, tmpdir):
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr(settings, "PIPELINE_RECORDS_DB_URL", "sqlite://")
+
+
+@pytest.mark.django_db
+def test_pipeline_is_cached(pipeline_settings):
+    """Without changes, the same pipeline should be used for each run"""
+    StreamFactory()
+    assert get_pipeline() is get_pipeline()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pipeline_invalidated_by_stream_change(pipeline_settings):
+    """Changing streams or profiles should cause a rebuild"""
+    stream = StreamFactory()
+    pipeline = get_pipeline()
+    assert [x.name for x in pipeline.incoming.streams] == [stream.name]
+
+    stream.name = "a_new_name"
+    stream.save()
+    pipeline_after_save = get_pipeline()
+    assert pipeline_after_save is not pipeline
+    assert pipeline_after_save.incoming.streams[0].name == "a_new_name"
+
+    stream.idis_profile.title = "a new title"
+    stream.idis_profile.save()
+    assert get_pipeline() is not pipeline_after_save
+
+    stream.delete()
+    assert get_pipeline().incoming.streams == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pipeline_invalidated_after_commit(pipeline_settings):
+    """A rebuild during the saving transaction would still see the old
+    configuration. Pipelines should only be invalidated once it commits"""
+    stream = StreamFactory()
+    pipeline = get_pipeline()
+
+    with transaction.atomic():
+        stream.name = "a_new_name"
+        stream.save()
+        assert get_pipeline() is pipeline
+    assert get_pipeline().incoming.streams[0].name == "a_new_name"
+
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            stream.delete()
+            raise ValueError("roll back")
+    assert get_pipeline().incoming.streams[0].name == "a_new_name"
+
+
+@pytest.mark.django_db
+def test_pipeline_invalidated_by_other_process(pipeline_settings):
+    """Another process changing the version stamp should cause a rebuild"""
+    StreamFactory()
+    pipeline = get_pipeline()
+
+    cache.set(PIPELINE_VERSION_CACHE_KEY, "changed_elsewhere", timeout=None)
+    assert get_pipeline() is not pipeline
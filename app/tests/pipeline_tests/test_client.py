@@ -0,0 +1,15 @@
+from anonapi.objects import RemoteAnonServer
+
+from idis.pipeline.client import PooledAnonClientTool
+
+
+def test_pooled_client_tool_shares_session():
+    """All calls to a server should go through the same session"""
+    tool = PooledAnonClientTool(username="user", token="token", pool_size=4)
+    server = RemoteAnonServer(name="p01", url="https://p01")
+
+    client = tool.get_client(server.url)
+    assert client is tool.get_client(server.url)
+    assert client.requestslib is tool.session
+    assert tool.get_client("https://p02").requestslib is tool.session
+    assert tool.session.get_adapter("https://p01")._pool_maxsize == 4
@@ -0,0 +1,88 @@
+from unittest.mock import Mock
+
+import pytest
+from anonapi.client import ServerNotResponding
+from anonapi.objects import RemoteAnonServer
+from idissend.core import PushStudyCallbackException
+
+from idis.pipeline.dispatch import ServerDispatcher, is_unreachable
+
+
+@pytest.fixture
+def a_dispatcher():
+    """Dispatcher for servers p01 and p02, with a client tool that says all
+    servers are OK"""
+    client_tool = Mock()
+    client_tool.get_server_status.return_value = "OK: online"
+    return ServerDispatcher(
+        servers=[
+            RemoteAnonServer(name="p01", url="https://p01"),
+            RemoteAnonServer(name="p02", url="https://p02"),
+        ],
+        client_tool=client_tool,
+        retry_interval=10,
+        max_retry_interval=30,
+    )
+
+
+def test_choose_by_queue_depth(a_dispatcher):
+    a_dispatcher.set_queue_depths({"p01": 3})
+
+    chosen = [a_dispatcher.choose().name for _ in range(5)]
+
+    assert chosen.count("p02") == 4
+
+
+def test_choose_by_latency(a_dispatcher):
+    a_dispatcher.record_success("p01", latency=1.0)
+    a_dispatcher.record_success("p02", latency=0.25)
+
+    chosen = [a_dispatcher.choose().name for _ in range(5)]
+
+    assert chosen.count("p02") == 4
+
+
+def test_max_in_flight(a_dispatcher):
+    a_dispatcher.max_in_flight = 2
+    a_dispatcher.set_queue_depths({"p01": 2})
+
+    assert a_dispatcher.choose().name == "p02"
+    assert a_dispatcher.choose().name == "p02"
+    assert a_dispatcher.choose() is None
+
+
+def test_failed_server(a_dispatcher):
+    """A failed server should be left alone for a while, then checked"""
+    a_dispatcher.set_queue_depths({"p02": 100})
+    a_dispatcher.record_failure("p01", now=1000)
+
+    assert a_dispatcher.choose(now=1005).name == "p02"
+    assert a_dispatcher.choose(now=1005, exclude=["p02"]) is None
+    a_dispatcher.client_tool.get_server_status.assert_not_called()
+
+    a_dispatcher.client_tool.get_server_status.return_value = "Server down"
+    assert a_dispatcher.choose(now=1011).name == "p02"
+    assert a_dispatcher.stats["p01"].retry_after == 1011 + 20  # doubled
+
+    a_dispatcher.client_tool.get_server_status.return_value = "OK: online"
+    assert a_dispatcher.choose(now=1031).name == "p01"
+    assert a_dispatcher.stats["p01"].failures == 0
+
+
+def test_retry_interval_is_capped(a_dispatcher):
+    for _ in range(10):
+        a_dispatcher.record_failure("p01", now=0)
+
+    assert a_dispatcher.stats["p01"].retry_after == 30
+
+
+def test_is_unreachable():
+    try:
+        try:
+            raise ServerNotResponding("no response")
+        except ServerNotResponding as e:
+            raise PushStudyCallbackException(e)
+    except PushStudyCallbackException as e:
+        assert is_unreachable(e)
+
+    assert not is_unreachable(PushStudyCallbackException("Server says no"))
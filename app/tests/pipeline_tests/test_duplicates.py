@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+from idissend.core import Study
+
+from idis.pipeline.duplicates import DuplicateFilter
+from idis.pipeline.models import SeenInstance
+from idis.pipeline.stages import IndexedCoolDown
+from tests.factories import StreamFactory
+from tests.pipeline_tests import write_dicom
+
+
+@pytest.fixture
+def a_stage(tmpdir):
+    """Incoming stage with a duplicate filter and no cool down"""
+    stage = IndexedCoolDown(
+        name="incoming",
+        path=Path(tmpdir),
+        streams=[StreamFactory()],
+        cool_down=0,
+        duplicate_filter=DuplicateFilter(),
+    )
+    stage.assert_all_paths()
+    return stage
+
+
+def add_study(stage, study_id, sop_uids):
+    path = stage.get_path_for_stream(stage.streams[0]) / study_id
+    path.mkdir()
+    for uid in sop_uids:
+        write_dicom(path / uid, study_uid="1.1", sop_uid=uid)
+    return Study(study_id=study_id, stream=stage.streams[0], stage=stage)
+
+
+@pytest.mark.django_db
+def test_drop_duplicates(a_stage):
+    add_study(a_stage, "first", ["2.1", "2.2"])
+    assert [x.study_id for x in a_stage.get_all_cooled_studies()] == ["first"]
+
+    add_study(a_stage, "resent", ["2.1", "2.2"])
+    add_study(a_stage, "partly_new", ["2.2", "2.3"])
+    (
+        a_stage.get_path_for_stream(a_stage.streams[0]) / "resent" / "notes"
+    ).write_text("text")
+
+    cooled = {x.study_id: x for x in a_stage.get_all_cooled_studies()}
+
+    assert sorted(cooled) == ["first", "partly_new", "resent"]
+    assert [x.name for x in cooled["partly_new"].get_path().iterdir()] == [
+        "2.3"
+    ]
+    assert [x.name for x in cooled["resent"].get_path().iterdir()] == [
+        "notes"
+    ]  # not DICOM, always kept
+    assert SeenInstance.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_fully_duplicate_study_is_removed(a_stage):
+    add_study(a_stage, "first", ["2.1"])
+    a_stage.get_all_cooled_studies()
+    duplicate = add_study(a_stage, "resent", ["2.1"])
+
+    assert not a_stage.remove_duplicates(duplicate)
+    assert not duplicate.get_path().exists()
+
+
+@pytest.mark.django_db
+def test_changed_content_is_kept(a_stage):
+    """Same uid with different content might be a correction"""
+    first = add_study(a_stage, "first", ["2.1"])
+    a_stage.remove_duplicates(first)
+    corrected = add_study(a_stage, "corrected", [])
+    write_dicom(
+        corrected.get_path() / "2.1",
+        study_uid="1.1",
+        sop_uid="2.1",
+        PatientName="Corrected",
+    )
+
+    assert a_stage.remove_duplicates(corrected)
+    assert SeenInstance.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_eviction(a_stage):
+    a_stage.duplicate_filter.ttl = a_stage.duplicate_filter.ttl * 0
+    first = add_study(a_stage, "first", ["2.1"])
+    a_stage.remove_duplicates(first)
+
+    a_stage.duplicate_filter.evict()
+
+    assert not SeenInstance.objects.exists()
@@ -0,0 +1,97 @@
+from pathlib import Path
+
+import pytest
+
+from idis.pipeline.grouping import group_loose_files, read_instance
+from idis.pipeline.models import IndexedInstance
+from idis.pipeline.stages import GroupingCoolDown
+from tests.factories import StreamFactory
+from tests.pipeline_tests import write_dicom
+
+
+def test_read_instance(tmpdir):
+    write_dicom(Path(tmpdir) / "file", study_uid="1.2", sop_uid="1.2.3")
+    (Path(tmpdir) / "not_dicom").write_text("just text")
+
+    instance = read_instance(Path(tmpdir) / "file")
+    assert instance.study_instance_uid == "1.2"
+    assert instance.file_name == "1.2.3.dcm"
+    assert read_instance(Path(tmpdir) / "not_dicom") is None
+
+
+@pytest.mark.django_db
+def test_group_loose_files(tmpdir):
+    stream = StreamFactory()
+    folder = Path(tmpdir)
+    for i in range(6):
+        write_dicom(
+            folder / f"IMG{i}", study_uid=f"1.{i % 2}", sop_uid=f"2.{i}"
+        )
+    write_dicom(folder / "new", study_uid="1.9", sop_uid="2.9", age=0)
+    (folder / "not_dicom").write_text("just text")
+
+    moved = group_loose_files(stream, folder, min_age=10, max_workers=3)
+
+    assert len(moved) == 6
+    assert sorted(x.name for x in folder.iterdir()) == [
+        "1.0",
+        "1.1",
+        "new",
+        "not_dicom",
+    ]
+    assert sorted(x.name for x in (folder / "1.1").iterdir()) == [
+        "2.1.dcm",
+        "2.3.dcm",
+        "2.5.dcm",
+    ]
+    assert IndexedInstance.objects.filter(study_id="1.0").count() == 3
+
+
+@pytest.mark.django_db
+def test_group_loose_files_same_sop_uid(tmpdir):
+    """A resent copy of a file replaces the earlier one. A different file with
+    the same SOPInstanceUID should not overwrite it"""
+    stream = StreamFactory()
+    folder = Path(tmpdir)
+    write_dicom(folder / "IMG1", study_uid="1.1", sop_uid="2.1")
+    group_loose_files(stream, folder, min_age=10)
+    write_dicom(folder / "IMG1", study_uid="1.1", sop_uid="2.1")
+    group_loose_files(stream, folder, min_age=10)
+    assert [x.name for x in (folder / "1.1").iterdir()] == ["2.1.dcm"]
+
+    write_dicom(
+        folder / "IMG2", study_uid="1.1", sop_uid="2.1", PatientID="other"
+    )
+    moved = group_loose_files(stream, folder, min_age=10)
+
+    assert [x.path.name for x in moved] == ["2.1_1.dcm"]
+    assert sorted(x.name for x in (folder / "1.1").iterdir()) == [
+        "2.1.dcm",
+        "2.1_1.dcm",
+    ]
+    assert sorted(
+        IndexedInstance.objects.values_list("file_name", flat=True)
+    ) == ["2.1.dcm", "2.1_1.dcm"]
+
+
+@pytest.mark.django_db
+def test_grouping_cool_down(tmpdir):
+    """Grouped studies should cool down like any other study"""
+    stage = GroupingCoolDown(
+        name="incoming",
+        path=Path(tmpdir),
+        streams=[StreamFactory()],
+        cool_down=0,
+    )
+    stage.assert_all_paths()
+    folder = stage.get_path_for_stream(stage.streams[0])
+    write_dicom(folder / "IMG1", study_uid="1.1", sop_uid="2.1")
+    write_dicom(folder / "IMG2", study_uid="1.1", sop_uid="2.2")
+
+    assert [x.study_id for x in stage.get_all_cooled_studies()] == ["1.1"]
+
+    (folder / "1.1" / "2.1.dcm").unlink()
+    (folder / "1.1" / "2.2.dcm").unlink()
+    (folder / "1.1").rmdir()
+    stage.get_all_cooled_studies()
+    assert not IndexedInstance.objects.exists()
@@ -0,0 +1,74 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from idis.pipeline.coordination import get_coordinator, get_coordinator_for_url
+from idis.pipeline.purge import TrashPurger, idle_io_priority
+from idis.pipeline.tasks import get_trash_path, purge_trash, settings
+
+
+@pytest.fixture
+def a_trash(tmpdir):
+    """Trash folder with one stream holding two studies of 5 files of 100
+    bytes"""
+    path = Path(tmpdir) / "stages" / "trash"
+    for study in ("study1", "study2"):
+        folder = path / "stream1" / study / "series"
+        folder.mkdir(parents=True)
+        for i in range(5):
+            (folder / f"file{i}").write_bytes(b"x" * 100)
+    return path
+
+
+def test_purge(a_trash):
+    result = TrashPurger(a_trash).purge()
+
+    assert result.complete
+    assert (result.files, result.bytes) == (10, 1000)
+    assert [x.name for x in a_trash.iterdir()] == ["stream1"]
+    assert not list((a_trash / "stream1").iterdir())
+
+
+def test_purge_rate_limited(a_trash):
+    start = time.monotonic()
+    result = TrashPurger(a_trash, files_per_second=50).purge()
+
+    assert result.complete
+    assert time.monotonic() - start >= 9 / 50
+
+
+def test_purge_resumes(a_trash):
+    """A purge that is stopped should leave the rest for the next one"""
+    purger = TrashPurger(a_trash, bytes_per_second=2000)
+
+    first = purger.purge(max_duration=0.2)
+    assert not first.complete
+    assert 0 < first.files < 10
+
+    second = purger.purge()
+    assert second.complete
+    assert first.files + second.files == 10
+
+
+def test_purge_stops_on_request(a_trash):
+    result = TrashPurger(a_trash).purge(should_stop=lambda: True)
+
+    assert not result.complete
+    assert result.files == 0
+
+
+def test_idle_io_priority():
+    with idle_io_priority() as idle:
+        assert idle in (True, False)
+
+
+def test_purge_trash_task(a_trash, monkeypatch):
+    get_coordinator_for_url.cache_clear()
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", a_trash.parent.parent)
+    assert get_trash_path() == a_trash
+
+    purge_trash()
+
+    assert get_coordinator().get_values()["trash_reclaimed_bytes"] == 1000
+    get_coordinator_for_url.cache_clear()
@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from shutil import copyfile
+
+import pytest
+from anonapi.testresources import MockAnonClientTool
+from idissend.persistence import IDISSendRecords, get_db_sessionmaker
+from sqlalchemy.exc import SQLAlchemyError
+
+from idis.pipeline.models import IDISJobRecord
+from idis.pipeline.records import DjangoRecords, import_records
+from idis.pipeline.building import init_pipeline, settings
+from tests.factories import StreamFactory
+from tests.pipeline_tests import RESOURCE_PATH
+
+
+@pytest.mark.django_db
+def test_django_records_session():
+    """Writes should only hit the database when the session closes"""
+    records = DjangoRecords()
+    with records.get_session() as session:
+        session.add(study_id="study1", job_id=1, server_name="p01")
+        session.add(study_id="study2", job_id=2, server_name="p01")
+        assert not IDISJobRecord.objects.exists()
+    assert IDISJobRecord.objects.count() == 2
+
+    with records.get_session() as session:
+        record = session.get_for_study_id("study1")
+    record.last_status = "DONE"
+    record.last_check = datetime.now()  # naive, like idissend does
+    with records.get_session() as session:
+        session.add_record(record)
+        session.delete(session.get_for_job_id(2))
+
+    with records.get_session() as session:
+        assert [x.last_status for x in session.get_all()] == ["DONE"]
+
+
+@pytest.mark.django_db
+def test_django_records_error():
+    """Database errors should look like errors from idissend records"""
+    records = DjangoRecords()
+    with records.get_session() as session:
+        session.add(study_id="study1", job_id=1, server_name="p01")
+
+    with pytest.raises(SQLAlchemyError):
+        with records.get_session() as session:
+            session.add(study_id="study2", job_id=1, server_name="p01")
+
+
+@pytest.mark.django_db
+def test_import_records(tmpdir):
+    """Records from an old sqlite file should be copied once"""
+    db_url = f"sqlite:///{Path(tmpdir) / 'records_db.sqlite'}"
+    sqlite_records = IDISSendRecords(session_maker=get_db_sessionmaker(db_url))
+    with sqlite_records.get_session() as session:
+        session.add(study_id="study1", job_id=1, server_name="p01")
+        session.add(
+            study_id="study2",
+            job_id=2,
+            server_name="p01",
+            last_check=datetime.now(),
+        )
+
+    assert import_records(db_url) == 2
+    assert import_records(db_url) == 0
+    assert IDISJobRecord.objects.get(job_id=2).last_check is not None
+
+
+@pytest.mark.django_db
+def test_pipeline_with_django_records(monkeypatch, tmpdir):
+    """Pending stage should work unchanged with records in django"""
+    StreamFactory()
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr(settings, "PIPELINE_RECORDS_DB_URL", "django://")
+    pipeline = init_pipeline()
+    pipeline.pending.idis_connection.client_tool = MockAnonClientTool()
+    pipeline.assert_all_paths()
+
+    study_path = (
+        pipeline.incoming.get_path_for_stream(pipeline.incoming.streams[0])
+        / "a_study"
+    )
+    study_path.mkdir()
+    copyfile(RESOURCE_PATH / "a_dicom_file", study_path / "a_dicom_file")
+    os.utime(study_path / "a_dicom_file", (0, 0))
+    pipeline.run_once()
+    assert IDISJobRecord.objects.count() == 1
+
+    pipeline.run_once()  # checks status of pending job
+    assert IDISJobRecord.objects.get().last_check is not None
@@ -0,0 +1,171 @@
+import time
+from pathlib import Path
+from shutil import copyfile
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from idis.pipeline.coordination import (
+    check_lock_url,
+    get_coordinator,
+    get_coordinator_for_url,
+)
+from idis.pipeline.scheduling import WATCHER_SEEN, AdaptiveSchedule
+from idis.pipeline.building import get_pipeline
+from idis.pipeline.tasks import (
+    PIPELINE_LOCK_NAME,
+    run_pipeline_once,
+    settings,
+)
+from tests.factories import StreamFactory
+from tests.pipeline_tests import RESOURCE_PATH
+
+
+@pytest.fixture(autouse=True)
+def fresh_coordinator():
+    """Do not share locks and statistics between tests"""
+    get_coordinator_for_url.cache_clear()
+    yield
+    get_coordinator_for_url.cache_clear()
+
+
+@pytest.fixture
+def pipeline_settings(monkeypatch, tmpdir):
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr(settings, "PIPELINE_RECORDS_DB_URL", "sqlite://")
+
+
+@pytest.fixture
+def apply_async(mocker):
+    return mocker.patch.object(run_pipeline_once, "apply_async")
+
+
+@pytest.mark.django_db
+def test_run_skipped_when_locked(pipeline_settings, apply_async):
+    """A run should not start while another run holds the lock"""
+    StreamFactory()
+    lock = get_coordinator().get_lock(PIPELINE_LOCK_NAME, timeout=10)
+    lock.acquire()
+    run_pipeline_once()
+    lock.release()
+
+    assert get_coordinator().get_values() == {"skipped": 1}
+
+    run_pipeline_once()
+    assert get_coordinator().get_values()["runs"] == 1
+
+
+@pytest.fixture
+def watcher_running():
+    get_coordinator().set_value(WATCHER_SEEN, time.time())
+
+
+@pytest.mark.django_db
+def test_back_off_when_idle(pipeline_settings, apply_async, watcher_running):
+    """An empty pipeline should skip scheduled runs, but not reruns"""
+    StreamFactory()
+    run_pipeline_once()
+    run_pipeline_once()
+    values = get_coordinator().get_values()
+    assert values["runs"] == 1
+    assert values["idle_skips"] == 1
+    assert values["idle_backoff"] == settings.PIPELINE_RUN_INTERVAL
+
+    run_pipeline_once(rerun=True)
+    assert get_coordinator().get_values()["runs"] == 2
+    assert not apply_async.called
+
+
+@pytest.mark.django_db
+def test_no_back_off_without_watcher(pipeline_settings, apply_async):
+    """Without the incoming watcher, new studies are only found by scheduled
+    runs. These should not be skipped"""
+    StreamFactory()
+    run_pipeline_once()
+    run_pipeline_once()
+    values = get_coordinator().get_values()
+    assert values["runs"] == 2
+    assert "idle_skips" not in values
+
+
+@pytest.mark.django_db
+def test_schedule_uses_run_results(pipeline_settings, mocker):
+    """Deciding what to do next should not scan the stages again"""
+    StreamFactory()
+    pipeline = get_pipeline()
+    pipeline.assert_all_paths()
+    pipeline.run_once()
+    for stage in (pipeline.incoming, pipeline.cooled_down, pipeline.pending):
+        mocker.patch.object(
+            stage, "get_all_studies", side_effect=AssertionError
+        )
+    mocker.patch.object(
+        pipeline.incoming, "get_all_cooled_studies", side_effect=AssertionError
+    )
+    schedule = AdaptiveSchedule(
+        get_coordinator(),
+        interval=30,
+        max_idle_backoff=100,
+        max_reruns_in_a_row=3,
+        watcher_timeout=10,
+    )
+    get_coordinator().set_value(WATCHER_SEEN, 0)
+    assert schedule.update(pipeline, now=0) is False
+    assert get_coordinator().get_values()["idle_backoff"] == 30
+
+
+def test_check_lock_url():
+    check_lock_url("redis://redis:6379/0")
+    check_lock_url("memory://")
+    with pytest.raises(ImproperlyConfigured, match="CELERY_BROKER_URL"):
+        check_lock_url("sqs://")
+
+
+@pytest.mark.django_db
+def test_rerun_when_work_left(pipeline_settings, apply_async, mocker):
+    """A run that leaves work should queue the next run right away, but not
+    forever"""
+    StreamFactory()
+    mocker.patch("idis.pipeline.scheduling.has_work", return_value=True)
+    for _ in range(settings.PIPELINE_MAX_IMMEDIATE_RERUNS + 1):
+        run_pipeline_once()
+
+    assert apply_async.call_count == settings.PIPELINE_MAX_IMMEDIATE_RERUNS
+    assert apply_async.call_args.kwargs == {"kwargs": {"rerun": True}}
+
+
+@pytest.mark.django_db
+def test_schedule_backoff_and_reset(pipeline_settings):
+    """Back off doubles up to max while idle, and resets on new data"""
+    StreamFactory()
+    pipeline = get_pipeline()
+    pipeline.assert_all_paths()
+    schedule = AdaptiveSchedule(
+        get_coordinator(),
+        interval=30,
+        max_idle_backoff=100,
+        max_reruns_in_a_row=3,
+        watcher_timeout=10,
+    )
+    get_coordinator().set_value(WATCHER_SEEN, 0)
+
+    pipeline.run_once()
+    backoffs = []
+    for _ in range(4):
+        schedule.update(pipeline, now=0)
+        backoffs.append(get_coordinator().get_values()["idle_backoff"])
+    assert backoffs == [30, 60, 100, 100]
+    assert not schedule.is_due(now=99)
+    assert schedule.is_due(now=100)
+
+    # a study comes in. Not idle anymore
+    incoming_path = pipeline.incoming.get_path_for_stream(
+        pipeline.incoming.streams[0]
+    )
+    (incoming_path / "a_study").mkdir()
+    copyfile(
+        RESOURCE_PATH / "a_dicom_file", incoming_path / "a_study" / "file"
+    )
+    pipeline.run_once()
+    assert schedule.update(pipeline, now=0) is False
+    assert schedule.is_due(now=0)
@@ -0,0 +1,326 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import count
+from pathlib import Path
+
+import pytest
+from anonapi.client import ServerNotResponding
+from anonapi.exceptions import AnonAPIException
+from anonapi.objects import RemoteAnonServer
+from anonapi.responses import JobsInfoList
+from anonapi.testresources import JobInfoFactory, MockAnonClientTool
+from django.utils import timezone
+from idissend.core import Stage, StudyPushException
+from idissend.persistence import IDISSendRecords, get_memory_only_sessionmaker
+from idissend.stages import IDISConnection
+
+from idis.pipeline import stages
+from idis.pipeline.models import IDISJobRecord, IndexedStudy
+from idis.pipeline.dispatch import ServerDispatcher
+from idis.pipeline.records import DjangoRecords
+from idis.pipeline.stages import BatchedPendingAnon, IndexedCoolDown
+from tests.factories import StreamFactory
+
+
+@pytest.fixture
+def a_stage(tmpdir):
+    stage = IndexedCoolDown(
+        name="incoming",
+        path=Path(tmpdir),
+        streams=[StreamFactory(), StreamFactory()],
+        cool_down=5,
+    )
+    stage.assert_all_paths()
+    return stage
+
+
+def add_study(stage, study_id, age_minutes, stream_index=0):
+    path = stage.get_path_for_stream(stage.streams[stream_index]) / study_id
+    path.mkdir()
+    mtime = time.time() - age_minutes * 60
+    for name in ("file1", "file2"):
+        (path / name).write_text("content")
+        os.utime(path / name, (mtime, mtime))
+    return path
+
+
+@pytest.mark.django_db
+def test_indexed_cool_down(a_stage):
+    """Only studies that have cooled down should be returned"""
+    add_study(a_stage, "old", age_minutes=10)
+    add_study(a_stage, "new", age_minutes=1)
+    add_study(a_stage, "other_stream", age_minutes=10, stream_index=1)
+
+    cooled = a_stage.get_all_cooled_studies()
+    assert sorted(x.study_id for x in cooled) == ["old", "other_stream"]
+    assert IndexedStudy.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_indexed_cool_down_ignores_loose_files(a_stage):
+    """A file directly in a stream folder is not a study, and should not be
+    pushed on, however fresh it is"""
+    folder = a_stage.get_path_for_stream(a_stage.streams[0])
+    (folder / "loose_file").write_text("still being written")
+
+    assert a_stage.get_all_cooled_studies() == []
+    assert not IndexedStudy.objects.exists()
+    assert (folder / "loose_file").exists()
+
+
+@pytest.mark.django_db
+def test_indexed_cool_down_only_looks_at_candidates(a_stage, mocker):
+    """Studies that are indexed and not due should not be looked at"""
+    add_study(a_stage, "new", age_minutes=1)
+    a_stage.get_all_cooled_studies()
+
+    spy = mocker.spy(stages, "get_newest_file_mtime")
+    assert a_stage.get_all_cooled_studies() == []
+    assert spy.call_count == 0
+
+
+@pytest.mark.django_db
+def test_indexed_cool_down_late_writes(a_stage):
+    """A study written to after indexing should not be returned early, and
+    studies that leave should leave the index"""
+    path = add_study(a_stage, "study", age_minutes=1)
+    a_stage.get_all_cooled_studies()
+
+    # index says study is due, but a file has just been written
+    IndexedStudy.objects.update(newest_mtime=0)
+    (path / "file3").write_text("late")
+    assert a_stage.get_all_cooled_studies() == []
+    assert IndexedStudy.objects.get().newest_mtime > 0
+
+    for file in path.iterdir():
+        file.unlink()
+    path.rmdir()
+    a_stage.get_all_cooled_studies()
+    assert not IndexedStudy.objects.exists()
+
+
+class SlowMockAnonClientTool(MockAnonClientTool):
+    """Takes latency seconds to create each job. Records the highest number of
+    calls running at the same time. Fails for studies starting with 'fail'
+    and for servers in down
+    """
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.job_ids = count(1)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.down = set()  # names of servers that do not respond
+
+    def create_path_job(self, server, project_name, source_path, *_, **__):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.latency)
+        with self.lock:
+            self.running -= 1
+            job_id = next(self.job_ids)
+        if Path(source_path).name.startswith("fail"):
+            raise AnonAPIException("Server says no")
+        if server.name in self.down:
+            raise ServerNotResponding(f"{server} is down")
+        return JobInfoFactory(job_id=job_id)
+
+    def get_job_info_list(self, server, job_ids, get_extended_info=False):
+        return JobsInfoList([JobInfoFactory(job_id=x) for x in job_ids])
+
+
+@pytest.fixture
+def batched_stages(tmpdir):
+    """A cooled_down stage and a BatchedPendingAnon stage that takes 50ms for
+    each IDIS call"""
+    stream = StreamFactory()
+    cooled_down = Stage(
+        name="cooled_down", path=Path(tmpdir) / "cooled", streams=[stream]
+    )
+    pending = BatchedPendingAnon(
+        name="pending",
+        path=Path(tmpdir) / "pending",
+        streams=[stream],
+        idis_connection=IDISConnection(
+            client_tool=SlowMockAnonClientTool(latency=0.05),
+            servers=[RemoteAnonServer(name="p01", url="https://p01")],
+        ),
+        records=DjangoRecords(),
+        max_concurrent=5,
+    )
+    return cooled_down, pending
+
+
+def add_studies(stage, study_ids):
+    for study_id in study_ids:
+        path = stage.get_path_for_stream(stage.streams[0]) / study_id
+        path.mkdir(parents=True)
+        (path / "file").write_text("content")
+
+
+@pytest.mark.django_db
+def test_batched_pending_anon(batched_stages):
+    """Jobs should be created concurrently, up to the limit"""
+    cooled_down, pending = batched_stages
+    add_studies(cooled_down, [f"study{x}" for x in range(20)])
+
+    start = time.monotonic()
+    pushed = pending.push_studies(cooled_down.get_all_studies())
+    elapsed = time.monotonic() - start
+
+    assert len(pushed) == 20
+    assert IDISJobRecord.objects.count() == 20
+    assert pending.idis_client_tool().max_running == 5
+    assert elapsed < 20 * 0.05 / 2
+
+
+@pytest.mark.django_db
+def test_batched_pending_anon_failure(batched_stages):
+    """A failing study should be rolled back without affecting others"""
+    cooled_down, pending = batched_stages
+    add_studies(cooled_down, ["study1", "fail_study", "study2"])
+
+    with pytest.raises(StudyPushException) as e:
+        pending.push_studies(cooled_down.get_all_studies())
+
+    assert "fail_study" in str(e.value)
+    assert [x.study_id for x in cooled_down.get_all_studies()] == [
+        "fail_study"
+    ]
+    assert sorted(
+        IDISJobRecord.objects.values_list("study_id", flat=True)
+    ) == ["study1", "study2"]
+
+
+@pytest.mark.django_db
+def test_batched_pending_anon_failover(batched_stages):
+    """Jobs should be spread over servers, and go elsewhere when a server is
+    down"""
+    cooled_down, pending = batched_stages
+    client_tool = pending.idis_client_tool()
+    servers = [
+        RemoteAnonServer(name=name, url=f"https://{name}")
+        for name in ("p01", "p02", "p03")
+    ]
+    pending.idis_connection.servers = servers
+    pending.dispatcher = ServerDispatcher(servers, client_tool)
+    client_tool.down.add("p02")
+    add_studies(cooled_down, [f"study{x}" for x in range(12)])
+
+    pushed = pending.push_studies(cooled_down.get_all_studies())
+
+    assert len(pushed) == 12
+    server_names = list(
+        IDISJobRecord.objects.values_list("server_name", flat=True)
+    )
+    assert "p02" not in server_names
+    assert server_names.count("p01") == server_names.count("p03") == 6
+    assert pending.dispatcher.stats["p02"].failures > 0
+
+
+@pytest.mark.django_db
+def test_batched_pending_anon_stream_limit(batched_stages):
+    """Studies over the stream limit should be held back, not failed"""
+    cooled_down, pending = batched_stages
+    pending.streams[0].max_in_flight = 3
+    add_studies(cooled_down, [f"study{x}" for x in range(5)])
+
+    assert len(pending.push_studies(cooled_down.get_all_studies())) == 3
+    assert len(cooled_down.get_all_studies()) == 2
+    assert len(pending.held_back) == 2
+
+    assert pending.push_studies(cooled_down.get_all_studies()) == []
+    assert pending.get_longest_wait() > 0
+
+    pending.streams[0].max_in_flight = 0  # no limit
+    assert len(pending.push_studies(cooled_down.get_all_studies())) == 2
+    assert pending.held_back == {}
+
+
+@pytest.mark.django_db
+def test_batched_pending_anon_server_limit(batched_stages):
+    """Studies should be held back when all servers are full"""
+    cooled_down, pending = batched_stages
+    servers = pending.idis_connection.servers
+    pending.dispatcher = ServerDispatcher(
+        servers, pending.idis_client_tool(), max_in_flight=4
+    )
+    add_studies(cooled_down, [f"study{x}" for x in range(6)])
+
+    assert len(pending.push_studies(cooled_down.get_all_studies())) == 4
+    assert len(pending.held_back) == 2
+    assert pending.dispatcher.get_queue_depths() == {"p01": 4}
+
+
+@pytest.mark.django_db
+def test_status_polling_backs_off(batched_stages, mocker):
+    """Jobs running for long should be checked less often. All jobs on a
+    server should be checked with a single call"""
+    cooled_down, pending = batched_stages
+    add_studies(cooled_down, ["new", "old", "old_checked"])
+    pending.push_studies(cooled_down.get_all_studies())
+
+    now = timezone.now()
+    IDISJobRecord.objects.filter(study_id__startswith="old").update(
+        created=now - timedelta(hours=2)
+    )
+    IDISJobRecord.objects.filter(study_id="old_checked").update(
+        last_status="ACTIVE", last_check=now - timedelta(minutes=1)
+    )
+    IDISJobRecord.objects.filter(study_id="old").update(
+        last_status="ACTIVE", last_check=now - timedelta(minutes=10)
+    )
+    get_job_info_list = mocker.spy(
+        pending.idis_client_tool(), "get_job_info_list"
+    )
+
+    updated = dict(
+        (study.study_id, record.last_status)
+        for study, record in pending.update_records(pending.get_all_studies())
+    )
+
+    assert get_job_info_list.call_count == 1
+    checked = get_job_info_list.call_args.kwargs["job_ids"]
+    assert sorted(checked) == sorted(
+        IDISJobRecord.objects.exclude(study_id="old_checked").values_list(
+            "job_id", flat=True
+        )
+    )
+    assert updated["old_checked"] == "ACTIVE"  # from record, not from IDIS
+    assert IDISJobRecord.objects.get(study_id="new").last_check is not None
+
+
+@pytest.mark.django_db
+def test_status_polling_backs_off_without_created(batched_stages, mocker):
+    """The default idissend records do not keep when a job was created. The
+    time the study was moved in should be used instead"""
+    cooled_down, pending = batched_stages
+    pending.records = IDISSendRecords(
+        session_maker=get_memory_only_sessionmaker()
+    )
+    add_studies(cooled_down, ["new", "old"])
+    pending.push_studies(cooled_down.get_all_studies())
+
+    two_hours_ago = time.time() - 2 * 60 * 60
+    old_path = pending.get_path_for_stream(pending.streams[0]) / "old"
+    os.utime(old_path, (two_hours_ago, two_hours_ago))
+    with pending.records.get_session() as session:
+        for record in session.get_all():
+            record.last_status = "ACTIVE"
+            record.last_check = datetime.now() - timedelta(minutes=1)
+            session.add_record(record)
+    get_job_info_list = mocker.spy(
+        pending.idis_client_tool(), "get_job_info_list"
+    )
+
+    pending.update_records(pending.get_all_studies())
+
+    with pending.records.get_session() as session:
+        new_job_id = session.get_for_study_id("new").job_id
+    assert get_job_info_list.call_count == 1
+    assert get_job_info_list.call_args.kwargs["job_ids"] == [new_job_id]
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from shutil import copyfile
 from unittest.mock import Mock
@@ -6,7 +7,17 @@ import pytest
 from anonapi.testresources import MockAnonClientTool
 from idissend.pipeline import IDISPipeline
 
-from idis.pipeline.tasks import run_pipeline_once, init_pipeline, settings
+from idis.core.metrics import get_store
+from idis.pipeline.building import init_pipeline
+from idis.pipeline.metrics import record_stages
+from idis.pipeline.coordination import get_coordinator
+from idis.pipeline.tasks import (
+    STAGE_SIZES_LOCK_NAME,
+    record_stage_sizes,
+    run_pipeline_once,
+    run_stream_once,
+    settings,
+)
 from tests.factories import StreamFactory
 from tests.pipeline_tests import RESOURCE_PATH
 
@@ -65,10 +76,13 @@ def test_run_pipeline_with_django_objects(
     # run pipeline empty, for good measure
     pipeline.run_once()
 
-    # now insert a single file in one of the streams of in the incoming stage
+    # now insert a study with a single file in one of the streams of in the
+    # incoming stage
     a_stream = pipeline.incoming.streams[0]
-    incoming_path = pipeline.incoming.get_path_for_stream(a_stream)
-    copyfile(RESOURCE_PATH / "a_dicom_file", incoming_path / "a_dicom_file")
+    study_path = pipeline.incoming.get_path_for_stream(a_stream) / "a_study"
+    study_path.mkdir()
+    copyfile(RESOURCE_PATH / "a_dicom_file", study_path / "a_dicom_file")
+    os.utime(study_path / "a_dicom_file", (0, 0))
 
     # and run again
     pipeline.run_once()
@@ -80,3 +94,87 @@ def test_run_pipeline_with_django_objects(
     # recreates a bug with converting idis_profile object to string
     call_args = mock_client_tool.create_path_job.call_args.kwargs
     assert call_args["project_name"] == a_stream.idis_profile.title
+
+
+@pytest.mark.django_db
+def test_run_pipeline_per_stream(monkeypatch, mocker):
+    """In per stream mode, each stream gets its own task on its own queue"""
+    monkeypatch.setattr(settings, "PIPELINE_PER_STREAM", True)
+    apply_async = mocker.patch.object(run_stream_once, "apply_async")
+    a_stream = StreamFactory(queue="high_priority")
+    another_stream = StreamFactory()
+
+    run_pipeline_once()
+
+    calls = {
+        x.kwargs["kwargs"]["stream_pk"]: x.kwargs["queue"]
+        for x in apply_async.call_args_list
+    }
+    assert calls == {a_stream.pk: "high_priority", another_stream.pk: None}
+
+
+@pytest.mark.django_db
+def test_run_stream_once(monkeypatch, tmpdir, mocker):
+    """A stream run should only move studies in its own stream"""
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr(settings, "PIPELINE_RECORDS_DB_URL", "sqlite://")
+    mocker.patch.object(run_stream_once, "apply_async")
+    streams = [StreamFactory(), StreamFactory()]
+    pipeline = init_pipeline()
+    pipeline.assert_all_paths()
+    for stream in streams:
+        study_path = pipeline.incoming.get_path_for_stream(stream) / "study"
+        study_path.mkdir()
+        copyfile(RESOURCE_PATH / "a_dicom_file", study_path / "a_file")
+        os.utime(study_path / "a_file", (0, 0))
+
+    mocker.patch(
+        "idis.pipeline.building.PooledAnonClientTool",
+        return_value=MockAnonClientTool(),
+    )
+    run_stream_once(stream_pk=streams[0].pk)
+
+    def in_incoming(stream):
+        return (
+            pipeline.incoming.get_path_for_stream(stream) / "study"
+        ).exists()
+
+    assert not in_incoming(streams[0])
+    assert in_incoming(streams[1])
+
+
+@pytest.mark.django_db
+def test_record_stages(an_idis_pipeline):
+    """Number of studies and files per stage should be in metrics"""
+    pipeline = an_idis_pipeline
+    pipeline.incoming.assert_all_paths()
+    a_stream = pipeline.incoming.streams[0]
+    study_path = pipeline.incoming.get_path_for_stream(a_stream) / "a_study"
+    study_path.mkdir()
+    for name in ("file1", "file2"):
+        copyfile(RESOURCE_PATH / "a_dicom_file", study_path / name)
+
+    removed = 'idis_pipeline_studies{stage="incoming",stream="removed"}'
+    get_store().set_value(removed, 3)
+
+    record_stages(pipeline)
+
+    values = get_store().get_values()
+    labels = f'stage="incoming",stream="{a_stream.name}"'
+    assert values[f"idis_pipeline_studies{{{labels}}}"] == 1
+    assert values[f"idis_pipeline_files{{{labels}}}"] == 2
+    assert removed not in values
+
+
+@pytest.mark.django_db
+def test_record_stage_sizes(an_idis_pipeline, mocker):
+    """Stage sizes are counted by a task, and not twice at the same time"""
+    record = mocker.patch("idis.pipeline.metrics.record_stages")
+    record_stage_sizes()
+    assert record.call_count == 1
+
+    lock = get_coordinator().get_lock(STAGE_SIZES_LOCK_NAME, timeout=10)
+    lock.acquire()
+    record_stage_sizes()
+    lock.release()
+    assert record.call_count == 1
@@ -0,0 +1,97 @@
+import time
+from pathlib import Path
+from shutil import copyfile
+
+import pytest
+from anonapi.testresources import MockAnonClientTool
+
+from idis.pipeline.building import init_pipeline
+from idis.pipeline.tasks import push_incoming_study, settings
+from idis.pipeline.watcher import (
+    InotifyWatcher,
+    PollingWatcher,
+    StudyActivity,
+)
+from tests.factories import StreamFactory
+from tests.pipeline_tests import RESOURCE_PATH
+
+
+@pytest.fixture
+def a_pipeline(monkeypatch, tmpdir, mocker):
+    """A pipeline with a single stream, not talking to IDIS"""
+    StreamFactory()
+    monkeypatch.setattr(settings, "PIPELINE_BASE_PATH", Path(tmpdir))
+    monkeypatch.setattr(settings, "PIPELINE_RECORDS_DB_URL", "sqlite://")
+    mocker.patch(
+        "idis.pipeline.building.PooledAnonClientTool",
+        return_value=MockAnonClientTool(),
+    )
+    pipeline = init_pipeline()
+    pipeline.assert_all_paths()
+    return pipeline
+
+
+def add_file(pipeline, study_id, name="a_file"):
+    stream = pipeline.incoming.streams[0]
+    study_path = pipeline.incoming.get_path_for_stream(stream) / study_id
+    study_path.mkdir(exist_ok=True)
+    copyfile(RESOURCE_PATH / "a_dicom_file", study_path / name)
+    return stream, study_id
+
+
+def test_study_activity():
+    """Studies are handed out once, unless written to again"""
+    activity = StudyActivity()
+    activity.touch("a", when=10)
+    activity.touch("b", when=15)
+
+    assert activity.pop_quiet(quiet_period=10, now=20) == ["a"]
+    assert activity.pop_quiet(quiet_period=10, now=30) == ["b"]
+    assert activity.pop_quiet(quiet_period=10, now=40) == []
+
+    activity.touch("a", when=10)  # seen before
+    assert len(activity) == 0
+    activity.touch("a", when=35)
+    assert activity.pop_quiet(quiet_period=10, now=50) == ["a"]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("watcher_class", [InotifyWatcher, PollingWatcher])
+def test_watcher(a_pipeline, watcher_class):
+    """Writes to a study should be recorded, without handing out early"""
+    activity = StudyActivity()
+    watcher = watcher_class(a_pipeline.incoming, activity)
+    try:
+        key = add_file(a_pipeline, "study1")
+        watcher.wait(timeout=1)
+        assert key in activity.last_write
+
+        written = activity.last_write[key]
+        assert activity.pop_quiet(quiet_period=60, now=written + 1) == []
+        assert activity.pop_quiet(quiet_period=60, now=written + 60) == [key]
+
+        # another file in the same study makes it active again
+        time.sleep(0.01)
+        add_file(a_pipeline, "study1", name="another_file")
+        watcher.wait(timeout=1)
+        assert key in activity.last_write
+    finally:
+        watcher.close()
+
+
+@pytest.mark.django_db
+def test_push_incoming_study(a_pipeline):
+    """Only the given study should be pushed, all the way to pending"""
+    stream, _ = add_file(a_pipeline, "study1")
+    add_file(a_pipeline, "study2")
+
+    push_incoming_study(stream_pk=stream.pk, study_id="study1")
+
+    assert [x.study_id for x in a_pipeline.incoming.get_all_studies()] == [
+        "study2"
+    ]
+    pending = a_pipeline.pending.get_all_studies()
+    assert [x.study_id.startswith("study1_") for x in pending] == [True]
+
+    # a study that has already been picked up is ignored
+    push_incoming_study(stream_pk=stream.pk, study_id="study1")
@@ -15,6 +15,9 @@ EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
 
 CELERY_BROKER = "memory"
 CELERY_BROKER_URL = "memory://"
+PIPELINE_LOCK_URL = "memory://"
+METRICS_URL = "memory://"
+PROFILING_URL = "memory://"
 
 # Disable debugging in tests
 DEBUG = False
@@ -23,3 +26,8 @@ DEBUG_LOGGING = False
 
 # Disable non-critical logging in tests
 logging.disable(logging.CRITICAL)
+
+# Do not depend on a running memcached server
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}